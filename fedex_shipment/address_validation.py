@@ -0,0 +1,228 @@
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+import re
+
+import frappe
+from frappe.utils import cint, cstr, now_datetime
+
+from fedex.services.address_validation_service import FedexAddressValidationRequest
+
+import fedex_config
+import client_pool
+import api
+import countries
+import utils
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ADDRESSES_PER_REQUEST = 100
+# addresses the hourly job validates at most, the newest first
+PENDING_ADDRESSES_PER_RUN = 500
+
+RESIDENTIAL_STATUS_MAPPING = {
+    'RESIDENTIAL': 'Residential',
+    'BUSINESS': 'Business'
+}
+
+
+@frappe.whitelist()
+def validate(addresses, fedex_settings=None):
+    frappe.has_permission('Address', 'write', throw=True)
+    if isinstance(addresses, basestring):
+        addresses = json.loads(addresses)
+    if not fedex_settings:
+        fedex_settings = utils.get_fedex_settings(frappe.defaults.get_user_default('company'))
+    if not fedex_settings:
+        frappe.throw('Please specify Fedex Settings to validate addresses with.')
+    return validate_addresses(addresses, fedex_settings)
+
+
+def validate_addresses(addresses, fedex_settings):
+    # Returns {address name: residential status} for the given Address records.
+    if not addresses:
+        return {}
+    return validate_address_rows(frappe.db.sql("""select * from `tabAddress` where name in ({0})""".format(
+        ', '.join(['%s'] * len(addresses))), list(addresses), as_dict=True), fedex_settings)
+
+
+def validate_address_rows(addresses, fedex_settings):
+    # Same as validate_addresses() for already loaded Address rows, which are
+    # updated in place with the validated status.
+    addresses_to_validate = {}
+    for address in addresses:
+        addresses_to_validate[address.name] = get_address_to_validate(address)
+    results = get_validation_results(fedex_settings, addresses_to_validate.values())
+
+    residential_statuses = {}
+    for address in addresses:
+        address_hash = addresses_to_validate[address.name]['address_hash']
+        residential_status = results.get(address_hash)
+        if residential_status:
+            residential_statuses[address.name] = residential_status
+            # only Address records whose status or contents changed are written back
+            if address.fedex_residential_status != residential_status or address.fedex_address_hash != address_hash:
+                frappe.db.set_value('Address', address.name, {
+                    'fedex_residential_status': residential_status,
+                    'fedex_address_hash': address_hash
+                }, update_modified=False)
+                frappe.clear_document_cache('Address', address.name)
+                address.fedex_residential_status = residential_status
+                address.fedex_address_hash = address_hash
+    return residential_statuses
+
+
+def on_address_update(doc, method=None):
+    # Added and edited addresses are validated in the background, so mapping
+    # a shipment never waits for Fedex and only reads the stored status.
+    if needs_validation(doc):
+        frappe.enqueue('fedex_shipment.address_validation.validate_addresses_job', queue='short',
+                       enqueue_after_commit=True, addresses=[doc.name])
+
+
+def validate_addresses_job(addresses):
+    fedex_settings = get_default_fedex_settings()
+    if fedex_settings:
+        validate_addresses(addresses, fedex_settings)
+
+
+def validate_pending_addresses():
+    # Addresses never validated, like the ones entered before the app was
+    # installed. The ones Fedex has no result for are stored as Unknown and
+    # not picked again.
+    fedex_settings = get_default_fedex_settings()
+    if not fedex_settings:
+        return
+    addresses = frappe.db.sql("""select * from `tabAddress` where ifnull(fedex_address_hash, '')=''
+        order by modified desc limit %s""", PENDING_ADDRESSES_PER_RUN, as_dict=True)
+    if addresses:
+        try:
+            validate_address_rows(addresses, fedex_settings)
+        except Exception:
+            logger.exception('Fedex address validation failed for %s addresses', len(addresses))
+
+
+def get_default_fedex_settings():
+    # the account of the default company, or else any account
+    return utils.get_fedex_settings(frappe.defaults.get_global_default('company')) or \
+        frappe.db.get_value('Fedex Settings', {}, 'name')
+
+
+def get_residential(address, customer_type=None):
+    # Stored status of an Address, from the background validation. Falls back
+    # to the customer type while the address is not validated yet or if Fedex
+    # cannot tell. Never calls Fedex itself.
+    residential_status = address.get('fedex_residential_status')
+    if residential_status in ('Residential', 'Business'):
+        return 1 if residential_status == 'Residential' else 0
+    if customer_type is None:
+        customer_type = frappe.db.get_value('Customer', address.customer, 'customer_type')
+    return 0 if customer_type == 'Company' else 1
+
+
+def needs_validation(address):
+    return address.get('fedex_address_hash') != get_address_to_validate(address)['address_hash']
+
+
+def get_address_to_validate(address):
+    address_to_validate = {
+        'street_lines': [normalize(line) for line in (address.address_line1, address.address_line2) if normalize(line)],
+        'city': normalize(address.city),
+        'state_or_province_code': normalize(countries.get_country_state_code(address.country, address.state)),
+        'postal_code': normalize(address.pincode).replace(' ', ''),
+        'country_code': normalize(countries.get_country_code(address.country))
+    }
+    address_to_validate['address_hash'] = hashlib.sha1(json.dumps(address_to_validate, sort_keys=True)).hexdigest()
+    return address_to_validate
+
+
+def normalize(value):
+    return re.sub(r'\s+', ' ', re.sub(r'[.,#]', ' ', cstr(value))).strip().upper()
+
+
+def get_validation_results(fedex_settings, addresses_to_validate):
+    # Returns {address hash: residential status}, from the cache where it is
+    # there and from Fedex, 100 addresses per request, otherwise.
+    unique_addresses = dict((a['address_hash'], a) for a in addresses_to_validate)
+    if not unique_addresses:
+        return {}
+    results = dict(frappe.db.sql("""select name, residential_status from `tabFedex Address Validation`
+        where name in ({0})""".format(', '.join(['%s'] * len(unique_addresses))), unique_addresses.keys()))
+
+    missing = [a for address_hash, a in unique_addresses.items() if address_hash not in results]
+    config_obj = fedex_config.get(fedex_settings) if missing else None
+    for i in range(0, len(missing), MAX_ADDRESSES_PER_REQUEST):
+        batch = missing[i:i + MAX_ADDRESSES_PER_REQUEST]
+        connection = make_address_validation_request(fedex_settings, config_obj, batch)
+        api.send_request(connection)
+        for address_result in getattr(connection.response, 'AddressResults', None) or []:
+            address_to_validate = unique_addresses.get(address_result.AddressId)
+            if address_to_validate:
+                results[address_result.AddressId] = cache_validation_result(address_to_validate, address_result)
+        # addresses Fedex returned nothing for are cached as Unknown too, not sent again with every shipment
+        for address_to_validate in batch:
+            if address_to_validate['address_hash'] not in results:
+                results[address_to_validate['address_hash']] = cache_validation_result(address_to_validate, None)
+    return results
+
+
+def make_address_validation_request(fedex_settings, config_obj, addresses_to_validate):
+    connection = client_pool.get_request(FedexAddressValidationRequest, fedex_settings, config_obj)
+
+    # The AddressValidationOptions are created with default values of None, which
+    # will cause WSDL validation errors. To make things work, each option needs to
+    # be explicitly set or deleted.
+    connection.AddressValidationOptions.CheckResidentialStatus = True
+    connection.AddressValidationOptions.VerifyAddresses = True
+    connection.AddressValidationOptions.RecognizeAlternateCityNames = True
+    connection.AddressValidationOptions.MaximumNumberOfMatches = 1
+    del connection.AddressValidationOptions.ConvertToUpperCase
+    del connection.AddressValidationOptions.ReturnParsedElements
+
+    # *Accuracy fields can be TIGHT, EXACT, MEDIUM, or LOOSE. Or deleted.
+    connection.AddressValidationOptions.StreetAccuracy = 'LOOSE'
+    del connection.AddressValidationOptions.DirectionalAccuracy
+    del connection.AddressValidationOptions.CompanyNameAccuracy
+
+    for address_to_validate in addresses_to_validate:
+        address = connection.create_wsdl_object_of_type('AddressToValidate')
+        # the hash comes back as AddressId and matches the result to its address
+        address.AddressId = address_to_validate['address_hash']
+        address.Address.StreetLines = address_to_validate['street_lines']
+        address.Address.City = address_to_validate['city']
+        address.Address.StateOrProvinceCode = address_to_validate['state_or_province_code']
+        address.Address.PostalCode = address_to_validate['postal_code']
+        address.Address.CountryCode = address_to_validate['country_code']
+        connection.add_address(address)
+    return connection
+
+
+def cache_validation_result(address_to_validate, address_result):
+    proposed_address_details = getattr(address_result, 'ProposedAddressDetails', None) or [None]
+    fedex_residential_status = cstr(getattr(proposed_address_details[0], 'ResidentialStatus', ''))
+    residential_status = RESIDENTIAL_STATUS_MAPPING.get(fedex_residential_status, 'Unknown')
+
+    doc_address_validation = frappe.get_doc({
+        'doctype': 'Fedex Address Validation',
+        'address_hash': address_to_validate['address_hash'],
+        'street_lines': '\n'.join(address_to_validate['street_lines']),
+        'city': address_to_validate['city'],
+        'state_or_province_code': address_to_validate['state_or_province_code'],
+        'postal_code': address_to_validate['postal_code'],
+        'country_code': address_to_validate['country_code'],
+        'residential_status': residential_status,
+        'fedex_residential_status': fedex_residential_status,
+        'score': cint(getattr(proposed_address_details[0], 'Score', 0)),
+        'delivery_point_validation': cstr(getattr(proposed_address_details[0], 'DeliveryPointValidation', '')),
+        'validated_on': now_datetime()
+    })
+    doc_address_validation.flags.ignore_permissions = True
+    try:
+        doc_address_validation.insert()
+    except frappe.DuplicateEntryError:
+        # validated by another request in the meantime
+        pass
+    return residential_status
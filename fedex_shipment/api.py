@@ -0,0 +1,207 @@
+from __future__ import unicode_literals
+
+import errno
+import httplib
+import logging
+import random
+import socket
+import time
+import urllib2
+from multiprocessing.pool import ThreadPool
+
+import frappe
+from frappe.utils import cint
+
+import call_log
+import metrics
+import ratelimit
+import routing
+import transport
+
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = {
+    'FedexProcessShipmentRequest': 'ship',
+    'FedexDeleteShipmentRequest': 'delete',
+    'FedexRateServiceRequest': 'rate',
+    'FedexTrackRequest': 'track',
+    'FedexAddressValidationRequest': 'address_validation',
+    'PostalCodeInquiryRequest': 'postal_code_inquiry'
+}
+
+# seconds suds waits for a reply, by Fedex request class
+DEFAULT_TIMEOUT = 30
+TIMEOUTS = {
+    'FedexProcessShipmentRequest': 60,
+    'FedexDeleteShipmentRequest': 30,
+    'FedexRateServiceRequest': 20,
+    'FedexTrackRequest': 20,
+    'FedexAddressValidationRequest': 20,
+    'PostalCodeInquiryRequest': 10
+}
+# Requests that create something in Fedex are sent again only when they
+# surely did not reach it, a timed out shipment may exist already.
+NOT_IDEMPOTENT = ('FedexProcessShipmentRequest', 'FedexDeleteShipmentRequest')
+
+MAX_ATTEMPTS = 3
+# full jitter backoff: a random sleep up to BACKOFF_BASE * 2 ** retry, capped
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 5.0
+
+# consecutive transient failures of an account that open its circuit, and
+# the seconds it stays open before a single call is let through to probe it
+BREAKER_FAILURES = 5
+BREAKER_OPEN_SECONDS = 30
+
+RETRIABLE_HTTP_CODES = (429, 502, 503, 504)
+CONNECTION_ERRNOS = (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH)
+
+
+class FedexUnavailableError(Exception):
+    pass
+
+
+def send_request(request, priority=None):
+    # Sends one request from the calling thread, raising what it raised.
+    error = send_requests([request], 1, priority)[0]
+    if error:
+        raise error
+
+
+def send_requests(requests, parallelism, priority=None):
+    # Only the SOAP round-trips run in the threads. Everything that touches
+    # frappe (messages, files, the documents, the cache) stays in the calling
+    # thread, which also hands a request to the threads once the rate limit
+    # lets it through. Requests failing for a transient reason are sent again
+    # after a jittered backoff. Returns the exception raised by each request,
+    # or None, in input order.
+    errors = [None] * len(requests)
+    pending = range(len(requests))
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt - 1))))
+
+        batch = []
+        for i in pending:
+            if is_circuit_open(requests[i].fedex_settings):
+                errors[i] = FedexUnavailableError('Fedex service does not respond for %s, please try again later.'
+                                                  % requests[i].fedex_settings)
+            else:
+                batch.append(i)
+        for i, error in zip(batch, send_batch([requests[i] for i in batch], parallelism, priority, attempt + 1)):
+            errors[i] = error
+
+        pending = [i for i in batch if errors[i] and is_retriable(requests[i], errors[i])]
+        if not pending:
+            break
+        if attempt + 1 < MAX_ATTEMPTS:
+            logger.info('Sending %s Fedex requests again after: %s', len(pending), errors[pending[0]])
+    return errors
+
+
+def send_batch(requests, parallelism, priority, attempt=1):
+    def send(request):
+        started = time.time()
+        try:
+            request.send_request()
+        except Exception as ex:
+            return time.time() - started, ex
+        return time.time() - started, None
+
+    if not requests:
+        return []
+    for request in requests:
+        if getattr(request, 'client', None):
+            request.client.set_options(timeout=TIMEOUTS.get(request.__class__.__name__, DEFAULT_TIMEOUT))
+
+    if len(requests) == 1:
+        ratelimit.acquire(requests[0].fedex_settings, priority)
+        results = [send(requests[0])]
+    else:
+        pool = ThreadPool(max(min(cint(parallelism), len(requests)), 1))
+        try:
+            results = []
+            for request in requests:
+                ratelimit.acquire(request.fedex_settings, priority)
+                results.append(pool.apply_async(send, (request,)))
+            results = [result.get() for result in results]
+        finally:
+            pool.close()
+            pool.join()
+
+    routing.record_calls([(request, elapsed, error) for request, (elapsed, error) in zip(requests, results)])
+    call_log.log_calls([(request, get_operation(request), elapsed, error, attempt)
+                        for request, (elapsed, error) in zip(requests, results)])
+    transport.flush_counters()
+    for request, (elapsed, error) in zip(requests, results):
+        metrics.observe('soap', get_operation(request), elapsed, bool(error))
+        record_circuit(request.fedex_settings, error)
+    metrics.flush()
+    return [error for elapsed, error in results]
+
+
+def get_operation(request):
+    return OPERATIONS.get(request.__class__.__name__, request.__class__.__name__)
+
+
+def is_transient(error):
+    # the Fedex service or the network failed, not the request itself
+    status = transport.get_http_status(error)
+    if status:
+        return status in RETRIABLE_HTTP_CODES
+    return isinstance(error, (socket.error, urllib2.URLError, httplib.HTTPException))
+
+
+def is_connection_failure(error):
+    # the request did not leave, so even a shipment can be sent again
+    if isinstance(error, urllib2.URLError) and not isinstance(error, urllib2.HTTPError):
+        error = error.reason
+    return isinstance(error, socket.gaierror) or \
+        isinstance(error, socket.error) and not transport.is_timeout(error) and error.errno in CONNECTION_ERRNOS
+
+
+def is_retriable(request, error):
+    if isinstance(error, FedexUnavailableError):
+        return False
+    if request.__class__.__name__ in NOT_IDEMPOTENT:
+        return is_connection_failure(error)
+    return is_transient(error)
+
+
+def is_circuit_open(fedex_settings):
+    circuit = get_circuit(fedex_settings)
+    if circuit.get('failures', 0) < BREAKER_FAILURES:
+        return False
+    if circuit.get('open_until', 0) > time.time():
+        return True
+    # half open: this call probes the service, the others keep failing fast
+    circuit['open_until'] = time.time() + BREAKER_OPEN_SECONDS
+    frappe.cache().set_value(get_circuit_key(fedex_settings), circuit)
+    return False
+
+
+def record_circuit(fedex_settings, error):
+    circuit = get_circuit(fedex_settings)
+    if error and is_transient(error):
+        circuit['failures'] = circuit.get('failures', 0) + 1
+        if circuit['failures'] >= BREAKER_FAILURES:
+            if circuit['failures'] == BREAKER_FAILURES:
+                logger.warning('Fedex circuit of %s is open after %s failures: %s', fedex_settings,
+                               BREAKER_FAILURES, error)
+            circuit['open_until'] = time.time() + BREAKER_OPEN_SECONDS
+            # the routing sends the calls to the other accounts meanwhile
+            routing.set_unavailable(fedex_settings, circuit['open_until'])
+    elif circuit.get('failures'):
+        circuit = {}
+    else:
+        return
+    frappe.cache().set_value(get_circuit_key(fedex_settings), circuit)
+
+
+def get_circuit(fedex_settings):
+    return frappe.cache().get_value(get_circuit_key(fedex_settings)) or {}
+
+
+def get_circuit_key(fedex_settings):
+    return 'fedex_circuit:%s' % fedex_settings
@@ -0,0 +1,142 @@
+from __future__ import unicode_literals
+
+import json
+
+import frappe
+from frappe.utils import cint, cstr
+from rq.timeouts import JobTimeoutException
+
+import shipment
+
+
+DEFAULT_MAX_PARALLEL_JOBS = 4
+PREFETCH_BATCH_SIZE = 50
+# seconds a job may run: a base plus a share per Packing Slip, a shipment
+# takes a few Fedex calls of up to a minute each when Fedex is slow
+JOB_TIMEOUT_BASE = 5 * 60
+JOB_TIMEOUT_PER_PACKING_SLIP = 3 * 60
+
+
+@frappe.whitelist()
+def make_bulk_fedex_shipments(packing_slips, max_parallel_jobs=None):
+    if isinstance(packing_slips, basestring):
+        packing_slips = json.loads(packing_slips)
+    # keep the order of selection, but never process a Packing Slip twice
+    unique_packing_slips = []
+    for ps in packing_slips:
+        if ps and ps not in unique_packing_slips:
+            unique_packing_slips.append(ps)
+    packing_slips = unique_packing_slips
+    if not packing_slips:
+        frappe.throw('Please select at least one Packing Slip.')
+
+    max_parallel_jobs = max(cint(max_parallel_jobs) or DEFAULT_MAX_PARALLEL_JOBS, 1)
+    doc_bulk_shipment = frappe.get_doc({
+        'doctype': 'Fedex Bulk Shipment',
+        'status': 'Queued',
+        'max_parallel_jobs': max_parallel_jobs,
+        'total_count': len(packing_slips),
+        'items': [{'packing_slip': ps, 'status': 'Pending'} for ps in packing_slips]
+    })
+    doc_bulk_shipment.insert()
+    frappe.db.commit()
+
+    for items in get_job_items([row.name for row in doc_bulk_shipment.items], max_parallel_jobs):
+        frappe.enqueue('fedex_shipment.bulk_shipment.process_bulk_shipment_items', queue='long',
+                       timeout=get_job_timeout(items), bulk_shipment=doc_bulk_shipment.name, items=items)
+    return doc_bulk_shipment.name
+
+
+def get_job_items(rows, max_parallel_jobs):
+    # Every job works through its own slice of the slips one by one, so no
+    # more than max_parallel_jobs FedEx conversations run for this batch.
+    return [rows[i::max_parallel_jobs] for i in range(min(max_parallel_jobs, len(rows)))]
+
+
+def get_job_timeout(items):
+    return JOB_TIMEOUT_BASE + JOB_TIMEOUT_PER_PACKING_SLIP * len(items)
+
+
+def process_bulk_shipment_items(bulk_shipment, items):
+    frappe.db.sql("""update `tabFedex Bulk Shipment` set status='In Progress'
+        where name=%s and status='Queued'""", bulk_shipment)
+    frappe.db.commit()
+    packing_slips = dict(frappe.db.sql("""select name, packing_slip from `tabFedex Bulk Shipment Item`
+        where name in ({0})""".format(', '.join(['%s'] * len(items))), items))
+    try:
+        for i in range(0, len(items), PREFETCH_BATCH_SIZE):
+            batch = items[i:i + PREFETCH_BATCH_SIZE]
+            try:
+                # the sources of a whole batch of Packing Slips are read at once
+                prefetched = shipment.prefetch_shipment_sources([packing_slips[item] for item in batch])
+                frappe.db.commit()
+            except JobTimeoutException:
+                raise
+            except Exception as ex:
+                frappe.db.rollback()
+                fail_pending_items(bulk_shipment, batch,
+                                   'Cannot read the Packing Slips: %s' % (cstr(ex) or ex.__class__.__name__))
+                continue
+            for item in batch:
+                process_bulk_shipment_item(bulk_shipment, item, packing_slips[item], prefetched)
+    except Exception as ex:
+        # the job stops, killed at its timeout or else, the items it did not
+        # get to are failed so the bulk shipment still completes
+        frappe.db.rollback()
+        fail_pending_items(bulk_shipment, items, 'The job stopped: %s' % (cstr(ex) or ex.__class__.__name__))
+        raise
+
+
+def fail_pending_items(bulk_shipment, items, error):
+    for item in frappe.db.sql_list("""select name from `tabFedex Bulk Shipment Item`
+            where name in ({0}) and status='Pending'""".format(', '.join(['%s'] * len(items))), items):
+        update_bulk_shipment_item(bulk_shipment, item, {'status': 'Failed', 'error': error})
+
+
+def process_bulk_shipment_item(bulk_shipment, item, packing_slip, prefetched):
+    try:
+        doc_fedex_shipment = shipment.map_fedex_shipment(packing_slip, prefetched)
+        doc_fedex_shipment.insert()
+        # already in a background job, no need to queue the labels again
+        doc_fedex_shipment.flags.create_labels_now = True
+        doc_fedex_shipment.submit()
+        frappe.db.commit()
+    except JobTimeoutException:
+        # the job is out of time, process_bulk_shipment_items fails what is left
+        raise
+    except Exception as ex:
+        frappe.db.rollback()
+        update_bulk_shipment_item(bulk_shipment, item, {
+            'status': 'Failed',
+            'error': cstr(ex) or ex.__class__.__name__
+        })
+    else:
+        update_bulk_shipment_item(bulk_shipment, item, {
+            'status': 'Completed',
+            'fedex_shipment': doc_fedex_shipment.name,
+            'tracking_number': doc_fedex_shipment.tracking_number
+        })
+
+
+def update_bulk_shipment_item(bulk_shipment, item, values):
+    frappe.db.set_value('Fedex Bulk Shipment Item', item, values)
+    counter = 'succeeded_count' if values.get('status') == 'Completed' else 'failed_count'
+    frappe.db.sql("""update `tabFedex Bulk Shipment`
+        set processed_count = processed_count + 1, {0} = {0} + 1
+        where name=%s""".format(counter), bulk_shipment)
+    total_count, processed_count, succeeded_count, failed_count = frappe.db.get_value('Fedex Bulk Shipment', bulk_shipment,
+        ['total_count', 'processed_count', 'succeeded_count', 'failed_count'])
+    if processed_count >= total_count:
+        frappe.db.set_value('Fedex Bulk Shipment', bulk_shipment, 'status',
+                            'Completed with Errors' if failed_count else 'Completed')
+    frappe.db.commit()
+
+    frappe.publish_realtime('fedex_bulk_shipment_progress', {
+        'bulk_shipment': bulk_shipment,
+        'packing_slip': frappe.db.get_value('Fedex Bulk Shipment Item', item, 'packing_slip'),
+        'status': values.get('status'),
+        'total_count': total_count,
+        'processed_count': processed_count,
+        'succeeded_count': succeeded_count,
+        'failed_count': failed_count
+    }, doctype='Fedex Bulk Shipment', docname=bulk_shipment)
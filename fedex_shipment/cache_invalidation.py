@@ -0,0 +1,37 @@
+from __future__ import unicode_literals
+
+import logging
+
+import frappe
+
+
+logger = logging.getLogger(__name__)
+
+INVALIDATED_KEYS_COUNTER = 'fedex_invalidated_cache_keys'
+
+
+def clear_shipment_cache(doc_fedex_shipment):
+    # Only the documents a Fedex Shipment writes to are dropped from the
+    # document cache; everything else in the site cache stays warm.
+    delivery_note = frappe.db.get_value('Packing Slip', doc_fedex_shipment.packing_slip, 'delivery_note')
+    documents = [
+        ('Fedex Shipment', doc_fedex_shipment.name),
+        ('Packing Slip', doc_fedex_shipment.packing_slip),
+        ('Delivery Note', delivery_note)
+    ]
+
+    # frappe does not tell whether a document was cached, so the count is of
+    # the documents cleared
+    invalidated = 0
+    for doctype, name in documents:
+        if name:
+            frappe.clear_document_cache(doctype, name)
+            invalidated += 1
+
+    frappe.cache().incrby(frappe.cache().make_key(INVALIDATED_KEYS_COUNTER), invalidated)
+    logger.info('Fedex Shipment %s: %s documents cleared from the cache', doc_fedex_shipment.name, invalidated)
+    return invalidated
+
+
+def get_invalidated_keys_count():
+    return int(frappe.cache().get(frappe.cache().make_key(INVALIDATED_KEYS_COUNTER)) or 0)
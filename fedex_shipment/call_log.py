@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+
+import json
+import logging
+import random
+import re
+import sys
+import time
+
+import frappe
+from frappe.utils import cstr, flt
+
+
+# One JSON record per Fedex call on the fedex_shipment.calls logger, which
+# writes to stderr (the worker logs) by itself and leaves the root logger
+# alone. What is logged is set per Fedex Settings by API Log Level:
+#   Off      nothing
+#   Errors   calls that raised or got an ERROR or FAILURE reply
+#   Sampled  errors and API Log Sample Rate percent of the other calls
+#   Full     every call with its SOAP envelopes, credentials redacted
+OFF, ERRORS, SAMPLED, FULL = 'Off', 'Errors', 'Sampled', 'Full'
+DEFAULT_LOG_LEVEL = ERRORS
+
+ERROR_SEVERITIES = ('ERROR', 'FAILURE')
+REDACTED_ELEMENTS = ('Key', 'Password', 'AccountNumber', 'MeterNumber', 'FedExFreightAccountNumber')
+REDACTED_ELEMENTS_RE = re.compile(r'(<(?:[\w-]+:)?(?:%s)(?:\s[^>]*)?>)[^<]*(</)' % '|'.join(REDACTED_ELEMENTS))
+# label images are saved as files, the log only says how big they were
+IMAGE_RE = re.compile(r'(<(?:[\w-]+:)?Image(?:\s[^>]*)?>)([^<]*)(</)')
+
+logger = logging.getLogger('fedex_shipment.calls')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+
+
+def log_calls(calls):
+    # (request, operation, seconds, exception or None, attempt) of finished
+    # calls, logged from the calling thread
+    for request, operation, elapsed, error, attempt in calls:
+        log_settings = get_log_settings(request.fedex_settings)
+        severity = cstr(getattr(getattr(request, 'response', None), 'HighestSeverity', '')) if not error else ''
+        failed = bool(error) or severity in ERROR_SEVERITIES
+        if log_settings.level == OFF or log_settings.level == ERRORS and not failed or \
+                log_settings.level == SAMPLED and not failed and random.random() * 100 >= log_settings.sample_rate:
+            continue
+
+        transport = getattr(getattr(getattr(request, 'client', None), 'options', None), 'transport', None)
+        sent, received = getattr(transport, 'sent', None), getattr(transport, 'received', None)
+        record = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'site': getattr(frappe.local, 'site', None),
+            'operation': operation,
+            'fedex_settings': request.fedex_settings,
+            'attempt': attempt,
+            'duration_ms': int(elapsed * 1000),
+            'severity': severity,
+            'request_bytes': len(sent) if sent else None,
+            'reply_bytes': len(received) if received else None
+        }
+        if error:
+            record.update({'error': redact(cstr(error)), 'error_type': error.__class__.__name__})
+        if log_settings.level == FULL:
+            record.update({'request': redact(sent), 'reply': redact(received)})
+        logger.log(logging.WARNING if failed else logging.INFO, json.dumps(record, sort_keys=True))
+
+
+def redact(payload):
+    if not payload:
+        return payload
+    payload = cstr(payload)
+    payload = REDACTED_ELEMENTS_RE.sub(r'\1***\2', payload)
+    return IMAGE_RE.sub(lambda match: '%s[%s bytes]%s' % (match.group(1), len(match.group(2)), match.group(3)), payload)
+
+
+def get_log_settings(fedex_settings):
+    cache_key = get_cache_key(fedex_settings)
+    log_settings = frappe.cache().get_value(cache_key)
+    if log_settings is None:
+        values = frappe.db.get_value('Fedex Settings', fedex_settings,
+                                     ['api_log_level', 'api_log_sample_rate'], as_dict=True) or {}
+        log_settings = frappe._dict({
+            'level': values.get('api_log_level') or DEFAULT_LOG_LEVEL,
+            'sample_rate': flt(values.get('api_log_sample_rate'))
+        })
+        frappe.cache().set_value(cache_key, log_settings)
+    return log_settings
+
+
+def get_cache_key(fedex_settings):
+    return 'fedex_log_settings:%s' % fedex_settings
+
+
+def clear_cache(doc, method=None):
+    frappe.cache().delete_value(get_cache_key(doc.name))
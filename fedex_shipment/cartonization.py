@@ -0,0 +1,271 @@
+from __future__ import unicode_literals
+
+import json
+import math
+
+import frappe
+from frappe.utils import cstr, flt
+
+
+# factors to pounds and inches, the units packages are computed in
+WEIGHT_UNITS = {
+    'LB': 1.0, 'LBS': 1.0, 'POUND': 1.0,
+    'KG': 2.20462, 'KGS': 2.20462, 'KILOGRAM': 2.20462,
+    'G': 0.00220462, 'GRAM': 0.00220462,
+    'OZ': 0.0625, 'OUNCE': 0.0625
+}
+DIMENSIONS_UNITS = {'IN': 1.0, 'CM': 0.393701}
+
+# share of a box volume that can really be filled with items
+DEFAULT_FILL_RATIO = 0.85
+# pounds, the Fedex limit of a single package, what packages without boxes are filled up to
+MAX_PACKAGE_WEIGHT = 150
+EPSILON = 1e-9
+
+
+def to_pounds(weight, weight_units):
+    return flt(weight) * WEIGHT_UNITS.get(cstr(weight_units).strip().upper(), 1.0)
+
+
+def to_inches(dimensions, dimensions_units):
+    factor = DIMENSIONS_UNITS.get(cstr(dimensions_units).strip().upper(), 1.0)
+    return tuple(sorted(flt(d) * factor for d in dimensions))
+
+
+def fits_in(dims, box_dims):
+    # both sorted, so an item fits if each of its sides fits the matching box side
+    return not dims or all(d <= b + EPSILON for d, b in zip(dims, box_dims))
+
+
+class Line(object):
+    def __init__(self, item_code, qty, weight, dims):
+        self.item_code = item_code
+        self.qty = qty
+        self.weight = weight
+        self.dims = dims if dims and all(dims) else None
+        self.volume = self.dims[0] * self.dims[1] * self.dims[2] if self.dims else 0.0
+
+
+class Box(object):
+    def __init__(self, name, length, width, height, dimensions_units, max_weight, box_weight, weight_units,
+                 fill_ratio=DEFAULT_FILL_RATIO):
+        self.name = name
+        self.length, self.width, self.height = flt(length), flt(width), flt(height)
+        self.dimensions_units = dimensions_units or 'IN'
+        self.weight_units = weight_units or 'LB'
+        self.dims = to_inches((length, width, height), dimensions_units)
+        self.fill_volume = self.dims[0] * self.dims[1] * self.dims[2] * fill_ratio
+        self.max_weight = to_pounds(max_weight, weight_units)
+        self.box_weight = to_pounds(box_weight, weight_units)
+
+    def holds(self, dims, weight):
+        return fits_in(dims, self.dims) and (not self.max_weight or self.box_weight + weight <= self.max_weight + EPSILON)
+
+
+class Package(object):
+    def __init__(self, box=None):
+        self.box = box
+        self.items = {}
+        self.count = 0
+        self.weight = 0.0
+        self.volume = 0.0
+        self.dims = None
+
+    def fits(self, line, qty):
+        # how many of qty units of the line can still be put in
+        if not self.box or self.count and line.volume > self.box.fill_volume - self.volume + EPSILON:
+            return 0
+        if not self.box.holds(line.dims, self.weight + line.weight):
+            return 0
+        if line.volume:
+            qty = min(qty, int((self.box.fill_volume - self.volume) / line.volume + EPSILON))
+            if not qty and not self.count:
+                # a single item fills an empty box even above the fill ratio
+                qty = 1
+        if line.weight and self.box.max_weight:
+            qty = min(qty, int((self.box.max_weight - self.box.box_weight - self.weight) / line.weight + EPSILON))
+        return max(qty, 0)
+
+    def has_room(self, volume, weight):
+        return self.box.fill_volume - self.volume + EPSILON >= volume and \
+            (not self.box.max_weight or self.box.max_weight - self.box.box_weight - self.weight + EPSILON >= weight)
+
+    def add(self, line, qty):
+        self.items[line.item_code] = self.items.get(line.item_code, 0) + qty
+        self.count += qty
+        self.weight += line.weight * qty
+        self.volume += line.volume * qty
+        if line.dims:
+            self.dims = tuple(max(d, l) for d, l in zip(self.dims, line.dims)) if self.dims else line.dims
+
+    def shrink(self, boxes):
+        # the smallest box, of sorted boxes, its contents fit in
+        for box in boxes:
+            if box.holds(self.dims, self.weight) and (self.volume <= box.fill_volume + EPSILON or self.count == 1):
+                self.box = box
+                return
+
+    def as_dict(self):
+        if self.box:
+            return {
+                'weight_units': self.box.weight_units,
+                'weight_value': round((self.weight + self.box.box_weight) / to_pounds(1, self.box.weight_units), 2),
+                'dimensions_units': self.box.dimensions_units,
+                'length': self.box.length,
+                'width': self.box.width,
+                'height': self.box.height
+            }
+        package = {'weight_units': 'LB', 'weight_value': round(self.weight, 2)}
+        if self.count == 1 and self.dims:
+            # shipped in its own packaging
+            package.update({
+                'dimensions_units': 'IN',
+                'length': math.ceil(self.dims[2]),
+                'width': math.ceil(self.dims[1]),
+                'height': math.ceil(self.dims[0])
+            })
+        return package
+
+
+def pack(lines, boxes):
+    # First fit decreasing: the biggest items go first, topping up the open
+    # packages before a new box is opened, and a new box is always the
+    # largest one the item fits in, so the package count stays low. Every
+    # package is then moved to the smallest box its contents fit in.
+    boxes = sorted(boxes, key=lambda box: box.fill_volume)
+    if not boxes:
+        return pack_by_weight(lines)
+
+    lines = sorted(lines, key=lambda line: (line.volume, line.weight), reverse=True)
+    # the smallest volume and weight among the lines still to pack, a package
+    # with less room than that left is closed and not tried again
+    min_volumes, min_weights = [0.0] * len(lines), [0.0] * len(lines)
+    for i in range(len(lines) - 1, -1, -1):
+        min_volumes[i] = min(lines[i].volume, min_volumes[i + 1]) if i + 1 < len(lines) else lines[i].volume
+        min_weights[i] = min(lines[i].weight, min_weights[i + 1]) if i + 1 < len(lines) else lines[i].weight
+
+    packages, open_packages = [], []
+    for i, line in enumerate(lines):
+        qty = line.qty
+        for package in open_packages:
+            if not qty:
+                break
+            count = package.fits(line, qty)
+            if count:
+                package.add(line, count)
+                qty -= count
+
+        box = next((box for box in reversed(boxes) if box.holds(line.dims, line.weight)), None)
+        while qty:
+            package = Package(box)
+            count = package.fits(line, qty) or 1
+            package.add(line, count)
+            packages.append(package)
+            if box:
+                open_packages.append(package)
+            qty -= count
+
+        if i + 1 < len(lines):
+            open_packages = [p for p in open_packages if p.has_room(min_volumes[i + 1], min_weights[i + 1])]
+
+    for package in packages:
+        package.shrink(boxes)
+    return packages
+
+
+def pack_by_weight(lines, max_weight=MAX_PACKAGE_WEIGHT):
+    # Without a box catalogue only the weight counts: first fit decreasing
+    # into packages of up to max_weight. An item heavier than that ships on
+    # its own.
+    packages = []
+    for line in sorted(lines, key=lambda line: line.weight, reverse=True):
+        qty = line.qty
+        for package in packages:
+            if not qty:
+                break
+            count = min(qty, int((max_weight - package.weight) / line.weight + EPSILON)) if line.weight else qty
+            if count > 0:
+                package.add(line, count)
+                qty -= count
+        while qty:
+            package = Package()
+            count = max(min(qty, int(max_weight / line.weight + EPSILON)), 1) if line.weight else qty
+            package.add(line, count)
+            packages.append(package)
+            qty -= count
+    return packages
+
+
+def make_packages(items, item_specs, boxes):
+    # Fedex Package values for Packing Slip Items. Packages the packer put in
+    # packages_json are kept as they are, otherwise the items are cartonized.
+    packed_contents = get_packed_contents(items)
+    if packed_contents:
+        boxes = sorted(boxes, key=lambda box: box.fill_volume)
+        packages = []
+        for pckg_no in sorted(packed_contents, key=lambda pckg_no: cstr(pckg_no)):
+            package = Package()
+            for line in make_lines(packed_contents[pckg_no].items(), item_specs):
+                package.add(line, line.qty)
+            package.shrink(boxes)
+            packages.append(package)
+    else:
+        packages = pack(make_lines([(item.item_code, item.qty) for item in items], item_specs), boxes)
+    return [package.as_dict() for package in packages]
+
+
+def get_packed_contents(items):
+    # {package no: {item code: qty}} merged from the packages_json of all items
+    packed_contents = {}
+    for item in items:
+        packages = json.loads(item.packages_json or "{}")
+        for pckg_no, pckg in packages.items():
+            merged_pckg = packed_contents.setdefault(pckg_no, {})
+            for item_code, qty in pckg.items():
+                merged_pckg[item_code] = merged_pckg.get(item_code, 0) + flt(qty)
+    return packed_contents
+
+
+def make_lines(item_qtys, item_specs):
+    qtys = {}
+    for item_code, qty in item_qtys:
+        qtys[item_code] = qtys.get(item_code, 0) + flt(qty)
+    lines = []
+    for item_code, qty in qtys.items():
+        if qty > 0:
+            spec = item_specs.get(item_code) or frappe._dict()
+            lines.append(Line(item_code, int(math.ceil(qty)), spec.weight or 0.0, spec.dims))
+    return lines
+
+
+def get_item_specs(item_codes):
+    # weight in pounds and sorted dimensions in inches of every item, in one query
+    item_codes = list(set(item_code for item_code in item_codes if item_code))
+    if not item_codes:
+        return {}
+    item_specs = {}
+    for item in frappe.db.sql("""select name, net_weight, weight_uom, fedex_length, fedex_width,
+            fedex_height, fedex_dimensions_units
+        from `tabItem` where name in ({0})""".format(', '.join(['%s'] * len(item_codes))), item_codes, as_dict=True):
+        item_specs[item.name] = frappe._dict({
+            'weight': to_pounds(item.net_weight, item.weight_uom),
+            'dims': to_inches((item.fedex_length, item.fedex_width, item.fedex_height), item.fedex_dimensions_units)
+        })
+    return item_specs
+
+
+def get_boxes(fedex_settings_list):
+    # {Fedex Settings: [Box]} for the box catalogues of many Fedex Settings, in one query
+    fedex_settings_list = list(set(fs for fs in fedex_settings_list if fs))
+    if not fedex_settings_list:
+        return {}
+    boxes = {}
+    for box in frappe.db.sql("""select b.parent, b.box_name, b.length, b.width, b.height, b.dimensions_units,
+            b.max_weight, b.box_weight, b.weight_units, fs.box_fill_ratio
+        from `tabFedex Box` b, `tabFedex Settings` fs
+        where b.parent = fs.name and b.parenttype = 'Fedex Settings' and b.parent in ({0})
+        order by b.idx""".format(', '.join(['%s'] * len(fedex_settings_list))), fedex_settings_list, as_dict=True):
+        boxes.setdefault(box.parent, []).append(Box(box.box_name, box.length, box.width, box.height,
+            box.dimensions_units, box.max_weight, box.box_weight, box.weight_units,
+            flt(box.box_fill_ratio) / 100 or DEFAULT_FILL_RATIO))
+    return boxes
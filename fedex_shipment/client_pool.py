@@ -0,0 +1,103 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+import types
+from collections import OrderedDict
+
+from suds.client import Client
+from fedex import base_service
+
+import transport
+
+
+# Parsed suds clients are kept warm per worker process and keyed by
+# (Fedex Settings name, request class, use_test_server). An entry is evicted
+# when it has not been used for CLIENT_IDLE_TIMEOUT seconds, and the least
+# recently used entry is dropped when the pool grows above MAX_CLIENTS.
+MAX_CLIENTS = 32
+CLIENT_IDLE_TIMEOUT = 60 * 60
+
+_clients = OrderedDict()
+_pooled_classes = {}
+_lock = threading.RLock()
+
+
+def get_request(request_class, fedex_settings, config_obj, *args, **kwargs):
+    key = (fedex_settings, request_class.__name__, bool(config_obj.use_test_server))
+    with _lock:
+        evict_idle()
+        entry = _clients.pop(key, None)
+
+    request = get_pooled_class(request_class)(entry[0] if entry else None, config_obj, *args, **kwargs)
+
+    with _lock:
+        _clients[key] = (request.pooled_client, time.time())
+        while len(_clients) > MAX_CLIENTS:
+            _clients.popitem(last=False)
+    # persistent connections instead of one TLS handshake per call
+    request.client.set_options(transport=transport.make_transport())
+    # the account a request goes through, for the routing statistics
+    request.fedex_settings = fedex_settings
+    return request
+
+
+class PooledService(base_service.FedexBaseService):
+    # Comes between a python-fedex request class and FedexBaseService in the
+    # MRO of a pooled class. FedexBaseService.__init__ builds a suds Client
+    # from the WSDL url, here it runs with its Client name bound to
+    # clone_client instead, so only the first request per key really parses
+    # the WSDL and later ones get a clone sharing it with their own options.
+    # The base_service module itself is left as it is.
+    def __init__(self, config_obj, wsdl_name, *args, **kwargs):
+        base_init = base_service.FedexBaseService.__init__.__func__
+        init = types.FunctionType(base_init.__code__, dict(base_init.__globals__, Client=self.clone_client),
+                                  base_init.__name__, base_init.__defaults__, base_init.__closure__)
+        init(self, config_obj, wsdl_name, *args, **kwargs)
+
+    def clone_client(self, url, **kwargs):
+        if self.pooled_client is None:
+            self.pooled_client = Client(url, **kwargs)
+        # A clone gets a deep copy of the options. The python-fedex plugin holds
+        # loggers, whose handlers hold locks that cannot be copied, so the clone
+        # shares the plugins instead.
+        plugins = self.pooled_client.options.plugins
+        self.pooled_client.set_options(plugins=[])
+        try:
+            client = self.pooled_client.clone()
+        finally:
+            self.pooled_client.set_options(plugins=plugins)
+        client.set_options(plugins=plugins)
+        return client
+
+
+def get_pooled_class(request_class):
+    # a subclass keeping the name of the request class, which the timeouts
+    # and the call log go by
+    with _lock:
+        if request_class not in _pooled_classes:
+            def __init__(self, pooled_client, config_obj, *args, **kwargs):
+                self.pooled_client = pooled_client
+                request_class.__init__(self, config_obj, *args, **kwargs)
+            _pooled_classes[request_class] = type(str(request_class.__name__), (request_class, PooledService),
+                                                  {'__init__': __init__})
+        return _pooled_classes[request_class]
+
+
+def evict_idle():
+    with _lock:
+        expired_before = time.time() - CLIENT_IDLE_TIMEOUT
+        for key, (client, last_used) in _clients.items():
+            if last_used < expired_before:
+                del _clients[key]
+
+
+def invalidate(fedex_settings=None):
+    with _lock:
+        for key in _clients.keys():
+            if fedex_settings is None or key[0] == fedex_settings:
+                del _clients[key]
+
+
+def on_fedex_settings_change(doc, method=None):
+    invalidate(doc.name)
@@ -1,4 +1,11 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+import unicodedata
+
 import frappe
+from frappe.utils import cstr
 
 COUNTRY_CODES = {
     "Aaland Islands": {"iso_code_2": "AX", "iso_code_3": "ALA"},
@@ -364,17 +371,129 @@ COUNTRY_STATE_CODES = {
 }
 
 
+# other spellings of the names above, matched after normalization
+COUNTRY_ALIASES = {
+    "Aland Islands": "Aaland Islands",
+    "America": "United States",
+    "Bolivia, Plurinational State of": "Bolivia",
+    "Brunei": "Brunei Darussalam",
+    "Burma": "Myanmar",
+    "Cabo Verde": "Cape Verde",
+    "Congo, Democratic Republic of the": "Democratic Republic of Congo",
+    "Czechia": "Czech Republic",
+    "DR Congo": "Democratic Republic of Congo",
+    "Great Britain": "United Kingdom",
+    "England": "United Kingdom",
+    "Eswatini": "Swaziland",
+    "Holland": "Netherlands",
+    "Holy See": "Vatican City State (Holy See)",
+    "Iran": "Iran (Islamic Republic of)",
+    "Ivory Coast": "Cote D'Ivoire",
+    "Korea": "Korea, Republic of",
+    "Kosovo": "Kosovo, Republic of",
+    "Laos": "Lao People's Democratic Republic",
+    "Libya": "Libyan Arab Jamahiriya",
+    "Micronesia": "Micronesia, Federated States of",
+    "Moldova": "Moldova, Republic of",
+    "Palestine": "Palestinian Territory, Occupied",
+    "Russia": "Russian Federation",
+    "Saint Barthelemy": "St. Barthelemy",
+    "Saint Helena": "St. Helena",
+    "Saint Martin": "St. Martin (French part)",
+    "Saint Pierre and Miquelon": "St. Pierre and Miquelon",
+    "South Korea": "Korea, Republic of",
+    "Syria": "Syrian Arab Republic",
+    "Tanzania": "Tanzania, United Republic of",
+    "The Netherlands": "Netherlands",
+    "Timor-Leste": "East Timor",
+    "U.K.": "United Kingdom",
+    "U.S.": "United States",
+    "U.S.A.": "United States",
+    "UAE": "United Arab Emirates",
+    "United States of America": "United States",
+    "Vatican": "Vatican City State (Holy See)",
+    "Venezuela, Bolivarian Republic of": "Venezuela",
+    "Vietnam": "Viet Nam"
+}
+
+STATE_ALIASES = {
+    "United States": {
+        "Ala.": "AL", "Ariz.": "AZ", "Ark.": "AR", "Calif.": "CA", "Colo.": "CO", "Conn.": "CT",
+        "Del.": "DE", "D.C.": "DC", "Washington DC": "DC", "Fla.": "FL", "Ga.": "GA", "Ill.": "IL",
+        "Ind.": "IN", "Kan.": "KS", "Kans.": "KS", "Ky.": "KY", "La.": "LA", "Md.": "MD", "Mass.": "MA",
+        "Mich.": "MI", "Minn.": "MN", "Miss.": "MS", "Mo.": "MO", "Mont.": "MT", "Neb.": "NE",
+        "Nebr.": "NE", "Nev.": "NV", "N.H.": "NH", "N.J.": "NJ", "N.M.": "NM", "N.Y.": "NY",
+        "N.C.": "NC", "N.D.": "ND", "Okla.": "OK", "Ore.": "OR", "Oreg.": "OR", "Pa.": "PA",
+        "Penn.": "PA", "R.I.": "RI", "S.C.": "SC", "S.D.": "SD", "Tenn.": "TN", "Tex.": "TX",
+        "Vt.": "VT", "Va.": "VA", "Wash.": "WA", "W.Va.": "WV", "Wis.": "WI", "Wisc.": "WI",
+        "Wyo.": "WY"
+    },
+    "Canada": {
+        "Newfoundland and Labrador": "NL", "Labrador": "NL", "PEI": "PE", "Yukon Territory": "YT"
+    },
+    "Mexico": {
+        "Baja California": "BC", "Ciudad de Mexico": "DF", "CDMX": "DF", "Mexico City": "DF",
+        "Coahuila de Zaragoza": "CO", "Estado de Mexico": "MX", "Michoacan de Ocampo": "MI",
+        "Veracruz de Ignacio de la Llave": "VE"
+    }
+}
+
+
+COUNTRY_NAMES_BY_ISO_CODE_2 = dict((codes['iso_code_2'], name) for name, codes in COUNTRY_CODES.items())
+COUNTRY_NAMES_BY_ISO_CODE_3 = dict((codes['iso_code_3'], name) for name, codes in COUNTRY_CODES.items())
+STATE_CODES = dict((country, frozenset(states.values())) for country, states in COUNTRY_STATE_CODES.items())
+
+
+def normalize_name(name):
+    # "Côte d'Ivoire", "COTE D IVOIRE" and "cote d'ivoire" are all "cote d ivoire"
+    name = unicodedata.normalize('NFKD', cstr(name).replace('&', ' and '))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'\W+', ' ', name.lower(), flags=re.UNICODE).split())
+
+
+def make_country_index():
+    # codes first, so that a name or an alias always wins over a code spelled the same
+    index = {}
+    for iso_code, name in COUNTRY_NAMES_BY_ISO_CODE_2.items() + COUNTRY_NAMES_BY_ISO_CODE_3.items():
+        index[iso_code.lower()] = name
+    for alias, name in COUNTRY_ALIASES.items():
+        index[normalize_name(alias)] = name
+    for name, codes in COUNTRY_CODES.items():
+        index[normalize_name(name)] = name
+        # spellings as they are stored, found without normalizing them first
+        index[codes['iso_code_2']] = index[codes['iso_code_3']] = index[name] = name
+    return index
+
+
+def make_state_index(country):
+    index = {}
+    for state_code in STATE_CODES[country]:
+        index[state_code.lower()] = state_code
+    for alias, state_code in STATE_ALIASES.get(country, {}).items():
+        index[normalize_name(alias)] = state_code
+    for state, state_code in COUNTRY_STATE_CODES[country].items():
+        index[normalize_name(state)] = index[state] = index[state_code] = state_code
+    return index
+
+
+COUNTRY_INDEX = make_country_index()
+STATE_INDEX = dict((country, make_state_index(country)) for country in COUNTRY_STATE_CODES)
+
+
+def get_country(country):
+    # the COUNTRY_CODES name of a country given by name, alias, ISO2 or ISO3 code
+    return COUNTRY_INDEX.get(country) or COUNTRY_INDEX.get(normalize_name(country))
+
+
 def get_country_code(country):
-    code = COUNTRY_CODES.get(country, {}).get('iso_code_2')
-    if not code:
+    country_name = get_country(country)
+    if not country_name:
         frappe.throw('Cannot get country code for country "%s"' % country)
-    return code
+    return COUNTRY_CODES[country_name]['iso_code_2']
 
 
 def get_country_state_code(country, state):
-    state_code = COUNTRY_STATE_CODES.get(country, {}).get(state, '')
-    if not state_code and state:
-        state = state.upper().strip()
-        if state in COUNTRY_STATE_CODES.get(country, {}).values():
-            state_code = state
-    return state_code
+    if not state:
+        return ''
+    state_index = STATE_INDEX.get(get_country(country), {})
+    return state_index.get(state) or state_index.get(normalize_name(state), '')
@@ -0,0 +1,29 @@
+frappe.listview_settings['Packing Slip'] = frappe.listview_settings['Packing Slip'] || {};
+
+var old_packing_slip_list_onload = frappe.listview_settings['Packing Slip'].onload;
+
+frappe.listview_settings['Packing Slip'].onload = function(listview) {
+    listview.page.add_menu_item(__('Make Fedex Shipments'), function() {
+        var packing_slips = $.map(listview.get_checked_items(), function(d) {
+            return d.docstatus==0 && !d.fedex_shipment ? d.name : null;
+        });
+        if (!packing_slips.length) {
+            msgprint(__("Please select draft Packing Slips without Fedex Shipment")); return;
+        }
+        frappe.call({
+            freeze: true,
+            method: "fedex_shipment.bulk_shipment.make_bulk_fedex_shipments",
+            args: {
+                "packing_slips": packing_slips
+            },
+            callback: function(r) {
+                if(!r.exc && r.message) {
+                    frappe.set_route("Form", "Fedex Bulk Shipment", r.message);
+                }
+            }
+        });
+    });
+    if (old_packing_slip_list_onload) {
+        old_packing_slip_list_onload(listview);
+    }
+}
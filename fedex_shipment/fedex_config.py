@@ -1,15 +1,39 @@
 from __future__ import unicode_literals
 
 import frappe
+from frappe.utils.password import get_decrypted_password
 
 from fedex.config import FedexConfig
 
 
+# Only the fields below are kept in the site cache. The password is never
+# written to redis, it is read decrypted once per request or job.
+CACHED_FIELDS = ('key', 'account_number', 'meter_number', 'freight_account_number', 'use_test_server')
+
+
 def get(fedex_settings):
-    fedex_settings = frappe.get_doc("Fedex Settings", fedex_settings)
-    return FedexConfig(key=fedex_settings.key,
-                       password=fedex_settings.password,
-                       account_number=fedex_settings.account_number,
-                       meter_number=fedex_settings.meter_number,
-                       freight_account_number=fedex_settings.freight_account_number,
-                       use_test_server=fedex_settings.use_test_server)
+    cache_key = get_cache_key(fedex_settings)
+    values = frappe.cache().get_value(cache_key)
+    if not values:
+        doc_fedex_settings = frappe.get_doc("Fedex Settings", fedex_settings)
+        values = dict((field, doc_fedex_settings.get(field)) for field in CACHED_FIELDS)
+        frappe.cache().set_value(cache_key, values)
+    return FedexConfig(password=get_password(fedex_settings), **values)
+
+
+def get_password(fedex_settings):
+    if not hasattr(frappe.local, 'fedex_passwords'):
+        frappe.local.fedex_passwords = {}
+    if fedex_settings not in frappe.local.fedex_passwords:
+        frappe.local.fedex_passwords[fedex_settings] = get_decrypted_password(
+            "Fedex Settings", fedex_settings, "password", raise_exception=False)
+    return frappe.local.fedex_passwords[fedex_settings]
+
+
+def get_cache_key(fedex_settings):
+    return "fedex_config_values:%s" % fedex_settings
+
+
+def clear_cache(doc, method=None):
+    frappe.cache().delete_value(get_cache_key(doc.name))
+    getattr(frappe.local, 'fedex_passwords', {}).pop(doc.name, None)
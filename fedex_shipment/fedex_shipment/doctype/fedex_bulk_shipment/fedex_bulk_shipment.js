@@ -0,0 +1,15 @@
+cur_frm.cscript.onload = function(doc) {
+    if(cur_frm.fedex_bulk_shipment_progress_bound) {
+        return;
+    }
+    cur_frm.fedex_bulk_shipment_progress_bound = true;
+    frappe.realtime.on("fedex_bulk_shipment_progress", function(data) {
+        if(data.bulk_shipment == cur_frm.doc.name) {
+            frappe.show_progress(__("Making Fedex Shipments"), data.processed_count, data.total_count);
+            if(data.processed_count >= data.total_count) {
+                frappe.hide_progress();
+            }
+            cur_frm.reload_doc();
+        }
+    });
+}
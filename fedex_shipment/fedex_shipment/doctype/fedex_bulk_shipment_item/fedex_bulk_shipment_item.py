@@ -0,0 +1,6 @@
+from __future__ import unicode_literals
+from frappe.model.document import Document
+
+
+class FedexBulkShipmentItem(Document):
+    pass
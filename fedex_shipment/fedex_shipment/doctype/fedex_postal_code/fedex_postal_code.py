@@ -0,0 +1,7 @@
+from __future__ import unicode_literals
+from frappe.model.document import Document
+
+
+class FedexPostalCode(Document):
+    def autoname(self):
+        self.name = '%s-%s' % (self.country_code, self.postal_code)
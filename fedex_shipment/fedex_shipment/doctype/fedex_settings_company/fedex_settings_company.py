@@ -1,6 +1,11 @@
 from __future__ import unicode_literals
+import frappe
 from frappe.model.document import Document
 
 
 class FedexSettingsCompany(Document):
     pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Fedex Settings Company", ["company", "parent"])
@@ -24,13 +24,124 @@ cur_frm.cscript.recipient_address = function() {
     });
 }
 
+cur_frm.cscript.shipper_address_postal_code = function() {
+    cur_frm.cscript.check_postal_code("shipper_address");
+}
+
+cur_frm.cscript.recipient_address_postal_code = function() {
+    cur_frm.cscript.check_postal_code("recipient_address");
+}
+
+cur_frm.cscript.check_postal_code = function(prefix) {
+    var doc = cur_frm.doc;
+    if(!doc[prefix + "_postal_code"] || !doc[prefix + "_country_code"]) {
+        return;
+    }
+    frappe.call({
+        method: "fedex_shipment.postal_codes.get_postal_code_details",
+        args: {
+            "postal_code": doc[prefix + "_postal_code"],
+            "country_code": doc[prefix + "_country_code"],
+            "fedex_settings": doc.fedex_settings
+        },
+        callback: function(r) {
+            if(r.exc) {
+                return;
+            }
+            if(!r.message) {
+                msgprint(__("Postal code {0} is not known to Fedex", [doc[prefix + "_postal_code"]]));
+                return;
+            }
+            $.each(["city", "state_or_province_code"], function(i, field) {
+                var value = r.message[field];
+                if(!value) {
+                    return;
+                }
+                if(!doc[prefix + "_" + field]) {
+                    cur_frm.set_value(prefix + "_" + field, value);
+                }
+                else if(doc[prefix + "_" + field].toUpperCase() != value.toUpperCase()) {
+                    msgprint(__("Postal code {0} belongs to {1}, not {2}",
+                        [doc[prefix + "_postal_code"], value, doc[prefix + "_" + field]]));
+                }
+            });
+        }
+    });
+}
+
+cur_frm.cscript.onload = function(doc) {
+    if(cur_frm.fedex_labels_events_bound) {
+        return;
+    }
+    cur_frm.fedex_labels_events_bound = true;
+    frappe.realtime.on("fedex_labels_ready", function(data) {
+        if(data.fedex_shipment == cur_frm.doc.name) {
+            cur_frm.reload_doc();
+            cur_frm.cscript.print_fedex_labels(data.fedex_shipment);
+        }
+    });
+    frappe.realtime.on("fedex_labels_failed", function(data) {
+        if(data.fedex_shipment == cur_frm.doc.name) {
+            cur_frm.reload_doc();
+            msgprint(__("Creating of Fedex labels failed"));
+        }
+    });
+}
+
+cur_frm.cscript.refresh = function(doc) {
+    if(doc.docstatus==1 && doc.fedex_replies) {
+        cur_frm.add_custom_button(__('Full Fedex Replies'), function() {
+            frappe.call({
+                method: "fedex_shipment.replies.get_full_replies",
+                args: {
+                    "fedex_shipment": doc.name,
+                },
+                callback: function(r) {
+                    if(!r.exc) {
+                        if(r.message) {
+                            msgprint($("<pre>").text(JSON.stringify(r.message, null, 1)).prop("outerHTML"),
+                                __("Fedex Replies"));
+                        }
+                        else {
+                            msgprint(__("Full Fedex replies are not stored for this shipment"));
+                        }
+                    }
+                }
+            });
+        });
+    }
+    if(doc.docstatus==1 && doc.label_status=="Failed") {
+        cur_frm.add_custom_button(__('Retry Labels Creation'), function() {
+            frappe.call({
+                method: "fedex_shipment.shipment.retry_labels_creation",
+                args: {
+                    "fedex_shipment": doc.name,
+                },
+                callback: function(r) {
+                    if(!r.exc) {
+                        cur_frm.reload_doc();
+                    }
+                }
+            });
+        });
+    }
+}
+
 cur_frm.cscript.on_submit = function() {
-    var me = this;
+    if(this.frm.doc.label_status=="Queued") {
+        msgprint(__("Fedex labels are being created, they will be printed as soon as they are ready"));
+    }
+    else {
+        cur_frm.cscript.print_fedex_labels(this.frm.doc.name);
+    }
+}
+
+cur_frm.cscript.print_fedex_labels = function(fedex_shipment) {
     frappe.call({
         freeze: true,
         method: "fedex_shipment.shipment.get_all_fedex_labels_file_url",
         args: {
-            "fedex_shipment": me.frm.doc.name,
+            "fedex_shipment": fedex_shipment,
         },
         callback: function(r) {
             if(!r.exc) {
@@ -42,7 +42,7 @@ app_version = "0.0.1"
 # ------------
 
 # before_install = "fedex_shipment.install.before_install"
-# after_install = "fedex_shipment.install.after_install"
+after_install = "fedex_shipment.install.after_install"
 
 # Desk Notifications
 # ------------------
@@ -71,7 +71,27 @@ doc_events = {
         "validate": "fedex_shipment.shipment.validate",
         "on_submit": "fedex_shipment.shipment.on_submit",
         "before_submit": "fedex_shipment.shipment.before_submit",
-        "before_cancel": "fedex_shipment.shipment.before_cancel"
+        "before_cancel": "fedex_shipment.shipment.before_cancel",
+        "on_trash": "fedex_shipment.replies.delete_full_replies"
+    },
+    "Address": {
+        "on_update": "fedex_shipment.address_validation.on_address_update"
+    },
+    "Fedex Settings": {
+        "on_update": [
+            "fedex_shipment.fedex_config.clear_cache",
+            "fedex_shipment.client_pool.on_fedex_settings_change",
+            "fedex_shipment.utils.clear_company_fedex_settings_cache",
+            "fedex_shipment.ratelimit.clear_cache",
+            "fedex_shipment.call_log.clear_cache"
+        ],
+        "on_trash": [
+            "fedex_shipment.fedex_config.clear_cache",
+            "fedex_shipment.client_pool.on_fedex_settings_change",
+            "fedex_shipment.utils.clear_company_fedex_settings_cache",
+            "fedex_shipment.ratelimit.clear_cache",
+            "fedex_shipment.call_log.clear_cache"
+        ]
     }
 }
 
@@ -80,10 +100,28 @@ doctype_js = {
     "Packing Slip": ["custom_scripts/packing_slip.js"]
 }
 
+doctype_list_js = {
+    "Packing Slip": ["custom_scripts/packing_slip_list.js"]
+}
+
 
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+    "all": [
+        "fedex_shipment.printing.print_all_spooled_labels",
+        "fedex_shipment.tracking.poll_tracking",
+        "fedex_shipment.routing.flush_account_counters"
+    ],
+    "hourly": [
+        "fedex_shipment.address_validation.validate_pending_addresses"
+    ],
+    "daily": [
+        "fedex_shipment.postal_codes.warm_up_postal_codes"
+    ]
+}
+
 # scheduler_events = {
 #   "all": [
 #       "fedex_shipment.tasks.all"
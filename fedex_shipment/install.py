@@ -0,0 +1,71 @@
+from __future__ import unicode_literals
+
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+
+CUSTOM_FIELDS = {
+    'Address': [
+        {
+            'fieldname': 'fedex_residential_status',
+            'label': 'Fedex Residential Status',
+            'fieldtype': 'Select',
+            'options': '\nResidential\nBusiness\nUnknown',
+            'insert_after': 'pincode',
+            'read_only': 1,
+            'no_copy': 1
+        },
+        {
+            'fieldname': 'fedex_address_hash',
+            'label': 'Fedex Address Hash',
+            'fieldtype': 'Data',
+            'insert_after': 'fedex_residential_status',
+            'hidden': 1,
+            'read_only': 1,
+            'no_copy': 1
+        }
+    ],
+    'Item': [
+        {
+            'fieldname': 'fedex_dimensions_sb',
+            'label': 'Shipping Dimensions',
+            'fieldtype': 'Section Break',
+            'insert_after': 'weight_uom'
+        },
+        {
+            'fieldname': 'fedex_dimensions_units',
+            'label': 'Dimensions Units',
+            'fieldtype': 'Select',
+            'options': 'IN\nCM',
+            'default': 'IN',
+            'insert_after': 'fedex_dimensions_sb'
+        },
+        {
+            'fieldname': 'fedex_length',
+            'label': 'Length',
+            'fieldtype': 'Float',
+            'insert_after': 'fedex_dimensions_units'
+        },
+        {
+            'fieldname': 'fedex_width',
+            'label': 'Width',
+            'fieldtype': 'Float',
+            'insert_after': 'fedex_length'
+        },
+        {
+            'fieldname': 'fedex_height',
+            'label': 'Height',
+            'fieldtype': 'Float',
+            'insert_after': 'fedex_width'
+        }
+    ]
+}
+
+
+def after_install():
+    make_custom_fields()
+
+
+def make_custom_fields(doctypes=None):
+    # all custom fields, or only those of the given doctypes for a patch
+    create_custom_fields(dict((doctype, fields) for doctype, fields in CUSTOM_FIELDS.items()
+                              if doctypes is None or doctype in doctypes))
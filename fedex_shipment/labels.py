@@ -0,0 +1,141 @@
+from __future__ import unicode_literals
+
+import abc
+import hashlib
+import os
+import shutil
+import tempfile
+
+from PyPDF2 import PdfFileMerger
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+
+import frappe
+from frappe.utils.file_manager import get_files_path
+
+
+PDF_CANVAS_SIZE_MAPPING = {
+    "PAPER_4X6": (4 * inch, 6 * inch),
+    "PAPER_4X8": (4 * inch, 8 * inch),
+    "PAPER_4X9": (4 * inch, 9 * inch),
+    "PAPER_7X4.75": (7 * inch, 4.75 * inch),
+    "PAPER_8.5X11_BOTTOM_HALF_LABEL": (8.5 * inch, 11 * inch),
+    "PAPER_8.5X11_TOP_HALF_LABEL": (8.5 * inch, 11 * inch),
+    "STOCK_4X6": (4 * inch, 6 * inch),
+    "STOCK_4X6.75_LEADING_DOC_TAB": (4 * inch, 6.75 * inch),
+    "STOCK_4X6.75_TRAILING_DOC_TAB": (4 * inch, 6.75 * inch),
+    "STOCK_4X8": (4 * inch, 8 * inch),
+    "STOCK_4X9_LEADING_DOC_TAB": (4 * inch, 9 * inch),
+    "STOCK_4X9_TRAILING_DOC_TAB": (4 * inch, 9 * inch),
+    "PAPER \"6X4\"": (6 * inch, 4 * inch)
+}
+
+
+def make_label_merger(doc_fedex_shipment):
+    label_image_type = (doc_fedex_shipment.label_image_type or '').lower()
+    if label_image_type == "pdf":
+        return PdfLabelMerger()
+    elif label_image_type == "png":
+        return PngLabelMerger(doc_fedex_shipment.label_stock_type)
+
+
+# Labels are spooled to a temporary folder under the site's files path and
+# merged from there straight into the attached file, so neither the labels
+# nor the merged document are held in memory as a whole.
+class LabelMerger(object):
+    __metaclass__ = abc.ABCMeta
+    extension = None
+
+    def __init__(self):
+        self.temp_dir = None
+        self.label_paths = []
+
+    def add_label(self, label_image_data):
+        if not self.temp_dir:
+            self.temp_dir = tempfile.mkdtemp(prefix='fedex_labels_', dir=get_files_path())
+        label_path = os.path.join(self.temp_dir, '%s.%s' % (len(self.label_paths), self.extension))
+        with open(label_path, 'wb') as label_file:
+            label_file.write(label_image_data)
+        self.label_paths.append(label_path)
+
+    def save(self, file_name, doctype, name):
+        file_path = get_files_path(file_name)
+        if os.path.exists(file_path):
+            file_name = '%s-%s' % (frappe.generate_hash(length=6), file_name)
+            file_path = get_files_path(file_name)
+        try:
+            self.write(file_path)
+            return attach_file(file_path, doctype, name)
+        except Exception:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+
+    @abc.abstractmethod
+    def write(self, file_path):
+        # merges the spooled labels into file_path
+        pass
+
+    def close(self):
+        if self.temp_dir:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+
+
+# PDF labels are merged page by page as Fedex sent them, nothing is rasterized.
+class PdfLabelMerger(LabelMerger):
+    extension = 'pdf'
+
+    def write(self, file_path):
+        merger = PdfFileMerger()
+        label_files = []
+        try:
+            for label_path in self.label_paths:
+                label_files.append(open(label_path, 'rb'))
+                merger.append(label_files[-1], import_bookmarks=False)
+            with open(file_path, 'wb') as pdf_file:
+                merger.write(pdf_file)
+        finally:
+            merger.close()
+            for label_file in label_files:
+                label_file.close()
+
+
+class PngLabelMerger(LabelMerger):
+    extension = 'png'
+
+    def __init__(self, label_stock_type):
+        super(PngLabelMerger, self).__init__()
+        self.marging = 0.25
+        self.width, self.height = PDF_CANVAS_SIZE_MAPPING.get(label_stock_type, (4 * inch, 6 * inch))
+
+    def write(self, file_path):
+        pdf_canvas = canvas.Canvas(file_path, pagesize=(self.width + self.marging * inch,
+                                                        self.height + self.marging * inch))
+        for label_path in self.label_paths:
+            pdf_canvas.drawImage(label_path, self.marging, self.marging, self.width, self.height,
+                                 preserveAspectRatio=True)
+            pdf_canvas.showPage()
+        pdf_canvas.save()
+
+
+def attach_file(file_path, doctype, name):
+    # the same record save_file() makes, without loading the content to memory
+    file_name = os.path.basename(file_path)
+    content_hash = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            content_hash.update(chunk)
+
+    file_data = frappe.get_doc({
+        'doctype': 'File Data',
+        'file_name': file_name,
+        'file_url': '/files/' + file_name,
+        'attached_to_doctype': doctype,
+        'attached_to_name': name,
+        'file_size': os.path.getsize(file_path),
+        'content_hash': content_hash.hexdigest()
+    })
+    file_data.flags.ignore_permissions = True
+    file_data.insert()
+    return file_data
@@ -0,0 +1,154 @@
+from __future__ import unicode_literals
+
+import functools
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+import frappe
+
+import transport
+
+
+# Latency histograms and error counts of the Fedex work, by stage and
+# operation. The 'soap' stage is every SOAP round-trip (operation ship,
+# delete, rate, track, ...), the 'total' stage a whole create, delete, rate
+# or track call, and the other stages the steps of a shipment creation.
+# Observations are counted per worker and added to the site totals in redis
+# by flush(), from the calling thread. get_metrics exports the totals in the
+# Prometheus text format.
+SERIES_KEY = 'fedex_metric_series'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_observations = Counter()
+_lock = threading.Lock()
+
+
+def observe(stage, operation, seconds, error=False):
+    labels = '%s|%s' % (stage, operation)
+    bucket = next((i for i, le in enumerate(BUCKETS) if seconds <= le), len(BUCKETS))
+    with _lock:
+        _observations['count|' + labels] += 1
+        _observations['sum_us|' + labels] += int(seconds * 1000000)
+        _observations['bucket|%s|%s' % (labels, bucket)] += 1
+        if error:
+            _observations['errors|' + labels] += 1
+
+
+def flush():
+    with _lock:
+        observations = dict(_observations)
+        _observations.clear()
+    if not observations:
+        return
+    pipeline = frappe.cache().pipeline()
+    pipeline.sadd(get_series_key(), *observations.keys())
+    for series, value in observations.items():
+        pipeline.incrby(get_metric_key(series), value)
+    pipeline.execute()
+
+
+def timed(operation, stage='total'):
+    # observes every call of the decorated function, failed ones as errors
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.time()
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                observe(stage, operation, time.time() - started, failed)
+                flush()
+        return wrapper
+    return decorator
+
+
+class Timings(object):
+    # Seconds spent in each stage of one operation, kept on the document for
+    # slow ones and observed into the histograms as well.
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = time.time()
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, stage):
+        started = time.time()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            seconds = time.time() - started
+            self.stages[stage] = self.stages.get(stage, 0) + seconds
+            observe(stage, self.operation, seconds, failed)
+
+    def as_json(self):
+        timings = OrderedDict([('total', round(time.time() - self.started, 4))])
+        timings.update((stage, round(seconds, 4)) for stage, seconds in self.stages.items())
+        return json.dumps(timings, indent=1, separators=(',', ': '))
+
+
+@frappe.whitelist()
+def get_metrics():
+    frappe.only_for('System Manager')
+    frappe.response['type'] = 'txt'
+    frappe.response['doctype'] = 'fedex_metrics'
+    frappe.response['result'] = render(get_totals(), transport.get_counters())
+
+
+def get_totals():
+    # {series: value} of the site
+    # smembers of the cache prefixes the key itself, the pipeline of flush does not
+    series = sorted(frappe.cache().smembers(SERIES_KEY))
+    values = frappe.cache().mget([get_metric_key(s) for s in series]) if series else []
+    return dict((s.decode('utf-8') if isinstance(s, bytes) else s, int(value or 0))
+                for s, value in zip(series, values))
+
+
+def render(totals, http_counters=None):
+    histograms = {}
+    for series, value in totals.items():
+        parts = series.split('|')
+        histogram = histograms.setdefault((parts[1], parts[2]), {'buckets': [0] * (len(BUCKETS) + 1)})
+        if parts[0] == 'bucket':
+            histogram['buckets'][int(parts[3])] += value
+        else:
+            histogram[parts[0]] = value
+
+    lines = ['# HELP fedex_duration_seconds Duration of Fedex calls and shipment stages.',
+             '# TYPE fedex_duration_seconds histogram']
+    for (stage, operation), histogram in sorted(histograms.items()):
+        labels = 'stage="%s",operation="%s"' % (stage, operation)
+        cumulative = 0
+        for le, count in zip([repr(float(le)) for le in BUCKETS] + ['+Inf'], histogram['buckets']):
+            cumulative += count
+            lines.append('fedex_duration_seconds_bucket{%s,le="%s"} %s' % (labels, le, cumulative))
+        lines.append('fedex_duration_seconds_sum{%s} %s' % (labels, histogram.get('sum_us', 0) / 1000000.0))
+        lines.append('fedex_duration_seconds_count{%s} %s' % (labels, histogram.get('count', 0)))
+
+    lines += ['# HELP fedex_errors_total Failed Fedex calls and shipment stages.',
+              '# TYPE fedex_errors_total counter']
+    for (stage, operation), histogram in sorted(histograms.items()):
+        lines.append('fedex_errors_total{stage="%s",operation="%s"} %s'
+                     % (stage, operation, histogram.get('errors', 0)))
+
+    if http_counters:
+        lines += ['# HELP fedex_http_total Requests sent and connections opened, reused, stale, evicted and discarded.',
+                  '# TYPE fedex_http_total counter']
+        for counter, value in sorted(http_counters.items()):
+            lines.append('fedex_http_total{counter="%s"} %s' % (counter, value))
+    return '\n'.join(lines) + '\n'
+
+
+def get_series_key():
+    return frappe.cache().make_key(SERIES_KEY)
+
+
+def get_metric_key(series):
+    return frappe.cache().make_key('fedex_metric:%s' % series)
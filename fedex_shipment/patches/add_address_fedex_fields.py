@@ -0,0 +1,7 @@
+from __future__ import unicode_literals
+
+from fedex_shipment import install
+
+
+def execute():
+    install.make_custom_fields(['Address'])
@@ -0,0 +1,98 @@
+from __future__ import unicode_literals
+
+import json
+import re
+
+import frappe
+from frappe.utils import cint
+
+from fedex_shipment import replies
+
+
+BATCH_SIZE = 200
+# a quoted value, where braces are text, or a brace
+BLOCK_TOKEN = re.compile(r'"[^"\n]*"|[{}]')
+
+
+def execute():
+    # Moves the raw_response dumps out of tabFedex Shipment: a summary parsed
+    # from the dump goes to fedex_replies, then the column is dropped. The
+    # dump itself, without label images, goes to a compressed Fedex Shipment
+    # Reply when the account of the shipment stores full replies, as new
+    # shipments do. The other accounts asked for the summary only. A shipment
+    # without an account keeps its dump, there is nothing to go by.
+    frappe.reload_doc('fedex_shipment', 'doctype', 'fedex_shipment_reply')
+    frappe.reload_doc('fedex_shipment', 'doctype', 'fedex_settings')
+    frappe.reload_doc('fedex_shipment', 'doctype', 'fedex_shipment')
+    if not frappe.db.has_column('Fedex Shipment', 'raw_response'):
+        return
+
+    store_full_replies = dict(frappe.db.sql("""select name, store_full_replies from `tabFedex Settings`"""))
+    last_name = ''
+    while True:
+        shipments = frappe.db.sql("""select name, fedex_settings, raw_response from `tabFedex Shipment`
+            where name > %s and ifnull(raw_response, '')!=''
+            order by name limit %s""", (last_name, BATCH_SIZE))
+        if not shipments:
+            break
+        for name, fedex_settings, raw_response in shipments:
+            compact_raw_response(name, raw_response,
+                                 cint(store_full_replies.get(fedex_settings, 1)) if fedex_settings else True)
+        last_name = shipments[-1][0]
+        frappe.db.commit()
+
+    frappe.db.sql_ddl("""alter table `tabFedex Shipment` drop column raw_response""")
+
+
+def compact_raw_response(name, raw_response, store_full_reply):
+    raw_response = re.sub(r'(Image = )"[^"]*"', r'\1"(saved as file)"', raw_response)
+    frappe.db.sql("""update `tabFedex Shipment` set fedex_replies=%s where name=%s""",
+                  (json.dumps([summarize_raw_response(raw_response)], indent=1, separators=(',', ': ')), name))
+
+    if store_full_reply:
+        replies.store(name, [{'raw_response': raw_response}])
+
+
+def summarize_raw_response(raw_response):
+    # what replies.summarize keeps of a reply, from its suds dump
+    return {
+        'severity': get_field(raw_response, 'HighestSeverity'),
+        'notifications': [{
+            'severity': get_field(notification, 'Severity'),
+            'code': get_field(notification, 'Code'),
+            'message': get_field(notification, 'Message')
+        } for notification in get_blocks(raw_response, 'Notification')],
+        'master_tracking_number': '',
+        'tracking_numbers': sorted(set(re.findall(r'TrackingNumber = "(\w+)"', raw_response)),
+                                   key=raw_response.index),
+        'actual_rate_type': '',
+        'rate_details': []
+    }
+
+
+def get_blocks(dump, type_name):
+    # The bodies of the (type_name){...} blocks of a suds dump, each up to its
+    # matching closing brace. Nested blocks (the MessageParameters of a
+    # Notification) are left out, so only the block's own fields remain.
+    blocks = []
+    for match in re.finditer(r'\(%s\)\{' % type_name, dump):
+        depth, start, parts = 1, match.end(), []
+        for token in BLOCK_TOKEN.finditer(dump, match.end()):
+            if token.group() == '{':
+                if depth == 1:
+                    parts.append(dump[start:token.start()])
+                depth += 1
+            elif token.group() == '}':
+                depth -= 1
+                if depth == 1:
+                    start = token.end()
+                elif not depth:
+                    parts.append(dump[start:token.start()])
+                    break
+        blocks.append(''.join(parts))
+    return blocks
+
+
+def get_field(dump, field):
+    match = re.search(r'^\s*%s = "([^"]*)"' % field, dump, re.M)
+    return match.group(1) if match else ''
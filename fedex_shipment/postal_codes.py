@@ -0,0 +1,122 @@
+from __future__ import unicode_literals
+
+import json
+import logging
+
+import frappe
+from frappe.utils import cstr, now_datetime
+
+from fedex.services.package_movement import PostalCodeInquiryRequest
+from fedex.services.package_movement import FedexPostalCodeNotFound, FedexInvalidPostalCodeFormat
+
+import fedex_config
+import client_pool
+import countries
+import api
+
+
+logger = logging.getLogger(__name__)
+
+INQUIRY_PARALLELISM = 4
+WARM_UP_BATCH_SIZE = 200
+
+
+@frappe.whitelist()
+def get_postal_code_details(postal_code, country_code, fedex_settings=None):
+    return get_postal_codes_details([(postal_code, country_code)], fedex_settings).get(
+        get_postal_code_name(postal_code, country_code))
+
+
+@frappe.whitelist()
+def get_postal_codes_details(postal_codes, fedex_settings=None):
+    # Returns {"<country code>-<postal code>": details} for the valid postal
+    # codes of a list of (postal code, country code) pairs. Codes missing in
+    # the Fedex Postal Code table are asked from Fedex and stored there.
+    if isinstance(postal_codes, basestring):
+        postal_codes = json.loads(postal_codes)
+    postal_codes = dict((get_postal_code_name(postal_code, country_code),
+                         (normalize_postal_code(postal_code), cstr(country_code).upper()))
+                        for postal_code, country_code in postal_codes if postal_code and country_code)
+    if not postal_codes:
+        return {}
+
+    details = dict((d.name, d) for d in frappe.db.sql("""select name, postal_code, country_code, city,
+            state_or_province_code, location_id, is_valid
+        from `tabFedex Postal Code` where name in ({0})""".format(', '.join(['%s'] * len(postal_codes))),
+        postal_codes.keys(), as_dict=True))
+
+    missing = [name for name in postal_codes if name not in details]
+    if missing:
+        fedex_settings = fedex_settings or frappe.db.get_value('Fedex Settings', {})
+        if fedex_settings:
+            details.update(inquire_postal_codes(fedex_settings, [postal_codes[name] for name in missing]))
+    return dict((name, d) for name, d in details.items() if d.is_valid)
+
+
+def inquire_postal_codes(fedex_settings, postal_codes):
+    config_obj = fedex_config.get(fedex_settings)
+    details = {}
+    for i in range(0, len(postal_codes), INQUIRY_PARALLELISM * 10):
+        batch = postal_codes[i:i + INQUIRY_PARALLELISM * 10]
+        inquiries = []
+        for postal_code, country_code in batch:
+            inquiry = client_pool.get_request(PostalCodeInquiryRequest, fedex_settings, config_obj)
+            inquiry.PostalCode = postal_code
+            inquiry.CountryCode = country_code
+            inquiries.append(inquiry)
+
+        errors = api.send_requests(inquiries, INQUIRY_PARALLELISM)
+        for (postal_code, country_code), inquiry, error in zip(batch, inquiries, errors):
+            if error and not isinstance(error, (FedexPostalCodeNotFound, FedexInvalidPostalCodeFormat)):
+                # not an answer about the postal code, ask again next time
+                logger.warning('Fedex postal code inquiry for %s %s failed: %s', country_code, postal_code, error)
+                continue
+            doc_postal_code = save_postal_code(postal_code, country_code, None if error else inquiry.response)
+            details[doc_postal_code.name] = frappe._dict(doc_postal_code.as_dict())
+    frappe.db.commit()
+    return details
+
+
+def save_postal_code(postal_code, country_code, response):
+    express_description = getattr(response, 'ExpressDescription', None)
+    doc_postal_code = frappe.get_doc({
+        'doctype': 'Fedex Postal Code',
+        'postal_code': postal_code,
+        'country_code': country_code,
+        'city': cstr(getattr(express_description, 'City', '')),
+        'state_or_province_code': cstr(getattr(express_description, 'StateOrProvinceCode', '')),
+        'location_id': cstr(getattr(express_description, 'LocationId', '')),
+        'is_valid': 1 if response else 0,
+        'looked_up_on': now_datetime()
+    })
+    doc_postal_code.flags.ignore_permissions = True
+    try:
+        doc_postal_code.insert()
+    except frappe.DuplicateEntryError:
+        # looked up by another request in the meantime
+        pass
+    return doc_postal_code
+
+
+def warm_up_postal_codes():
+    # preloads the postal codes of existing Address records not in the table yet
+    postal_codes = set()
+    for pincode, country in frappe.db.sql("""select distinct pincode, country from `tabAddress`
+            where ifnull(pincode, '')!='' and ifnull(country, '')!=''"""):
+        # addresses in countries Fedex does not know are skipped, not thrown at
+        country_name = countries.get_country(country)
+        if country_name:
+            postal_codes.add((normalize_postal_code(pincode), countries.COUNTRY_CODES[country_name]['iso_code_2']))
+    known = set(frappe.db.sql_list("""select name from `tabFedex Postal Code`"""))
+    postal_codes = [pc for pc in postal_codes if get_postal_code_name(*pc) not in known]
+
+    for i in range(0, len(postal_codes), WARM_UP_BATCH_SIZE):
+        get_postal_codes_details(postal_codes[i:i + WARM_UP_BATCH_SIZE])
+
+
+def get_postal_code_name(postal_code, country_code):
+    return '%s-%s' % (cstr(country_code).upper(), normalize_postal_code(postal_code))
+
+
+def normalize_postal_code(postal_code):
+    return cstr(postal_code).replace(' ', '').upper()
@@ -0,0 +1,107 @@
+from __future__ import unicode_literals
+
+import socket
+import time
+
+import frappe
+from frappe.utils import cint, now_datetime
+from frappe.utils.file_manager import get_files_path
+
+
+THERMAL_LABEL_IMAGE_TYPES = ('ZPLII', 'EPL2')
+DEFAULT_BATCH_SIZE = 20
+# seconds, a printer that stops answering must not hold the worker for ever
+DEFAULT_TIMEOUT = 10
+
+
+def is_thermal_label(doc_fedex_shipment):
+    return (doc_fedex_shipment.label_image_type or '').upper() in THERMAL_LABEL_IMAGE_TYPES
+
+
+def get_spool_key(printer_station):
+    return 'fedex_print_spool:%s' % printer_station
+
+
+def get_lock_key(printer_station):
+    return frappe.cache().make_key('fedex_print_lock:%s' % printer_station)
+
+
+def spool_shipment_labels(doc_fedex_shipment):
+    if not is_thermal_label(doc_fedex_shipment) or not doc_fedex_shipment.printer_station:
+        return
+
+    # spooled only once the submit is committed, the labels of a rolled back one never print
+    frappe.enqueue('fedex_shipment.printing.spool_labels', queue='short', enqueue_after_commit=True,
+                   fedex_shipment=doc_fedex_shipment.name)
+    frappe.msgprint('Fedex labels are sent to Printer Station %s' % doc_fedex_shipment.printer_station)
+
+
+def spool_labels(fedex_shipment):
+    doc_fedex_shipment = frappe.get_doc('Fedex Shipment', fedex_shipment)
+    if doc_fedex_shipment.docstatus != 1:
+        return
+
+    # labels are read back from the files create() saved, in SequenceNumber order
+    spool_key = get_spool_key(doc_fedex_shipment.printer_station)
+    for doc_package in doc_fedex_shipment.packages:
+        if doc_package.label_image:
+            with open(get_files_path(doc_package.label_image.split('/files/', 1)[-1]), 'rb') as label_file:
+                frappe.cache().rpush(spool_key, label_file.read())
+    print_spooled_labels(doc_fedex_shipment.printer_station)
+
+
+def print_spooled_labels(printer_station):
+    # one job at a time talks to a printer, the others leave the labels spooled for it
+    lock_key = get_lock_key(printer_station)
+    if not frappe.cache().set(lock_key, 1, nx=True, ex=10 * 60):
+        return
+
+    try:
+        station = frappe.db.get_value('Fedex Printer Station', printer_station,
+                                      ['host', 'port', 'batch_size', 'timeout'], as_dict=True)
+        if not station:
+            return
+        batch_size = cint(station.batch_size) or DEFAULT_BATCH_SIZE
+        spool_key = get_spool_key(printer_station)
+        while True:
+            batch = frappe.cache().lrange(spool_key, 0, batch_size - 1)
+            if not batch:
+                break
+
+            started = time.time()
+            send_to_printer(station.host, cint(station.port) or 9100, cint(station.timeout) or DEFAULT_TIMEOUT, batch)
+            frappe.cache().ltrim(spool_key, len(batch), -1)
+            update_station_throughput(printer_station, len(batch), time.time() - started)
+    finally:
+        frappe.cache().delete(lock_key)
+
+
+def print_all_spooled_labels():
+    for printer_station in frappe.db.sql_list("""select name from `tabFedex Printer Station`"""):
+        if frappe.cache().llen(get_spool_key(printer_station)):
+            print_spooled_labels(printer_station)
+
+
+def send_to_printer(host, port, timeout, labels):
+    # the whole batch goes over a single raw connection (JetDirect / port 9100)
+    connection = socket.create_connection((host, port), timeout)
+    try:
+        connection.sendall(b''.join(labels))
+    finally:
+        connection.close()
+
+
+def update_station_throughput(printer_station, labels_count, seconds):
+    frappe.db.sql("""update `tabFedex Printer Station`
+        set labels_printed = labels_printed + %(labels_count)s,
+            batches_printed = batches_printed + 1,
+            printing_seconds = printing_seconds + %(seconds)s,
+            labels_per_minute = 60 * labels_printed / greatest(printing_seconds, 0.001),
+            last_printed_on = %(now)s
+        where name = %(printer_station)s""", {
+        'labels_count': labels_count,
+        'seconds': seconds,
+        'now': now_datetime(),
+        'printer_station': printer_station
+    })
+    frappe.db.commit()
@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+
+import logging
+import time
+
+import frappe
+from frappe.utils import cint, flt
+
+import routing
+
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# longest a call waits for a token before it is sent anyway, in seconds
+MAX_WAIT = {INTERACTIVE: 30, BACKGROUND: 300}
+MIN_SLEEP, MAX_SLEEP = 0.01, 1.0
+
+# One bucket per Fedex Settings, shared by every web and background worker
+# of the site through redis. Takes a token and returns 0, or returns how many
+# seconds to wait before trying again. Background calls leave `reserve`
+# tokens in the bucket so interactive calls get through first.
+TAKE_TOKEN_SCRIPT = """
+local rate, burst, reserve, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(now - updated_at, 0) * rate)
+local wait = 0
+if tokens + 1e-6 >= reserve + 1 then
+    tokens = math.max(tokens - 1, 0)
+else
+    wait = (reserve + 1 - tokens) / rate
+end
+redis.call('hmset', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('expire', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+
+def get_priority():
+    # calls made while serving a web request are the ones someone waits for
+    return INTERACTIVE if getattr(frappe.local, 'request', None) else BACKGROUND
+
+
+def acquire(fedex_settings, priority=None):
+    # Blocks until the account of a request may call Fedex, returns the seconds waited.
+    priority = priority or get_priority()
+    limit = get_rate_limit(fedex_settings)
+    started = time.time()
+    if limit.rate:
+        reserve = 0 if priority == INTERACTIVE else min(limit.burst * limit.reserve, limit.burst - 1)
+        while True:
+            wait = flt(frappe.cache().eval(TAKE_TOKEN_SCRIPT, 1, get_bucket_key(fedex_settings),
+                                           limit.rate, limit.burst, reserve, time.time()))
+            if not wait:
+                break
+            if time.time() - started + wait > MAX_WAIT[priority]:
+                logger.warning('No Fedex rate limit token for %s in %ss, sending the %s call anyway',
+                               fedex_settings, MAX_WAIT[priority], priority)
+                break
+            time.sleep(min(max(wait, MIN_SLEEP), MAX_SLEEP))
+
+    waited = time.time() - started
+    routing.increment_counters(fedex_settings, {
+        priority + '_calls': 1,
+        priority + '_wait_ms': int(waited * 1000)
+    })
+    return waited
+
+
+def get_rate_limit(fedex_settings):
+    cache_key = get_cache_key(fedex_settings)
+    limit = frappe.cache().get_value(cache_key)
+    if limit is None:
+        values = frappe.db.get_value('Fedex Settings', fedex_settings,
+                                     ['api_calls_per_second', 'api_burst', 'api_interactive_reserve'], as_dict=True) or {}
+        limit = frappe._dict({
+            'rate': flt(values.get('api_calls_per_second')),
+            'burst': max(cint(values.get('api_burst')), 1),
+            'reserve': flt(values.get('api_interactive_reserve')) / 100
+        })
+        frappe.cache().set_value(cache_key, limit)
+    return limit
+
+
+def get_bucket_key(fedex_settings):
+    return frappe.cache().make_key('fedex_rate_limit_bucket:%s' % fedex_settings)
+
+
+def get_cache_key(fedex_settings):
+    return 'fedex_rate_limit:%s' % fedex_settings
+
+
+def clear_cache(doc, method=None):
+    frappe.cache().delete_value(get_cache_key(doc.name))
+    frappe.cache().delete(get_bucket_key(doc.name))
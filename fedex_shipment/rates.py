@@ -0,0 +1,132 @@
+from __future__ import unicode_literals
+
+import hashlib
+import json
+
+import frappe
+from frappe.utils import cint, cstr, flt
+
+import fedex_config
+import shipment
+import api
+import cartonization
+import metrics
+import routing
+import postal_codes
+import utils
+
+
+DEFAULT_RATE_CACHE_TTL = 30 * 60
+
+
+@frappe.whitelist()
+def get_rates(doctype, name, service_types=None):
+    if doctype == 'Fedex Shipment':
+        doc_fedex_shipment = frappe.get_doc(doctype, name)
+        doc_fedex_shipment.check_permission('read')
+    elif doctype == 'Delivery Note':
+        doc_fedex_shipment = make_shipment_for_rating(name)
+    else:
+        frappe.throw('Fedex rates can be requested for Fedex Shipment or Delivery Note only.')
+
+    if isinstance(service_types, basestring):
+        service_types = json.loads(service_types)
+    return get_quotes(doc_fedex_shipment, service_types)
+
+
+def make_shipment_for_rating(delivery_note):
+    doc_delivery_note = frappe.get_doc('Delivery Note', delivery_note)
+    doc_delivery_note.check_permission('read')
+    if not doc_delivery_note.shipping_address_name:
+        frappe.throw('Shipping Address is missed in Delivery Note %s' % doc_delivery_note.name)
+    warehouse = frappe.db.get('Warehouse', doc_delivery_note.items[0].warehouse)
+    if not warehouse:
+        frappe.throw('Delivery Note Item has no warehouse set.')
+
+    doc_fedex_shipment = frappe.new_doc('Fedex Shipment')
+    doc_fedex_shipment.fedex_settings = utils.get_fedex_settings(doc_delivery_note.company)
+    if not doc_fedex_shipment.fedex_settings:
+        frappe.throw('There is no Fedex Settings for Company %s' % doc_delivery_note.company)
+    doc_fedex_shipment.preferred_currency = doc_delivery_note.currency
+    shipment.set_shipper_address(doc_fedex_shipment, warehouse)
+    shipment.set_recipient_address(doc_fedex_shipment, frappe.db.get('Address', doc_delivery_note.shipping_address_name))
+
+    # the items are cartonized the way make_fedex_shipment does, with their weights converted to the box units
+    packages = cartonization.make_packages(doc_delivery_note.items,
+                                           cartonization.get_item_specs([d.item_code for d in doc_delivery_note.items]),
+                                           cartonization.get_boxes([doc_fedex_shipment.fedex_settings]).get(
+                                               doc_fedex_shipment.fedex_settings, []))
+    fedex_package = frappe.new_doc('Fedex Package')
+    for package in packages or [{}]:
+        doc_fedex_shipment.append('packages', {
+            'dimensions_units': package.get('dimensions_units') or fedex_package.dimensions_units,
+            'width': package.get('width') or fedex_package.width,
+            'height': package.get('height') or fedex_package.height,
+            'length': package.get('length') or fedex_package.length,
+            'weight_units': package.get('weight_units') or fedex_package.weight_units,
+            'weight_value': package.get('weight_value') or fedex_package.weight_value
+        })
+    return doc_fedex_shipment
+
+
+@metrics.timed('rate_quotes')
+def get_quotes(doc_fedex_shipment, service_types=None):
+    fedex_settings = frappe.db.get_value('Fedex Settings', doc_fedex_shipment.fedex_settings,
+                                         ['rate_service_types', 'rate_cache_ttl'], as_dict=True)
+    if service_types is None:
+        service_types = [st.strip() for st in (fedex_settings.rate_service_types or '').splitlines() if st.strip()]
+    # without enabled service types a single request quotes every available one
+    service_types = service_types or [None]
+    rate_cache_ttl = cint(fedex_settings.rate_cache_ttl) or DEFAULT_RATE_CACHE_TTL
+    # One account quotes every service type of a call, and the quotes are
+    # cached by it, as the negotiated rates differ between accounts.
+    rate_fedex_settings = routing.choose_fedex_settings(doc_fedex_shipment.fedex_settings)
+    config_obj = fedex_config.get(rate_fedex_settings)
+
+    quotes = {}
+    missing = []
+    for service_type in service_types:
+        cache_key = get_cache_key(doc_fedex_shipment, config_obj, service_type)
+        cached = frappe.cache().get_value(cache_key)
+        if cached is not None:
+            quotes[service_type] = cached
+        else:
+            missing.append((service_type, cache_key))
+
+    errors = []
+    if missing:
+        rate_requests = [shipment.make_rate_request(doc_fedex_shipment, config_obj, service_type, rate_fedex_settings)
+                         for service_type, cache_key in missing]
+        for (service_type, cache_key), rate_request, error in zip(missing, rate_requests,
+                api.send_requests(rate_requests, len(rate_requests))):
+            if error:
+                errors.append('%s: %s' % (service_type or 'All services', cstr(error)))
+                continue
+            quotes[service_type] = shipment.get_rate_quotes(rate_request)
+            # redis expires the quotes, every quoted route would stay otherwise
+            frappe.cache().set_value(cache_key, quotes[service_type], expires_in_sec=rate_cache_ttl)
+
+    if errors and not quotes:
+        frappe.throw('Cannot get rates from Fedex service:\n%s' % '\n'.join(errors))
+    return sorted([quote for service_type in service_types for quote in quotes.get(service_type, [])],
+                  key=lambda quote: quote['total_net_charge'])
+
+
+def get_cache_key(doc_fedex_shipment, config_obj, service_type):
+    packages = [(round(flt(p.weight_value), 1), p.weight_units, cint(p.length), cint(p.width), cint(p.height), p.dimensions_units)
+                for p in doc_fedex_shipment.packages]
+    key = [
+        postal_codes.normalize_postal_code(doc_fedex_shipment.shipper_address_postal_code),
+        doc_fedex_shipment.shipper_address_country_code,
+        postal_codes.normalize_postal_code(doc_fedex_shipment.recipient_address_postal_code),
+        doc_fedex_shipment.recipient_address_country_code,
+        cint(doc_fedex_shipment.recipient_address_residential),
+        packages,
+        service_type,
+        doc_fedex_shipment.drop_off_type,
+        doc_fedex_shipment.packaging_type,
+        doc_fedex_shipment.payment_type,
+        doc_fedex_shipment.preferred_currency,
+        config_obj.account_number
+    ]
+    return 'fedex_rates:%s' % hashlib.md5(json.dumps(key, sort_keys=True)).hexdigest()
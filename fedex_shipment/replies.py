@@ -0,0 +1,148 @@
+from __future__ import unicode_literals
+
+import base64
+import datetime
+import json
+import zlib
+
+import frappe
+from frappe.utils import cstr, flt
+
+from suds.sudsobject import Object
+
+import utils
+
+
+RATE_AMOUNTS = {
+    'TotalNetCharge': 'total_net_charge',
+    'TotalNetFedExCharge': 'total_net_fedex_charge',
+    'TotalTaxes': 'total_taxes',
+    'TotalBaseCharge': 'total_base_charge',
+    'TotalNetFreight': 'total_net_freight',
+    'TotalSurcharges': 'total_surcharges',
+    'TotalRebates': 'total_rebates',
+    'TotalFreightDiscounts': 'total_freight_discounts'
+}
+
+
+def summarize(response):
+    # the parts of a ship reply the app uses, small enough to keep on every Fedex Shipment
+    completed_shipment_detail = getattr(response, 'CompletedShipmentDetail', None)
+    master_tracking_id = getattr(completed_shipment_detail, 'MasterTrackingId', None)
+    shipment_rating = getattr(completed_shipment_detail, 'ShipmentRating', None)
+    return {
+        'severity': cstr(getattr(response, 'HighestSeverity', '')),
+        'notifications': [{
+            'severity': cstr(getattr(notification, 'Severity', '')),
+            'code': cstr(getattr(notification, 'Code', '')),
+            'message': cstr(getattr(notification, 'Message', ''))
+        } for notification in getattr(response, 'Notifications', None) or []],
+        'master_tracking_number': cstr(getattr(master_tracking_id, 'TrackingNumber', '')),
+        'tracking_numbers': [cstr(tracking_id.TrackingNumber)
+                             for package_detail in getattr(completed_shipment_detail, 'CompletedPackageDetails', None) or []
+                             for tracking_id in getattr(package_detail, 'TrackingIds', None) or []],
+        'actual_rate_type': cstr(getattr(shipment_rating, 'ActualRateType', '')),
+        'rate_details': [get_rate_detail(shipment_rate_detail)
+                         for shipment_rate_detail in getattr(shipment_rating, 'ShipmentRateDetails', None) or []]
+    }
+
+
+def get_rate_detail(shipment_rate_detail):
+    # every total of a ShipmentRateDetail, of a ship or a rate reply
+    rate_detail = {'rate_type': cstr(getattr(shipment_rate_detail, 'RateType', '')), 'currency': ''}
+    for fedex_field, field in RATE_AMOUNTS.items():
+        money = getattr(shipment_rate_detail, fedex_field, None)
+        rate_detail[field] = flt(getattr(money, 'Amount', 0))
+        rate_detail['currency'] = rate_detail['currency'] or cstr(getattr(money, 'Currency', ''))
+    exchange_rate = getattr(shipment_rate_detail, 'CurrencyExchangeRate', None)
+    if exchange_rate is not None:
+        rate_detail.update({
+            'from_currency': cstr(exchange_rate.FromCurrency),
+            'into_currency': cstr(exchange_rate.IntoCurrency),
+            'exchange_rate': flt(exchange_rate.Rate)
+        })
+    return rate_detail
+
+
+def choose_rate_detail(rate_details, actual_rate_type):
+    return ([d for d in rate_details if d['rate_type'] == actual_rate_type] or rate_details)[0]
+
+
+def get_totals(summaries, required_currency=None):
+    # The total_* fields and totals_currency of a shipment from the summaries
+    # of its replies. The shipment rating comes with the reply that completed
+    # the shipment, the last child one of a multi-piece shipment. Amounts are
+    # converted to required_currency with the exchange rate Fedex sent or the
+    # rate of the day, and left in the Fedex currency if there is none.
+    rated = [summary for summary in summaries if summary['rate_details']]
+    if not rated:
+        return {}
+    rate_detail = choose_rate_detail(rated[-1]['rate_details'], rated[-1]['actual_rate_type'])
+    actual_currency = rate_detail['currency']
+    required_currency = required_currency or actual_currency
+
+    from_currency, into_currency = rate_detail.get('from_currency', ''), rate_detail.get('into_currency', '')
+    rate = rate_detail.get('exchange_rate')
+    if rate:
+        utils.cache_exchange_rate(from_currency, into_currency, rate)
+    if required_currency.upper() != actual_currency.upper() and \
+            set([from_currency.upper(), into_currency.upper()]) != set([required_currency.upper(), actual_currency.upper()]):
+        from_currency, into_currency = actual_currency, required_currency
+        rate = utils.get_exchange_rate(actual_currency, required_currency)
+    if required_currency.upper() != actual_currency.upper() and not rate:
+        required_currency = actual_currency
+
+    totals = {'totals_currency': required_currency}
+    for field in RATE_AMOUNTS.values():
+        totals[field] = utils.get_amount(required_currency, actual_currency, rate_detail.get(field),
+                                         from_currency, into_currency, rate)
+    return totals
+
+
+def to_dict(value):
+    # suds objects as plain values, without the label images saved as files already
+    if isinstance(value, Object):
+        return dict((name, to_dict(item)) for name, item in value if name != 'Image')
+    if isinstance(value, (list, tuple)):
+        return [to_dict(item) for item in value]
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def compress(replies):
+    reply_json = json.dumps(replies, separators=(',', ':'), default=cstr)
+    return base64.b64encode(zlib.compress(reply_json.encode('utf-8'), 6)), len(reply_json)
+
+
+def decompress(compressed_replies):
+    return json.loads(zlib.decompress(base64.b64decode(compressed_replies)).decode('utf-8'))
+
+
+def save_full_replies(doc_fedex_shipment, responses):
+    store(doc_fedex_shipment.name, [to_dict(response) for response in responses])
+
+
+def store(fedex_shipment, reply_values):
+    compressed_replies, reply_size = compress(reply_values)
+    frappe.db.sql("""delete from `tabFedex Shipment Reply` where name=%s""", fedex_shipment)
+    doc_reply = frappe.get_doc({
+        'doctype': 'Fedex Shipment Reply',
+        'fedex_shipment': fedex_shipment,
+        'reply_size': reply_size,
+        'compressed_replies': compressed_replies
+    })
+    doc_reply.flags.ignore_permissions = True
+    doc_reply.flags.ignore_links = True
+    doc_reply.insert()
+
+
+@frappe.whitelist()
+def get_full_replies(fedex_shipment):
+    frappe.get_doc('Fedex Shipment', fedex_shipment).check_permission('read')
+    compressed_replies = frappe.db.get_value('Fedex Shipment Reply', fedex_shipment, 'compressed_replies')
+    return decompress(compressed_replies) if compressed_replies else None
+
+
+def delete_full_replies(doc, method=None):
+    frappe.db.sql("""delete from `tabFedex Shipment Reply` where name=%s""", doc.name)
@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import random
+import time
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+import fedex_config
+import transport
+import utils
+
+
+# weight of the latest call in the moving averages of latency and error rate
+EWMA_ALPHA = 0.2
+# latency assumed for an account that was not called yet, in seconds
+DEFAULT_LATENCY = 1.0
+MIN_LATENCY = 0.05
+# how much an error rate of 100% divides the share of an account
+ERROR_PENALTY = 10
+# seconds a meter that returned a throttling error is left alone
+THROTTLE_COOLDOWN = 60
+# HTTP statuses Fedex answers with when a meter calls too often
+THROTTLING_HTTP_STATUSES = (429, 503)
+COUNTERS = ('calls', 'errors', 'throttled', 'latency_ms',
+            'interactive_calls', 'interactive_wait_ms', 'background_calls', 'background_wait_ms')
+
+
+def choose_fedex_settings(fedex_settings):
+    # One of the Fedex Settings interchangeable with the given one, picked at
+    # random with a share inversely proportional to its recent latency and
+    # error rate. Meters throttled by Fedex are skipped while they cool down.
+    candidates = get_candidates(fedex_settings)
+    if len(candidates) < 2:
+        return fedex_settings
+
+    now = time.time()
+    healths = [(candidate, get_health(candidate)) for candidate in candidates]
+    available = [(candidate, health) for candidate, health in healths if health.get('throttled_until', 0) <= now]
+    if not available:
+        # every meter is throttled, the one free again soonest is used
+        return min(healths, key=lambda candidate_health: candidate_health[1]['throttled_until'])[0]
+
+    weights = [1.0 / (max(health.get('latency', DEFAULT_LATENCY), MIN_LATENCY) *
+                      (1 + ERROR_PENALTY * health.get('error_rate', 0.0)))
+               for candidate, health in available]
+    point = random.uniform(0, sum(weights))
+    for (candidate, health), weight in zip(available, weights):
+        point -= weight
+        if point <= 0:
+            return candidate
+    return available[-1][0]
+
+
+def get_candidates(fedex_settings):
+    use_test_server = fedex_config.get(fedex_settings).use_test_server
+    return [fs for fs in utils.get_interchangeable_fedex_settings(fedex_settings)
+            if fedex_config.get(fs).use_test_server == use_test_server]
+
+
+def record_calls(calls):
+    # (request, seconds, exception or None) of finished calls, recorded from
+    # the calling thread: moving averages for the routing and counters for
+    # the Fedex Settings form
+    calls_by_fedex_settings = {}
+    for request, elapsed, error in calls:
+        fedex_settings = getattr(request, 'fedex_settings', None)
+        if fedex_settings:
+            calls_by_fedex_settings.setdefault(fedex_settings, []).append((elapsed, error))
+
+    now = time.time()
+    for fedex_settings, fs_calls in calls_by_fedex_settings.items():
+        health = get_health(fedex_settings)
+        counters = dict.fromkeys(COUNTERS, 0)
+        for elapsed, error in fs_calls:
+            health['latency'] = ewma(health.get('latency'), elapsed)
+            health['error_rate'] = ewma(health.get('error_rate'), 1.0 if error else 0.0)
+            counters['calls'] += 1
+            counters['latency_ms'] += int(elapsed * 1000)
+            if error:
+                counters['errors'] += 1
+                if is_throttling_error(error):
+                    counters['throttled'] += 1
+                    health['throttled_until'] = now + THROTTLE_COOLDOWN
+        frappe.cache().set_value(get_health_key(fedex_settings), health)
+        increment_counters(fedex_settings, counters)
+
+
+def set_unavailable(fedex_settings, until):
+    health = get_health(fedex_settings)
+    health['throttled_until'] = max(health.get('throttled_until', 0), until)
+    frappe.cache().set_value(get_health_key(fedex_settings), health)
+
+
+def increment_counters(fedex_settings, counters):
+    for counter, value in counters.items():
+        if value:
+            frappe.cache().incrby(get_counter_key(fedex_settings, counter), value)
+
+
+def ewma(average, value):
+    return value if average is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * average
+
+
+def is_throttling_error(error):
+    # by the HTTP status only, a message may hold any digits of a tracking number or an amount
+    return transport.get_http_status(error) in THROTTLING_HTTP_STATUSES
+
+
+def get_health(fedex_settings):
+    return frappe.cache().get_value(get_health_key(fedex_settings)) or {}
+
+
+def get_health_key(fedex_settings):
+    return 'fedex_account_health:%s' % fedex_settings
+
+
+def get_counter_key(fedex_settings, counter):
+    return frappe.cache().make_key('fedex_account_counter:%s:%s' % (fedex_settings, counter))
+
+
+def flush_account_counters():
+    # moves the call counters kept in redis to the Fedex Settings records
+    for fedex_settings in frappe.db.sql_list("""select name from `tabFedex Settings`"""):
+        counters = {}
+        for counter in COUNTERS:
+            counters[counter] = cint(frappe.cache().get(get_counter_key(fedex_settings, counter)))
+            if counters[counter]:
+                frappe.cache().incrby(get_counter_key(fedex_settings, counter), -counters[counter])
+        if not any(counters.values()):
+            continue
+
+        # the averages go first, MySQL assigns from left to right
+        frappe.db.sql("""update `tabFedex Settings`
+            set api_average_latency = (api_average_latency * api_calls + %(latency)s)
+                    / greatest(api_calls + %(calls)s, 1),
+                api_average_interactive_wait = (api_average_interactive_wait * api_interactive_calls + %(interactive_wait)s)
+                    / greatest(api_interactive_calls + %(interactive_calls)s, 1),
+                api_average_background_wait = (api_average_background_wait * api_background_calls + %(background_wait)s)
+                    / greatest(api_background_calls + %(background_calls)s, 1),
+                api_calls = api_calls + %(calls)s,
+                api_interactive_calls = api_interactive_calls + %(interactive_calls)s,
+                api_background_calls = api_background_calls + %(background_calls)s,
+                api_errors = api_errors + %(errors)s,
+                api_throttled = api_throttled + %(throttled)s,
+                api_counters_updated_on = %(now)s
+            where name = %(fedex_settings)s""", {
+            'latency': counters['latency_ms'] / 1000.0,
+            'calls': counters['calls'],
+            'errors': counters['errors'],
+            'throttled': counters['throttled'],
+            'interactive_calls': counters['interactive_calls'],
+            'interactive_wait': counters['interactive_wait_ms'] / 1000.0,
+            'background_calls': counters['background_calls'],
+            'background_wait': counters['background_wait_ms'] / 1000.0,
+            'now': now_datetime(),
+            'fedex_settings': fedex_settings
+        })
+    frappe.db.commit()
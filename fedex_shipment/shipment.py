@@ -4,48 +4,33 @@ from __future__ import unicode_literals
 import logging
 import base64
 import json
-import StringIO
-
-from reportlab.lib.units import inch
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfgen import canvas
 
 import frappe
 from frappe.utils.file_manager import save_file, get_file, get_files_path
-from frappe.utils import cstr, flt
+from frappe.utils import cint, cstr, flt
 from frappe.model.mapper import get_mapped_doc
 
 from fedex.services.ship_service import FedexProcessShipmentRequest
 from fedex.services.ship_service import FedexDeleteShipmentRequest
-from fedex.services.track_service import FedexTrackRequest
 from fedex.services.rate_service import FedexRateServiceRequest
-from fedex.services.package_movement import PostalCodeInquiryRequest
-from fedex.services.address_validation_service import FedexAddressValidationRequest
 
 import fedex_config
+import client_pool
+import api
+import ratelimit
+import routing
+import cache_invalidation
+import labels
+import printing
 import countries
 import utils
+import address_validation
+import cartonization
+import replies
+import metrics
 
 
-# Set this to the INFO level to see the response from Fedex printed in stdout.
-logging.basicConfig(level=logging.DEBUG)
-
-
-PDF_CANVAS_SIZE_MAPPING = {
-    "PAPER_4X6": (4 * inch, 6 * inch),
-    "PAPER_4X8": (4 * inch, 8 * inch),
-    "PAPER_4X9": (4 * inch, 9 * inch),
-    "PAPER_7X4.75": (7 * inch, 4.75 * inch),
-    "PAPER_8.5X11_BOTTOM_HALF_LABEL": (8.5 * inch, 11 * inch),
-    "PAPER_8.5X11_TOP_HALF_LABEL": (8.5 * inch, 11 * inch),
-    "STOCK_4X6": (4 * inch, 6 * inch),
-    "STOCK_4X6.75_LEADING_DOC_TAB": (4 * inch, 6.75 * inch),
-    "STOCK_4X6.75_TRAILING_DOC_TAB": (4 * inch, 6.75 * inch),
-    "STOCK_4X8": (4 * inch, 8 * inch),
-    "STOCK_4X9_LEADING_DOC_TAB": (4 * inch, 9 * inch),
-    "STOCK_4X9_TRAILING_DOC_TAB": (4 * inch, 9 * inch),
-    "PAPER \"6X4\"": (6 * inch, 4 * inch)
-}
+logger = logging.getLogger(__name__)
 
 
 def validate(doc, method=None):
@@ -53,10 +38,70 @@ def validate(doc, method=None):
 
 
 def before_submit(doc, method=None):
-    create(doc)
+    if not doc.flags.create_labels_now and \
+            cint(frappe.db.get_value('Fedex Settings', doc.fedex_settings, 'create_labels_in_background')):
+        doc.label_status = 'Queued'
+    else:
+        create(doc)
+        doc.label_status = 'Labels Ready'
 
 
 def on_submit(doc, method=None):
+    if doc.label_status == 'Queued':
+        enqueue_labels_creation(doc.name)
+    else:
+        update_tracking_numbers(doc)
+        printing.spool_shipment_labels(doc)
+        cache_invalidation.clear_shipment_cache(doc)
+
+
+def enqueue_labels_creation(fedex_shipment):
+    frappe.enqueue('fedex_shipment.shipment.create_labels', queue='short', enqueue_after_commit=True,
+                   fedex_shipment=fedex_shipment)
+
+
+def create_labels(fedex_shipment):
+    doc = frappe.get_doc('Fedex Shipment', fedex_shipment)
+    if doc.docstatus != 1 or doc.label_status != 'Queued':
+        return
+
+    try:
+        create(doc)
+    except Exception as ex:
+        frappe.db.rollback()
+        frappe.db.set_value('Fedex Shipment', fedex_shipment, {
+            'label_status': 'Failed',
+            'label_error': cstr(ex) or ex.__class__.__name__
+        })
+        frappe.db.commit()
+        frappe.publish_realtime('fedex_labels_failed', {'fedex_shipment': fedex_shipment},
+                                doctype=doc.doctype, docname=doc.name)
+        return
+
+    doc.label_status = 'Labels Ready'
+    doc.label_error = None
+    doc.db_update()
+    for doc_package in doc.packages:
+        doc_package.db_update()
+    update_tracking_numbers(doc)
+    printing.spool_shipment_labels(doc)
+    frappe.db.commit()
+    cache_invalidation.clear_shipment_cache(doc)
+    frappe.publish_realtime('fedex_labels_ready', {'fedex_shipment': fedex_shipment},
+                            doctype=doc.doctype, docname=doc.name)
+
+
+@frappe.whitelist()
+def retry_labels_creation(fedex_shipment):
+    doc = frappe.get_doc('Fedex Shipment', fedex_shipment)
+    doc.check_permission('submit')
+    if doc.docstatus != 1 or doc.label_status != 'Failed':
+        frappe.throw('Labels can be created again only for submitted Fedex Shipment with failed labels.')
+    frappe.db.set_value('Fedex Shipment', fedex_shipment, 'label_status', 'Queued')
+    enqueue_labels_creation(fedex_shipment)
+
+
+def update_tracking_numbers(doc):
     if not frappe.db.get_value('Packing Slip', doc.packing_slip, 'oc_tracking_number'):
         frappe.db.set_value('Packing Slip', doc.packing_slip, 'oc_tracking_number', doc.tracking_number)
         frappe.msgprint('Tracking number was updated for Packing Slip %s' % doc.packing_slip)
@@ -73,37 +118,17 @@ def on_submit(doc, method=None):
 
     if not frappe.db.get_value('Packing Slip', doc.packing_slip, 'fedex_shipment'):
         frappe.db.set_value('Packing Slip', doc.packing_slip, 'fedex_shipment', doc.name)
-    frappe.clear_cache()
 
 
 def before_cancel(doc, method=None):
-    delete(doc)
-
-
-def make_pdf_canvas(doc_fedex_shipment):
-    if doc_fedex_shipment.label_image_type.lower() == "png":
-        marging = 0.25
-        width, height = PDF_CANVAS_SIZE_MAPPING.get('label_stock_type', (4 * inch, 6 * inch))
-        c = canvas.Canvas('fedex_labels.pdf', pagesize=(width + marging * inch, height + marging * inch))
-        return c, width, height, marging
-    else:
-        [None] * 4
-
+    # labels that were queued or failed have nothing to delete in Fedex
+    if doc.tracking_number:
+        delete(doc)
 
-def add_label_to_canvas(pdf_canvas, width, height, marging, label_image_data):
-    if pdf_canvas:
-        image_reader = ImageReader(StringIO.StringIO(label_image_data))
-        pdf_canvas.drawImage(image_reader, marging, marging, width, height, preserveAspectRatio=True)
-        pdf_canvas.showPage()
-
-
-def create(doc_fedex_shipment):
-    # init stuff
-    pdf_canvas, canvas_img_width, canvas_img_height, canvas_img_marging = make_pdf_canvas(doc_fedex_shipment)
-    config_obj = fedex_config.get(doc_fedex_shipment.fedex_settings)
 
+def make_shipment_request(doc_fedex_shipment, config_obj):
     # This is the object that will be handling our tracking request.
-    shipment = FedexProcessShipmentRequest(config_obj)
+    shipment = client_pool.get_request(FedexProcessShipmentRequest, doc_fedex_shipment.fedex_settings, config_obj)
 
     # This is very generalized, top-level information.
     # REGULAR_PICKUP, REQUEST_COURIER, DROP_BOX, BUSINESS_SERVICE_CENTER or STATION
@@ -170,29 +195,48 @@ def create(doc_fedex_shipment):
     # BOTTOM_EDGE_OF_TEXT_FIRST or TOP_EDGE_OF_TEXT_FIRST
     shipment.RequestedShipment.LabelSpecification.LabelPrintingOrientation = doc_fedex_shipment.label_printing_orientation
 
-    doc_master_package = doc_fedex_shipment.packages[0]
+    shipment.RequestedShipment.PackageCount = len(doc_fedex_shipment.packages)
+    shipment.RequestedShipment.TotalWeight.Units = doc_fedex_shipment.packages[0].weight_units
+    shipment.RequestedShipment.TotalWeight.Value = sum(flt(p.weight_value) for p in doc_fedex_shipment.packages)
+    return shipment
+
+
+def set_shipment_request_package(shipment, doc_package, sequence_number):
     package = shipment.create_wsdl_object_of_type('RequestedPackageLineItem')
     package.PhysicalPackaging = 'BOX'
 
     # adding weight
     package_weight = shipment.create_wsdl_object_of_type('Weight')
-    package_weight.Units = doc_master_package.weight_units
-    package_weight.Value = doc_master_package.weight_value
+    package_weight.Units = doc_package.weight_units
+    package_weight.Value = doc_package.weight_value
     package.Weight = package_weight
 
     # adding dimensions
     package_dimensions = shipment.create_wsdl_object_of_type('Dimensions')
-    package_dimensions.Units = doc_master_package.dimensions_units
-    package_dimensions.Length = doc_master_package.length
-    package_dimensions.Width = doc_master_package.width
-    package_dimensions.Height = doc_master_package.height
+    package_dimensions.Units = doc_package.dimensions_units
+    package_dimensions.Length = doc_package.length
+    package_dimensions.Width = doc_package.width
+    package_dimensions.Height = doc_package.height
     package.Dimensions = package_dimensions
 
-    package.SequenceNumber = 1
+    package.SequenceNumber = sequence_number
     shipment.RequestedShipment.RequestedPackageLineItems = [package]
-    shipment.RequestedShipment.PackageCount = len(doc_fedex_shipment.packages)
-    shipment.RequestedShipment.TotalWeight.Units = doc_fedex_shipment.packages[0].weight_units
-    shipment.RequestedShipment.TotalWeight.Value = sum(flt(p.weight_value) for p in doc_fedex_shipment.packages)
+
+
+@metrics.timed('create')
+def create(doc_fedex_shipment):
+    # init stuff
+    timings = metrics.Timings('create')
+    # the master and child packages, and later the deletion, go through the same account
+    with timings.stage('route'):
+        doc_fedex_shipment.fedex_settings = routing.choose_fedex_settings(doc_fedex_shipment.fedex_settings)
+        config_obj = fedex_config.get(doc_fedex_shipment.fedex_settings)
+
+    shipment = make_shipment_request(doc_fedex_shipment, config_obj)
+    doc_master_package = doc_fedex_shipment.packages[0]
+    set_shipment_request_package(shipment, doc_master_package, 1)
+    master_shipment = shipment
+    child_shipments = []
 
     # shipment.RequestedShipment.CustomsClearanceDetail = shipment.create_wsdl_object_of_type('CustomsClearanceDetail')
     # shipment.RequestedShipment.CustomsClearanceDetail.DutiesPayment = new Payment();
@@ -224,8 +268,10 @@ def create(doc_fedex_shipment):
     # shipment.send_validation_request()
 
     # Fires off the request, sets the 'response' attribute on the object.
+    # labels are waited for even when created in a background job
     try:
-        shipment.send_request()
+        with timings.stage('ship_master'):
+            api.send_request(shipment, ratelimit.INTERACTIVE)
     except Exception as ex:
         frappe.throw('Fedex API: ' + cstr(ex))
     # frappe.msgprint('11111---' * 100 + cstr(shipment.response))
@@ -274,56 +320,44 @@ def create(doc_fedex_shipment):
     # print "Net Shipping Cost (US$):", shipment.response.CompletedShipmentDetail.CompletedPackageDetails[0].PackageRating.PackageRateDetails[0].NetCharge.Amount
 
     master_tracking_number = shipment.response.CompletedShipmentDetail.CompletedPackageDetails[0].TrackingIds[0].TrackingNumber
-    label_image_data = base64.b64decode(shipment.response.CompletedShipmentDetail.CompletedPackageDetails[0].Label.Parts[0].Image)
-    saved_file = save_file('fedex_label_%s.%s' % (master_tracking_number, doc_fedex_shipment.label_image_type.lower()), label_image_data, doc_fedex_shipment.doctype, doc_fedex_shipment.name)
-    add_label_to_canvas(pdf_canvas, canvas_img_width, canvas_img_height, canvas_img_marging, label_image_data)
-
-    doc_master_package.update({
-        'tracking_number': master_tracking_number,
-        'label_image': saved_file.file_url
-    })
-
-    doc_fedex_shipment.update({
-        'tracking_number': master_tracking_number,
-        'label_image': saved_file.file_url,
-        # 'status': shipment.response.HighestSeverity,
-        'total_net_charge': shipment.response.HighestSeverity,
-        'total_net_fedex_charge': shipment.response.HighestSeverity,
-        'total_taxes': shipment.response.HighestSeverity,
-        'total_base_charge': shipment.response.HighestSeverity,
-        'total_net_freight': shipment.response.HighestSeverity,
-        'total_surcharges': shipment.response.HighestSeverity,
-        'total_rebates': shipment.response.HighestSeverity,
-        'total_freight_discounts': shipment.response.HighestSeverity,
-        'raw_response': cstr(shipment.response)
-    })
 
+    # from here the master shipment exists in Fedex, whatever fails rolls it back
+    label_merger = None
     try:
+        label_merger = labels.make_label_merger(doc_fedex_shipment)
+        with timings.stage('decode'):
+            label_image_data = base64.b64decode(shipment.response.CompletedShipmentDetail.CompletedPackageDetails[0].Label.Parts[0].Image)
+        with timings.stage('save_file'):
+            saved_file = save_file('fedex_label_%s.%s' % (master_tracking_number, doc_fedex_shipment.label_image_type.lower()), label_image_data, doc_fedex_shipment.doctype, doc_fedex_shipment.name)
+        with timings.stage('spool_label'):
+            label_merger and label_merger.add_label(label_image_data)
+
+        doc_master_package.update({
+            'tracking_number': master_tracking_number,
+            'label_image': saved_file.file_url
+        })
+
+        doc_fedex_shipment.update({
+            'tracking_number': master_tracking_number,
+            'label_image': saved_file.file_url
+        })
+
         if len(doc_fedex_shipment.packages) > 1:
-            shipment.RequestedShipment.MasterTrackingId.TrackingNumber = master_tracking_number
-            shipment.RequestedShipment.MasterTrackingId.TrackingIdType.value = 'EXPRESS'
             for i, doc_package in enumerate(doc_fedex_shipment.packages[1:]):
-                package = shipment.create_wsdl_object_of_type('RequestedPackageLineItem')
-                package.PhysicalPackaging = 'BOX'
-
-                # adding weight
-                package_weight = shipment.create_wsdl_object_of_type('Weight')
-                package_weight.Units = doc_package.weight_units
-                package_weight.Value = doc_package.weight_value
-                package.Weight = package_weight
-
-                # adding dimensions
-                package_dimensions = shipment.create_wsdl_object_of_type('Dimensions')
-                package_dimensions.Units = doc_package.dimensions_units
-                package_dimensions.Length = doc_package.length
-                package_dimensions.Width = doc_package.width
-                package_dimensions.Height = doc_package.height
-                package.Dimensions = package_dimensions
-
-                package.SequenceNumber = i + 2
-                shipment.RequestedShipment.RequestedPackageLineItems = [package]
-                shipment.RequestedShipment.PackageCount = len(doc_fedex_shipment.packages)
-                shipment.send_request()
+                child_shipment = make_shipment_request(doc_fedex_shipment, config_obj)
+                child_shipment.RequestedShipment.MasterTrackingId.TrackingNumber = master_tracking_number
+                child_shipment.RequestedShipment.MasterTrackingId.TrackingIdType.value = 'EXPRESS'
+                set_shipment_request_package(child_shipment, doc_package, i + 2)
+                child_shipments.append(child_shipment)
+
+            parallelism = frappe.db.get_value('Fedex Settings', doc_fedex_shipment.fedex_settings, 'child_package_parallelism')
+            with timings.stage('ship_children'):
+                errors = api.send_requests(child_shipments, parallelism, ratelimit.INTERACTIVE)
+
+            # replies are handled in SequenceNumber order, whatever order they came back in
+            for doc_package, shipment, error in zip(doc_fedex_shipment.packages[1:], child_shipments, errors):
+                if error:
+                    raise error
 
                 msg = ''
                 try:
@@ -347,32 +381,42 @@ def create(doc_fedex_shipment):
 
                 # updating shipment package items
                 tracking_number = shipment.response.CompletedShipmentDetail.CompletedPackageDetails[0].TrackingIds[0].TrackingNumber
-                label_image_data = base64.b64decode(shipment.response.CompletedShipmentDetail.CompletedPackageDetails[0].Label.Parts[0].Image)
-                saved_file = save_file('fedex_label_%s.%s' % (tracking_number, doc_fedex_shipment.label_image_type.lower()), label_image_data, doc_fedex_shipment.doctype, doc_fedex_shipment.name)
+                with timings.stage('decode'):
+                    label_image_data = base64.b64decode(shipment.response.CompletedShipmentDetail.CompletedPackageDetails[0].Label.Parts[0].Image)
+                with timings.stage('save_file'):
+                    saved_file = save_file('fedex_label_%s.%s' % (tracking_number, doc_fedex_shipment.label_image_type.lower()), label_image_data, doc_fedex_shipment.doctype, doc_fedex_shipment.name)
                 doc_package.update({
                     'tracking_number': tracking_number,
                     'label_image': saved_file.file_url
                 })
-                add_label_to_canvas(pdf_canvas, canvas_img_width, canvas_img_height, canvas_img_marging, label_image_data)
+                with timings.stage('spool_label'):
+                    label_merger and label_merger.add_label(label_image_data)
 
         # complete pdf doc
         try:
-            pdf_canvas and save_file('all_fedex_labels_%s.pdf' % master_tracking_number, pdf_canvas.getpdfdata(), doc_fedex_shipment.doctype, doc_fedex_shipment.name)
+            with timings.stage('merge_pdf'):
+                label_merger and label_merger.save('all_fedex_labels_%s.pdf' % master_tracking_number, doc_fedex_shipment.doctype, doc_fedex_shipment.name)
         except Exception as ex:
             frappe.msgprint('Cannot merge Fedex labels to PDF file:\n' + cstr(ex))
     except Exception as ex:
-        delete(doc_fedex_shipment)
+        # the user gets the error at once, the master package is deleted in the background
+        enqueue_rollback(doc_fedex_shipment.fedex_settings, master_tracking_number)
         frappe.throw(cstr(ex))
+    finally:
+        label_merger and label_merger.close()
+
+    with timings.stage('replies'):
+        responses = [request.response for request in [master_shipment] + child_shipments]
+        summaries = [replies.summarize(response) for response in responses]
+        doc_fedex_shipment.fedex_replies = json.dumps(summaries, indent=1, separators=(',', ': '))
+        if cint(frappe.db.get_value('Fedex Settings', doc_fedex_shipment.fedex_settings, 'store_full_replies')):
+            replies.save_full_replies(doc_fedex_shipment, responses)
+
     try:
-        for shipment_rate_detail in shipment.response.CompletedShipmentDetail.ShipmentRating.ShipmentRateDetails:
-            if shipment_rate_detail.RateType == shipment.response.CompletedShipmentDetail.ShipmentRating.ActualRateType:
-                doc_fedex_shipment.update({
-                    'total_net_charge': flt(shipment_rate_detail.TotalNetCharge.Amount),
-                    'totals_currency': cstr(shipment_rate_detail.TotalNetCharge.Currency)
-                })
-                break
+        doc_fedex_shipment.update(replies.get_totals(summaries, doc_fedex_shipment.preferred_currency))
     except Exception as ex:
         frappe.msgprint('Cannot update Total Amounts: %s' % cstr(ex))
+    doc_fedex_shipment.fedex_timings = timings.as_json()
 
     # del_request.TrackingId.TrackingIdType = 'EXPRESS'
         # for i, doc_package in enumerate(doc_fedex_shipment.packages):
@@ -392,43 +436,13 @@ def create(doc_fedex_shipment):
         #     })
         #     doc_package.save()
 
-    """
-    This is an example of how to dump a label to a PNG file.
-    """
-    # This will be the file we write the label out to.
-    # png_file = open('example_shipment_label.png', 'wb')
-    # png_file.write(label_binary_data)
-    # png_file.close()
-
-    """
-    This is an example of how to print the label to a serial printer. This will not
-    work for all label printers, consult your printer's documentation for more
-    details on what formats it can accept.
-    """
-    # Pipe the binary directly to the label printer. Works under Linux
-    # without requiring PySerial. This WILL NOT work on other platforms.
-    # label_printer = open("/dev/ttyS0", "w")
-    # label_printer.write(label_binary_data)
-    # label_printer.close()
-
-    """
-    This is a potential cross-platform solution using pySerial. This has not been
-    tested in a long time and may or may not work. For Windows, Mac, and other
-    platforms, you may want to go this route.
-    """
-    # import serial
-    # label_printer = serial.Serial(0)
-    # print "SELECTED SERIAL PORT: "+ label_printer.portstr
-    # label_printer.write(label_binary_data)
-    # label_printer.close()
-    frappe.clear_cache()
-
 
+@metrics.timed('create_freight')
 def create_freight(doc_fedex_shipment):
     config_obj = fedex_config.get(doc_fedex_shipment.fedex_settings)
 
     # This is the object that will be handling our tracking request.
-    shipment = FedexProcessShipmentRequest(config_obj)
+    shipment = client_pool.get_request(FedexProcessShipmentRequest, doc_fedex_shipment.fedex_settings, config_obj)
     shipment.RequestedShipment.DropoffType = 'REGULAR_PICKUP'
     shipment.RequestedShipment.ServiceType = 'FEDEX_FREIGHT_ECONOMY'
     shipment.RequestedShipment.PackagingType = 'YOUR_PACKAGING'
@@ -534,7 +548,7 @@ def create_freight(doc_fedex_shipment):
     # shipment.send_validation_request()
 
     # Fires off the request, sets the 'response' attribute on the object.
-    shipment.send_request()
+    api.send_request(shipment)
 
     # This will show the reply to your shipment being sent. You can access the
     # attributes through the response attribute on the request object. This is
@@ -587,28 +601,13 @@ def create_freight(doc_fedex_shipment):
     # label_printer.close()
 
 
+@metrics.timed('delete')
 def delete(doc_fedex_shipment):
-    config_obj = fedex_config.get(doc_fedex_shipment.fedex_settings)
-
-    # This is the object that will be handling our tracking request.
-    del_request = FedexDeleteShipmentRequest(config_obj)
-
-    # Either delete all packages in a shipment, or delete an individual package.
-    # Docs say this isn't required, but the WSDL won't validate without it.
-    # DELETE_ALL_PACKAGES, DELETE_ONE_PACKAGE
-    del_request.DeletionControlType = "DELETE_ALL_PACKAGES"
-
-    # The tracking number of the shipment to delete.
-    del_request.TrackingId.TrackingNumber = doc_fedex_shipment.tracking_number
-
-    # What kind of shipment the tracking number used.
-    # Docs say this isn't required, but the WSDL won't validate without it.
-    # EXPRESS, GROUND, or USPS
-    del_request.TrackingId.TrackingIdType = 'EXPRESS'
+    del_request = make_delete_request(doc_fedex_shipment.fedex_settings, doc_fedex_shipment.tracking_number)
 
     # Fires off the request, sets the 'response' attribute on the object.
     try:
-        del_request.send_request()
+        api.send_request(del_request)
     except Exception as ex:
         frappe.throw('Fedex API: ' + cstr(ex))
 
@@ -621,38 +620,50 @@ def delete(doc_fedex_shipment):
         frappe.throw('Canceling of Shipment in Fedex service failed.')
 
 
-def track(fedex_settings, track_number):
-    config_obj = fedex_config.get(fedex_settings)
+def enqueue_rollback(fedex_settings, tracking_number):
+    # not after commit, the transaction of the failed shipment is rolled back
+    frappe.enqueue('fedex_shipment.shipment.rollback', queue='short',
+                   fedex_settings=fedex_settings, tracking_number=tracking_number)
 
-    # NOTE: TRACKING IS VERY ERRATIC ON THE TEST SERVERS. YOU MAY NEED TO USE
-    # PRODUCTION KEYS/PASSWORDS/ACCOUNT #.
-    track = FedexTrackRequest(config_obj)
-    track.TrackPackageIdentifier.Type = 'TRACKING_NUMBER_OR_DOORTAG'
-    track.TrackPackageIdentifier.Value = track_number
 
-    # Fires off the request, sets the 'response' attribute on the object.
-    track.send_request()
+@metrics.timed('rollback')
+def rollback(fedex_settings, tracking_number):
+    del_request = make_delete_request(fedex_settings, tracking_number)
+    try:
+        api.send_request(del_request)
+    except Exception:
+        logger.exception('Cannot delete Fedex shipment %s of a failed Fedex Shipment', tracking_number)
+        raise
+    if del_request.response.HighestSeverity != "SUCCESS":
+        logger.error('Cannot delete Fedex shipment %s of a failed Fedex Shipment: %s', tracking_number,
+                     '; '.join('%s, %s' % (n.Code, n.Message) for n in del_request.response.Notifications))
 
-    # See the response printed out.
-    print track.response
 
-    # Look through the matches (there should only be one for a tracking number
-    # query), and show a few details about each shipment.
-    print "== Results =="
-    for match in track.response.TrackDetails:
-        print "Tracking #:", match.TrackingNumber
-        print "Status:", match.StatusDescription
+def make_delete_request(fedex_settings, tracking_number):
+    config_obj = fedex_config.get(fedex_settings)
 
+    # This is the object that will be handling our tracking request.
+    del_request = client_pool.get_request(FedexDeleteShipmentRequest, fedex_settings, config_obj)
 
-def rate_request(doc_fedex_shipment):
-    config_obj = fedex_config.get(doc_fedex_shipment.fedex_settings)
+    # Either delete all packages in a shipment, or delete an individual package.
+    # Docs say this isn't required, but the WSDL won't validate without it.
+    # DELETE_ALL_PACKAGES, DELETE_ONE_PACKAGE
+    del_request.DeletionControlType = "DELETE_ALL_PACKAGES"
 
-    # This is the object that will be handling our tracking request.
-    rate_request = FedexRateServiceRequest(config_obj)
+    # The tracking number of the shipment to delete.
+    del_request.TrackingId.TrackingNumber = tracking_number
+
+    # What kind of shipment the tracking number used.
+    # Docs say this isn't required, but the WSDL won't validate without it.
+    # EXPRESS, GROUND, or USPS
+    del_request.TrackingId.TrackingIdType = 'EXPRESS'
+    return del_request
 
-    # If you wish to have transit data returned with your request you
-    # need to uncomment the following
-    # rate_request.ReturnTransitAndCommit = True
+
+def make_rate_request(doc_fedex_shipment, config_obj, service_type=None, fedex_settings=None):
+    # This is the object that will be handling our tracking request.
+    rate_request = client_pool.get_request(FedexRateServiceRequest, fedex_settings or doc_fedex_shipment.fedex_settings,
+                                           config_obj)
 
     # This is very generalized, top-level information.
     # REGULAR_PICKUP, REQUEST_COURIER, DROP_BOX, BUSINESS_SERVICE_CENTER or STATION
@@ -661,90 +672,92 @@ def rate_request(doc_fedex_shipment):
     # See page 355 in WS_ShipService.pdf for a full list. Here are the common ones:
     # STANDARD_OVERNIGHT, PRIORITY_OVERNIGHT, FEDEX_GROUND, FEDEX_EXPRESS_SAVER
     # To receive rates for multiple ServiceTypes set to None.
-    rate_request.RequestedShipment.ServiceType = doc_fedex_shipment.service_type
+    rate_request.RequestedShipment.ServiceType = service_type
 
     # What kind of package this will be shipped in.
     # FEDEX_BOX, FEDEX_PAK, FEDEX_TUBE, YOUR_PACKAGING
     rate_request.RequestedShipment.PackagingType = doc_fedex_shipment.packaging_type
 
     # Shipper's address
-    rate_request.RequestedShipment.Shipper.Address.PostalCode = '29631'
-    rate_request.RequestedShipment.Shipper.Address.CountryCode = 'US'
-    rate_request.RequestedShipment.Shipper.Address.Residential = False
+    rate_request.RequestedShipment.Shipper.Address.PostalCode = doc_fedex_shipment.shipper_address_postal_code
+    rate_request.RequestedShipment.Shipper.Address.CountryCode = doc_fedex_shipment.shipper_address_country_code
+    rate_request.RequestedShipment.Shipper.Address.StateOrProvinceCode = doc_fedex_shipment.shipper_address_state_or_province_code
+    rate_request.RequestedShipment.Shipper.Address.Residential = True if doc_fedex_shipment.shipper_address_residential else False
 
     # Recipient address
-    rate_request.RequestedShipment.Recipient.Address.PostalCode = '27577'
-    rate_request.RequestedShipment.Recipient.Address.CountryCode = 'US'
+    rate_request.RequestedShipment.Recipient.Address.PostalCode = doc_fedex_shipment.recipient_address_postal_code
+    rate_request.RequestedShipment.Recipient.Address.CountryCode = doc_fedex_shipment.recipient_address_country_code
+    rate_request.RequestedShipment.Recipient.Address.StateOrProvinceCode = doc_fedex_shipment.recipient_address_state_or_province_code
     # This is needed to ensure an accurate rate quote with the response.
-    # rate_request.RequestedShipment.Recipient.Address.Residential = True
+    rate_request.RequestedShipment.Recipient.Address.Residential = True if doc_fedex_shipment.recipient_address_residential else False
     # include estimated duties and taxes in rate quote, can be ALL or NONE
     rate_request.RequestedShipment.EdtRequestType = 'NONE'
 
     # Who pays for the rate_request?
     # RECIPIENT, SENDER or THIRD_PARTY
-    rate_request.RequestedShipment.ShippingChargesPayment.PaymentType = 'SENDER'
-
-    package1_weight = rate_request.create_wsdl_object_of_type('Weight')
-    # Weight, in LB.
-    package1_weight.Value = 1.0
-    package1_weight.Units = "LB"
-
-    package1 = rate_request.create_wsdl_object_of_type('RequestedPackageLineItem')
-    package1.Weight = package1_weight
-    # can be other values this is probably the most common
-    package1.PhysicalPackaging = 'BOX'
-    # Required, but according to FedEx docs:
-    # "Used only with PACKAGE_GROUPS, as a count of packages within a
-    # group of identical packages". In practice you can use this to get rates
-    # for a shipment with multiple packages of an identical package size/weight
-    # on rate request without creating multiple RequestedPackageLineItem elements.
-    # You can OPTIONALLY specify a package group:
-    # package1.GroupNumber = 0  # default is 0
-    # The result will be found in RatedPackageDetail, with specified GroupNumber.
-    package1.GroupPackageCount = 1
-    # Un-comment this to see the other variables you may set on a package.
-    # print package1
-
-    # This adds the RequestedPackageLineItem WSDL object to the rate_request. It
-    # increments the package count and total weight of the rate_request for you.
-    rate_request.add_package(package1)
-
-    # If you'd like to see some documentation on the ship service WSDL, un-comment
-    # this line. (Spammy).
-    # print rate_request.client
-
-    # Un-comment this to see your complete, ready-to-send request as it stands
-    # before it is actually sent. This is useful for seeing what values you can
-    # change.
-    # print rate_request.RequestedShipment
-
-    # Fires off the request, sets the 'response' attribute on the object.
-    rate_request.send_request()
-
-    # This will show the reply to your rate_request being sent. You can access the
-    # attributes through the response attribute on the request object. This is
-    # good to un-comment to see the variables returned by the FedEx reply.
-    # print rate_request.response
-
-    # Here is the overall end result of the query.
-    print "HighestSeverity:", rate_request.response.HighestSeverity
-
+    rate_request.RequestedShipment.ShippingChargesPayment.PaymentType = doc_fedex_shipment.payment_type
+    rate_request.RequestedShipment.PreferredCurrency = doc_fedex_shipment.preferred_currency
+
+    rate_request.RequestedShipment.TotalWeight.Units = doc_fedex_shipment.packages[0].weight_units
+    for i, doc_package in enumerate(doc_fedex_shipment.packages):
+        package_weight = rate_request.create_wsdl_object_of_type('Weight')
+        package_weight.Units = doc_package.weight_units
+        package_weight.Value = flt(doc_package.weight_value)
+
+        package_dimensions = rate_request.create_wsdl_object_of_type('Dimensions')
+        package_dimensions.Units = doc_package.dimensions_units
+        package_dimensions.Length = cint(doc_package.length)
+        package_dimensions.Width = cint(doc_package.width)
+        package_dimensions.Height = cint(doc_package.height)
+
+        package = rate_request.create_wsdl_object_of_type('RequestedPackageLineItem')
+        package.Weight = package_weight
+        package.Dimensions = package_dimensions
+        # can be other values this is probably the most common
+        package.PhysicalPackaging = 'BOX'
+        package.SequenceNumber = i + 1
+        # Required, but according to FedEx docs:
+        # "Used only with PACKAGE_GROUPS, as a count of packages within a
+        # group of identical packages".
+        package.GroupPackageCount = 1
+
+        # This adds the RequestedPackageLineItem WSDL object to the rate_request. It
+        # increments the package count and total weight of the rate_request for you.
+        rate_request.add_package(package)
+
+    return rate_request
+
+
+def get_rate_quotes(rate_request):
+    quotes = []
     # RateReplyDetails can contain rates for multiple ServiceTypes if ServiceType was set to None
     for service in rate_request.response.RateReplyDetails:
-        for detail in service.RatedShipmentDetails:
-            for surcharge in detail.ShipmentRateDetail.Surcharges:
-                if surcharge.SurchargeType == 'OUT_OF_DELIVERY_AREA':
-                    print "%s: ODA rate_request charge %s" % (service.ServiceType, surcharge.Amount.Amount)
+        quote = replies.choose_rate_detail([replies.get_rate_detail(d.ShipmentRateDetail) for d in service.RatedShipmentDetails],
+                                           cstr(getattr(service, 'ActualRateType', '')))
+        quote.update({
+            'service_type': cstr(service.ServiceType),
+            'delivery_timestamp': cstr(getattr(service, 'DeliveryTimestamp', None) or '')
+        })
+        quotes.append(quote)
+    return quotes
+
+
+@metrics.timed('rate')
+def rate_request(doc_fedex_shipment, service_type=None):
+    config_obj = fedex_config.get(doc_fedex_shipment.fedex_settings)
+    rate_request = make_rate_request(doc_fedex_shipment, config_obj, service_type)
 
-        for rate_detail in service.RatedShipmentDetails:
-            print "%s: Net FedEx Charge %s %s" % (service.ServiceType, rate_detail.ShipmentRateDetail.TotalNetFedExCharge.Currency, rate_detail.ShipmentRateDetail.TotalNetFedExCharge.Amount)
+    # Fires off the request, sets the 'response' attribute on the object.
+    api.send_request(rate_request)
+    return get_rate_quotes(rate_request)
 
 
+@metrics.timed('freight_rate')
 def freight_rate_request(doc_fedex_shipment):
     config_obj = fedex_config.get(doc_fedex_shipment.fedex_settings)
 
     # This is the object that will be handling our tracking request.
-    rate_request = FedexRateServiceRequest(config_obj)
+    rate_request = client_pool.get_request(FedexRateServiceRequest, doc_fedex_shipment.fedex_settings, config_obj)
 
     rate_request.RequestedShipment.ServiceType = 'FEDEX_FREIGHT_ECONOMY'
 
@@ -818,7 +831,7 @@ def freight_rate_request(doc_fedex_shipment):
     # print rate_request.RequestedShipment
 
     # Fires off the request, sets the 'response' attribute on the object.
-    rate_request.send_request()
+    api.send_request(rate_request)
 
     # This will show the reply to your rate_request being sent. You can access the
     # attributes through the response attribute on the request object. This is
@@ -839,145 +852,56 @@ def freight_rate_request(doc_fedex_shipment):
             print "%s: Net FedEx Charge %s %s" % (service.ServiceType, rate_detail.ShipmentRateDetail.TotalNetFedExCharge.Currency, rate_detail.ShipmentRateDetail.TotalNetFedExCharge.Amount)
 
 
-def postal_inquiry(doc_fedex_shipment):
-    config_obj = fedex_config.get(doc_fedex_shipment.fedex_settings)
-
-    inquiry = PostalCodeInquiryRequest(config_obj)
-    inquiry.PostalCode = '29631'
-    inquiry.CountryCode = 'US'
-
-    # Fires off the request, sets the 'response' attribute on the object.
-    inquiry.send_request()
-
-    # See the response printed out.
-    print inquiry.response
-
-
-def validate_address(doc_fedex_shipment):
-    config_obj = fedex_config.get(doc_fedex_shipment.fedex_settings)
-
-    # This is the object that will be handling our tracking request.
-    connection = FedexAddressValidationRequest(config_obj)
-
-    # The AddressValidationOptions are created with default values of None, which
-    # will cause WSDL validation errors. To make things work, each option needs to
-    # be explicitly set or deleted.
-
-    # Set the flags we want to True (or a value).
-    connection.AddressValidationOptions.CheckResidentialStatus = True
-    connection.AddressValidationOptions.VerifyAddresses = True
-    connection.AddressValidationOptions.RecognizeAlternateCityNames = True
-    connection.AddressValidationOptions.MaximumNumberOfMatches = 3
-
-    # Delete the flags we don't want.
-    del connection.AddressValidationOptions.ConvertToUpperCase
-    del connection.AddressValidationOptions.ReturnParsedElements
-
-    # *Accuracy fields can be TIGHT, EXACT, MEDIUM, or LOOSE. Or deleted.
-    connection.AddressValidationOptions.StreetAccuracy = 'LOOSE'
-    del connection.AddressValidationOptions.DirectionalAccuracy
-    del connection.AddressValidationOptions.CompanyNameAccuracy
-
-    # Create some addresses to validate
-    address1 = connection.create_wsdl_object_of_type('AddressToValidate')
-    address1.CompanyName = 'International Paper'
-    address1.Address.StreetLines = ['155 Old Greenville Hwy', 'Suite 103']
-    address1.Address.City = 'Clemson'
-    address1.Address.StateOrProvinceCode = 'SC'
-    address1.Address.PostalCode = 29631
-    address1.Address.CountryCode = 'US'
-    address1.Address.Residential = False
-    connection.add_address(address1)
-
-    address2 = connection.create_wsdl_object_of_type('AddressToValidate')
-    address2.Address.StreetLines = ['320 S Cedros', '#200']
-    address2.Address.City = 'Solana Beach'
-    address2.Address.StateOrProvinceCode = 'CA'
-    address2.Address.PostalCode = 92075
-    address2.Address.CountryCode = 'US'
-    connection.add_address(address2)
-
-    # Send the request and print the response
-    connection.send_request()
-    print connection.response
-
-
 @frappe.whitelist()
 def make_fedex_shipment(source_name, target_doc=None):
+    return map_fedex_shipment(source_name, prefetch_shipment_sources([source_name]), target_doc)
+
+
+def map_fedex_shipment(source_name, prefetched, target_doc=None):
     def postprocess(source, target):
-        doc_delivery_note = frappe.get_doc('Delivery Note', source.delivery_note)
+        delivery_note = prefetched.delivery_notes.get(source.delivery_note)
+        if not delivery_note:
+            frappe.throw('Delivery Note is not set in Packing Slip %s' % source.name)
 
         # updating preferred currency that is used for returned from Fedex totals
-        target.preferred_currency = doc_delivery_note.currency
+        target.preferred_currency = delivery_note.currency
 
         # updating shipper address
-        warehouse = frappe.db.get('Warehouse', source.items[0].warehouse)
+        warehouse = prefetched.warehouses.get(prefetched.packing_slip_warehouses.get(source.name)) or \
+            prefetched.warehouses.get(prefetched.delivery_note_warehouses.get(delivery_note.name))
         if not warehouse:
-            warehouse = frappe.db.get('Warehouse', doc_delivery_note.items[0].warehouse)
-            if not warehouse:
-                frappe.throw('Neither Packing Slip Item nor Delivery Note Item has warehouse set.')
-        target.shipper_address_address_line_1 = warehouse.address_line_1
-        target.shipper_address_city = warehouse.city
-        target.shipper_address_state_or_province_code = countries.get_country_state_code(warehouse.country, warehouse.state)
-        target.shipper_address_postal_code = warehouse.postal_code or warehouse.pin
-        target.shipper_address_residential = 0
-        if not warehouse.country:
-            frappe.throw('Please specify country in Warehouse %s' % warehouse.name)
-        target.shipper_address_country_code = countries.get_country_code(warehouse.country)
-        target.shipper_contact_person_name = warehouse.company
-        target.shipper_contact_company_name = warehouse.company
-        target.shipper_contact_phone_number = warehouse.phone_no
+            frappe.throw('Neither Packing Slip Item nor Delivery Note Item has warehouse set.')
+        set_shipper_address(target, warehouse)
 
         # updating recipient address
-        target.customer = doc_delivery_note.customer
-        if doc_delivery_note.shipping_address_name:
-            target.fedex_settings = utils.get_fedex_settings(doc_delivery_note.company)
-            shipping_address = frappe.db.get('Address', doc_delivery_note.shipping_address_name)
-            target.recipient_address = shipping_address.name
-            target.recipient_address_address_line_1 = shipping_address.address_line1
-            target.recipient_address_city = shipping_address.city
-            target.recipient_address_state_or_province_code = countries.get_country_state_code(shipping_address.country, shipping_address.state)
-            target.recipient_address_postal_code = shipping_address.pincode
-            target.recipient_address_country_code = countries.get_country_code(shipping_address.country)
-            target.recipient_contact_person_name = shipping_address.customer_name
-            target.recipient_contact_company_name = shipping_address.customer_name
-            target.recipient_contact_phone_number = shipping_address.phone
-
-            customer_type = frappe.db.get_value('Customer', shipping_address.customer, 'customer_type')
-            target.recipient_address_residential = 0 if customer_type == 'Company' else 1
+        target.customer = delivery_note.customer
+        shipping_address = prefetched.addresses.get(delivery_note.shipping_address_name)
+        if shipping_address:
+            target.fedex_settings = prefetched.company_fedex_settings.get(delivery_note.company)
+            target.label_image_type = prefetched.label_image_types.get(target.fedex_settings) or target.label_image_type
+            set_recipient_address(target, shipping_address, prefetched.customer_types.get(shipping_address.customer))
         else:
-            frappe.msgprint('Shipping Address is missed in Delivery Note %s' % doc_delivery_note.name)
+            frappe.msgprint('Shipping Address is missed in Delivery Note %s' % delivery_note.name)
 
         # create shipment packages
-        merged_packages = {}
-        for item in source.items:
-            packages = json.loads(item.packages_json or "{}")
-            for pckg_no in packages:
-                merged_pckg = merged_packages.get("pckg_no")
-                if merged_pckg:
-                    pckg = packages.get("pckg_no")
-                    for item_code in pckg:
-                        if merged_pckg.get("item_code"):
-                            merged_pckg[item_code] += pckg[item_code]
-                        else:
-                            merged_pckg[item_code] = pckg[item_code]
-                else:
-                    merged_packages[pckg_no] = packages[pckg_no]
+        packages = cartonization.make_packages(source.items, prefetched.item_specs,
+                                               prefetched.boxes.get(target.fedex_settings, []))
+        fedex_package = prefetched.fedex_package
         target.set("packages", [])
-        for idx, key in enumerate(merged_packages.keys(), 1):
-            fedex_package = frappe.new_doc("Fedex Package")
+        for idx, package in enumerate(packages or [{}], 1):
             target.append("packages", {
                 "doctype": fedex_package.doctype,
-                "dimensions_units": fedex_package.dimensions_units,
-                "width": fedex_package.width,
-                "height": fedex_package.height,
-                "length": fedex_package.length,
-                "weight_units": fedex_package.weight_units,
-                "weight_value": fedex_package.weight_value,
+                "dimensions_units": package.get("dimensions_units") or fedex_package.dimensions_units,
+                "width": package.get("width") or fedex_package.width,
+                "height": package.get("height") or fedex_package.height,
+                "length": package.get("length") or fedex_package.length,
+                "weight_units": package.get("weight_units") or fedex_package.weight_units,
+                "weight_value": package.get("weight_value") or fedex_package.weight_value,
                 "idx": idx
             })
 
-    if frappe.db.get_value('Packing Slip', source_name, 'fedex_shipment') or frappe.db.get_value('Packing Slip', source_name, 'oc_tracking_number'):
+    packing_slip = prefetched.packing_slips.get(source_name)
+    if packing_slip and (packing_slip.fedex_shipment or packing_slip.oc_tracking_number):
         frappe.throw('Cannot make new Fedex Shipment: either Fedex Shipment is already created or tracking number is set.')
 
     doclist = get_mapped_doc('Packing Slip', source_name, {
@@ -995,6 +919,87 @@ def make_fedex_shipment(source_name, target_doc=None):
     return doclist
 
 
+def prefetch_shipment_sources(packing_slips):
+    # Everything map_fedex_shipment() reads besides the Packing Slips it maps,
+    # for any number of them in a fixed number of queries.
+    prefetched = frappe._dict()
+    prefetched.packing_slips = get_rows('Packing Slip', packing_slips,
+                                        ['name', 'delivery_note', 'fedex_shipment', 'oc_tracking_number'])
+    prefetched.delivery_notes = get_rows('Delivery Note', [ps.delivery_note for ps in prefetched.packing_slips.values()],
+                                         ['name', 'currency', 'customer', 'company', 'shipping_address_name'])
+    prefetched.packing_slip_warehouses = get_first_item_warehouses('Packing Slip Item', prefetched.packing_slips.keys())
+    prefetched.delivery_note_warehouses = get_first_item_warehouses('Delivery Note Item', prefetched.delivery_notes.keys())
+    prefetched.warehouses = get_rows('Warehouse', prefetched.packing_slip_warehouses.values() +
+                                     prefetched.delivery_note_warehouses.values())
+    prefetched.addresses = get_rows('Address', [dn.shipping_address_name for dn in prefetched.delivery_notes.values()])
+    prefetched.customer_types = dict((c.name, c.customer_type) for c in get_rows('Customer',
+        [a.customer for a in prefetched.addresses.values()], ['name', 'customer_type']).values())
+    prefetched.company_fedex_settings = utils.get_companies_fedex_settings(
+        [dn.company for dn in prefetched.delivery_notes.values()])
+    prefetched.label_image_types = dict((fs.name, fs.label_image_type) for fs in get_rows('Fedex Settings',
+        prefetched.company_fedex_settings.values(), ['name', 'label_image_type']).values())
+    prefetched.item_specs = cartonization.get_item_specs(get_item_codes('Packing Slip Item', prefetched.packing_slips.keys()))
+    prefetched.boxes = cartonization.get_boxes(prefetched.company_fedex_settings.values())
+    prefetched.fedex_package = frappe.new_doc("Fedex Package")
+    return prefetched
+
+
+def get_rows(doctype, names, fields=None):
+    names = list(set(name for name in names if name))
+    if not names:
+        return {}
+    return dict((row.name, row) for row in frappe.db.sql("""select {0} from `tab{1}` where name in ({2})""".format(
+        ', '.join('`%s`' % f for f in fields) if fields else '*', doctype, ', '.join(['%s'] * len(names))),
+        names, as_dict=True))
+
+
+def get_item_codes(doctype, parents):
+    if not parents:
+        return []
+    return frappe.db.sql_list("""select distinct item_code from `tab{0}` where parent in ({1})""".format(
+        doctype, ', '.join(['%s'] * len(parents))), list(parents))
+
+
+def get_first_item_warehouses(doctype, parents):
+    parents = list(set(parents))
+    if not parents:
+        return {}
+    warehouses = {}
+    for parent, warehouse in frappe.db.sql("""select parent, warehouse from `tab{0}`
+            where parent in ({1}) and ifnull(warehouse, '')!=''
+            order by parent, idx""".format(doctype, ', '.join(['%s'] * len(parents))), parents):
+        warehouses.setdefault(parent, warehouse)
+    return warehouses
+
+
+def set_shipper_address(target, warehouse):
+    target.shipper_address_address_line_1 = warehouse.address_line_1
+    target.shipper_address_city = warehouse.city
+    target.shipper_address_state_or_province_code = countries.get_country_state_code(warehouse.country, warehouse.state)
+    target.shipper_address_postal_code = warehouse.postal_code or warehouse.pin
+    target.shipper_address_residential = 0
+    if not warehouse.country:
+        frappe.throw('Please specify country in Warehouse %s' % warehouse.name)
+    target.shipper_address_country_code = countries.get_country_code(warehouse.country)
+    target.shipper_contact_person_name = warehouse.company
+    target.shipper_contact_company_name = warehouse.company
+    target.shipper_contact_phone_number = warehouse.phone_no
+
+
+def set_recipient_address(target, shipping_address, customer_type=None):
+    target.recipient_address = shipping_address.name
+    target.recipient_address_address_line_1 = shipping_address.address_line1
+    target.recipient_address_city = shipping_address.city
+    target.recipient_address_state_or_province_code = countries.get_country_state_code(shipping_address.country, shipping_address.state)
+    target.recipient_address_postal_code = shipping_address.pincode
+    target.recipient_address_country_code = countries.get_country_code(shipping_address.country)
+    target.recipient_contact_person_name = shipping_address.customer_name
+    target.recipient_contact_company_name = shipping_address.customer_name
+    target.recipient_contact_phone_number = shipping_address.phone
+
+    target.recipient_address_residential = address_validation.get_residential(shipping_address, customer_type)
+
+
 @frappe.whitelist()
 def get_address_details(address):
     address = frappe.db.get('Address', address)
@@ -1002,8 +1007,7 @@ def get_address_details(address):
         address['state_or_province_code'] = countries.get_country_state_code(address.country, address.state)
         address['country_code'] = countries.get_country_code(address.country)
 
-        customer_type = frappe.db.get_value('Customer', address.customer, 'customer_type')
-        address['residential'] = 0 if customer_type == 'Company' else 1
+        address['residential'] = address_validation.get_residential(address)
         return address
 
 
@@ -0,0 +1,63 @@
+from __future__ import unicode_literals, print_function
+
+import random
+import time
+
+from fedex_shipment import cartonization
+
+
+# Time and package count of cartonizing orders of 1 to 500 lines with a
+# catalogue of four boxes, against the lower bound of the count by volume
+# and weight. The items are random but the same on every run. Run with
+#   bench --site <site> execute fedex_shipment.tests.benchmark_cartonization.run
+LINE_COUNTS = (1, 10, 100, 250, 500)
+REPEAT = 5
+
+
+def make_boxes():
+    return [
+        cartonization.Box('Small', 12, 9, 4, 'IN', 20, 0.5, 'LB'),
+        cartonization.Box('Medium', 16, 12, 10, 'IN', 40, 1, 'LB'),
+        cartonization.Box('Large', 20, 16, 14, 'IN', 60, 1.5, 'LB'),
+        cartonization.Box('Extra Large', 30, 24, 20, 'IN', 100, 3, 'LB')
+    ]
+
+
+def make_lines(count, seed=1):
+    # 1 to 10 units of items from a pen to a small appliance, a few without dimensions
+    generator = random.Random(seed)
+    lines = []
+    for i in range(count):
+        dims = None if generator.random() < 0.05 else \
+            cartonization.to_inches([generator.uniform(0.5, 18) for side in range(3)], 'IN')
+        lines.append(cartonization.Line('ITEM-%04d' % i, generator.randint(1, 10), generator.uniform(0.05, 12), dims))
+    return lines
+
+
+def get_lower_bound(lines, boxes):
+    # no packing needs fewer of the largest box than the volume or the weight ask for
+    largest = max(boxes, key=lambda box: box.fill_volume)
+    volume = sum(line.volume * line.qty for line in lines)
+    weight = sum(line.weight * line.qty for line in lines)
+    return max(int(volume / largest.fill_volume) + 1, int(weight / (largest.max_weight - largest.box_weight)) + 1)
+
+
+def measure(lines, boxes, repeat=REPEAT):
+    # the best of repeat runs, in seconds, and the packages of the last one
+    best = None
+    for i in range(repeat):
+        started = time.time()
+        packages = cartonization.pack(lines, boxes)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, packages
+
+
+def run(line_counts=LINE_COUNTS):
+    boxes = make_boxes()
+    print('%6s %6s %10s %10s %12s' % ('lines', 'units', 'ms', 'packages', 'lower bound'))
+    for count in line_counts:
+        lines = make_lines(count)
+        elapsed, packages = measure(lines, boxes)
+        print('%6s %6s %10.2f %10s %12s' % (count, sum(line.qty for line in lines), elapsed * 1000, len(packages),
+                                           get_lower_bound(lines, boxes)))
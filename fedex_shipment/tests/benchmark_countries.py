@@ -0,0 +1,41 @@
+from __future__ import unicode_literals, print_function
+
+import timeit
+
+from fedex_shipment import countries
+
+
+# Microseconds per call of get_country_code over every country spelled four
+# ways (name, upper-cased name, ISO2, lower-cased ISO3), and of
+# get_country_state_code over every state name and code. Run with
+#   bench --site <site> execute fedex_shipment.tests.benchmark_countries.run
+REPEAT = 5
+NUMBER = 100
+
+
+def get_country_spellings():
+    spellings = []
+    for name, codes in sorted(countries.COUNTRY_CODES.items()):
+        spellings += [name, name.upper(), codes['iso_code_2'], codes['iso_code_3'].lower()]
+    return spellings
+
+
+def get_state_spellings():
+    return [(country, spelling) for country, states in sorted(countries.COUNTRY_STATE_CODES.items())
+            for state, state_code in sorted(states.items()) for spelling in (state, state_code)]
+
+
+def measure(fn, spellings):
+    # the best of REPEAT runs, in microseconds per call
+    timer = timeit.Timer(lambda: [fn(*spelling) for spelling in spellings])
+    return min(timer.repeat(REPEAT, NUMBER)) / NUMBER / len(spellings) * 1000000
+
+
+def run():
+    country_spellings = get_country_spellings()
+    state_spellings = get_state_spellings()
+    print('%-24s %8s %10s' % ('function', 'calls', 'us/call'))
+    print('%-24s %8s %10.2f' % ('get_country_code', len(country_spellings),
+                                measure(countries.get_country_code, [(s,) for s in country_spellings])))
+    print('%-24s %8s %10.2f' % ('get_country_state_code', len(state_spellings),
+                                measure(countries.get_country_state_code, state_spellings)))
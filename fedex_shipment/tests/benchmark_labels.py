@@ -0,0 +1,116 @@
+from __future__ import unicode_literals, print_function
+
+import io
+import multiprocessing
+import os
+import Queue
+import resource
+import tempfile
+import time
+import traceback
+
+from PIL import Image, ImageDraw
+from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+
+import frappe
+
+from fedex_shipment import labels
+
+
+# Time and peak RSS of merging the labels of 1, 10 and 50 packages, native
+# PDF pages against the PNG labels redrawn on a reportlab canvas. Each case
+# runs in a process of its own so the peaks do not add up. Run with
+#   bench --site <site> execute fedex_shipment.tests.benchmark_labels.run
+PACKAGE_COUNTS = (1, 10, 50)
+# seconds a case may take before it counts as failed
+MEASURE_TIMEOUT = 300
+
+
+def make_pdf_label(number):
+    # a 4x6 page with text and barcode bars, about the size of a Fedex PDF label
+    label = io.BytesIO()
+    pdf_canvas = canvas.Canvas(label, pagesize=(4 * inch, 6 * inch))
+    pdf_canvas.setFont('Helvetica', 10)
+    for line in range(30):
+        pdf_canvas.drawString(0.2 * inch, (5.7 - line * 0.12) * inch, 'PACKAGE %s LINE %s 794644790138' % (number, line))
+    for bar in range(120):
+        pdf_canvas.rect(0.2 * inch + bar * 0.03 * inch, 0.3 * inch, 0.01 * inch * (1 + bar % 3), 1.5 * inch, fill=1)
+    pdf_canvas.showPage()
+    pdf_canvas.save()
+    return label.getvalue()
+
+
+def make_png_label(number):
+    # a 4x6 label at 200 dpi, the resolution of Fedex PNG labels
+    image = Image.new('1', (800, 1200), 1)
+    draw = ImageDraw.Draw(image)
+    for line in range(30):
+        draw.text((40, 40 + line * 20), 'PACKAGE %s LINE %s 794644790138' % (number, line), fill=0)
+    for bar in range(0, 720, 6):
+        draw.rectangle([40 + bar, 800, 41 + bar + bar % 3, 1100], fill=0)
+    label = io.BytesIO()
+    image.save(label, 'PNG')
+    return label.getvalue()
+
+
+def merge(label_image_type, label_data, count, file_path):
+    label_merger = labels.make_label_merger(frappe._dict({'label_image_type': label_image_type,
+                                                          'label_stock_type': 'PAPER_4X6'}))
+    try:
+        for i in range(count):
+            label_merger.add_label(label_data)
+        label_merger.write(file_path)
+    finally:
+        label_merger.close()
+
+
+def measure(label_image_type, label_data, count, results):
+    # puts (elapsed, peak, growth, size) on the results queue, or the error as text
+    file_path = tempfile.mkstemp(suffix='.pdf')[1]
+    try:
+        rss_before = get_rss()
+        started = time.time()
+        merge(label_image_type, label_data, count, file_path)
+        elapsed = time.time() - started
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        results.put((elapsed, peak, max(peak - rss_before, 0), os.path.getsize(file_path)))
+    except Exception:
+        results.put(traceback.format_exc())
+    finally:
+        os.remove(file_path)
+
+
+def measure_in_process(label_image_type, label_data, count, timeout=MEASURE_TIMEOUT):
+    # raises what measure failed with, or if it gave no result in time
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(label_image_type, label_data, count, results))
+    process.start()
+    try:
+        result = results.get(timeout=timeout)
+    except Queue.Empty:
+        result = 'Measuring %s %s labels gave no result in %s seconds, exit code %s' % (
+            count, label_image_type, timeout, process.exitcode)
+    finally:
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    if not isinstance(result, tuple):
+        raise Exception(result)
+    return result
+
+
+def get_rss():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+def run(package_counts=PACKAGE_COUNTS):
+    label_data = {'PDF': make_pdf_label(1), 'PNG': make_png_label(1)}
+    print('%-4s %8s %10s %12s %12s %12s' % ('type', 'packages', 'seconds', 'peak RSS MB', 'growth MB', 'file kB'))
+    for count in package_counts:
+        for label_image_type in ('PDF', 'PNG'):
+            elapsed, peak, growth, size = measure_in_process(label_image_type, label_data[label_image_type], count)
+            print('%-4s %8s %10.3f %12.1f %12.1f %12.1f' % (label_image_type, count, elapsed, peak / 1048576.0,
+                                                          growth / 1048576.0, size / 1024.0))
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+
+import os
+import socket
+import ssl
+import struct
+import threading
+import time
+
+
+# a self-signed certificate of localhost and its key, for the stand-in only
+CERT_FILE = os.path.join(os.path.dirname(__file__), 'soap_server.pem')
+# the client side context trusting the stand-in, for transport.SSL_CONTEXT
+SSL_CONTEXT = ssl.create_default_context(cafile=CERT_FILE)
+
+REPLY = b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body/></soapenv:Envelope>'
+
+
+class SoapServerStandIn(object):
+    # A keep-alive HTTPS endpoint on localhost answering each request with
+    # the next action of its script, counting the requests it read:
+    #   reply          a 200 reply, the connection kept open
+    #   reply_close    a 200 reply, then the connection closed as if idle
+    #   reply_drop     a 200 reply, then the connection dropped without a TLS close
+    #   reset          the request read, then the connection reset
+    #   stall          the request read, then no reply for a while
+    #   unavailable    a 503 reply without a body
+    # The reply is made by reply_for(request body) when it is given.
+    def __init__(self, actions, reply_for=None):
+        self.actions = list(actions)
+        self.reply_for = reply_for
+        self.requests = 0
+        self.connections = 0
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.url = 'https://localhost:%s/web-services' % self.server.getsockname()[1]
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            thread = threading.Thread(target=self.handle, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, plain_connection):
+        try:
+            connection = ssl.wrap_socket(plain_connection, server_side=True, certfile=CERT_FILE)
+        except (socket.error, ssl.SSLError):
+            return
+        finally:
+            # the TLS socket holds the connection from here, its close really closes it
+            plain_connection.close()
+        stream = connection.makefile('rb')
+        try:
+            while True:
+                body = self.read_request(stream)
+                if body is None:
+                    break
+                self.requests += 1
+                action = self.actions.pop(0) if self.actions else 'reply'
+                if action == 'reset':
+                    connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack(b'ii', 1, 0))
+                    return
+                if action == 'stall':
+                    time.sleep(2)
+                    return
+                if action == 'unavailable':
+                    connection.sendall(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n')
+                    continue
+                reply = self.reply_for(body) if self.reply_for else REPLY
+                connection.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: text/xml; charset=utf-8\r\n'
+                                   b'Content-Length: %d\r\n\r\n%s' % (len(reply), reply))
+                if action == 'reply_close':
+                    try:
+                        connection.settimeout(0.1)
+                        connection.unwrap()
+                    except (socket.error, ssl.SSLError):
+                        pass
+                    return
+                if action == 'reply_drop':
+                    return
+        except socket.error:
+            pass
+        finally:
+            stream.close()
+            connection.close()
+
+    def read_request(self, stream):
+        content_length = None
+        line = stream.readline()
+        if not line:
+            return None
+        while line not in (b'\r\n', b''):
+            if line.lower().startswith(b'content-length:'):
+                content_length = int(line.split(b':', 1)[1])
+            line = stream.readline()
+        return stream.read(content_length or 0)
+
+    def close(self):
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.server.close()
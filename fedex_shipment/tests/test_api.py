@@ -0,0 +1,120 @@
+from __future__ import unicode_literals
+
+import re
+import unittest
+
+import frappe
+from fedex.config import FedexConfig
+from fedex.services.ship_service import FedexDeleteShipmentRequest
+
+from fedex_shipment import api, client_pool, routing, tracking, transport
+from fedex_shipment.tests.soap_server import SoapServerStandIn, SSL_CONTEXT
+
+
+TEST_FEDEX_SETTINGS = '_Test Fedex Stand-in'
+
+TRACK_REPLY = (b'<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body>'
+               b'<TrackReply xmlns="%s"><HighestSeverity>SUCCESS</HighestSeverity><Notifications>'
+               b'<Severity>SUCCESS</Severity><Source>trck</Source><Code>0</Code>'
+               b'<Message>Request was successfully processed.</Message></Notifications>'
+               b'<Version><ServiceId>trck</ServiceId><Major>10</Major><Intermediate>0</Intermediate>'
+               b'<Minor>0</Minor></Version></TrackReply></soapenv:Body></soapenv:Envelope>')
+
+
+def make_track_reply(body):
+    # answers in the namespace of the WSDL version the request was made with
+    return TRACK_REPLY % re.search(br'"(http://fedex\.com/ws/track/v\d+)"', body).group(1)
+
+
+class TestSendRequests(unittest.TestCase):
+    def setUp(self):
+        self.server = None
+        self.timeouts = dict(api.TIMEOUTS)
+        self.backoff_base = api.BACKOFF_BASE
+        self.ssl_context = transport.SSL_CONTEXT
+        transport.SSL_CONTEXT = SSL_CONTEXT
+        # the stand-in stalls for 2 seconds, a timeout well below it
+        api.TIMEOUTS.update({'FedexTrackRequest': 0.5, 'FedexDeleteShipmentRequest': 0.5})
+        api.BACKOFF_BASE = 0.01
+        self.clear_state()
+
+    def tearDown(self):
+        if self.server:
+            self.server.close()
+        api.TIMEOUTS.clear()
+        api.TIMEOUTS.update(self.timeouts)
+        api.BACKOFF_BASE = self.backoff_base
+        transport.SSL_CONTEXT = self.ssl_context
+        self.clear_state()
+
+    def clear_state(self):
+        frappe.cache().delete_value(api.get_circuit_key(TEST_FEDEX_SETTINGS))
+        frappe.cache().delete_value(routing.get_health_key(TEST_FEDEX_SETTINGS))
+        client_pool.invalidate(TEST_FEDEX_SETTINGS)
+        transport._connections.clear()
+
+    def make_config(self):
+        return FedexConfig(key='test-key', password='test-password', account_number='510087000',
+                           meter_number='118000000', use_test_server=True)
+
+    def make_track_request(self, actions):
+        self.server = SoapServerStandIn(actions, reply_for=make_track_reply)
+        request = tracking.make_track_request(TEST_FEDEX_SETTINGS, self.make_config(), ['794644790138'])
+        request.client.set_options(location=self.server.url)
+        return request
+
+    def make_delete_request(self, actions):
+        self.server = SoapServerStandIn(actions)
+        request = client_pool.get_request(FedexDeleteShipmentRequest, TEST_FEDEX_SETTINGS, self.make_config())
+        request.DeletionControlType = 'DELETE_ALL_PACKAGES'
+        request.TrackingId.TrackingNumber = '794644790138'
+        request.TrackingId.TrackingIdType = 'EXPRESS'
+        request.client.set_options(location=self.server.url)
+        return request
+
+    def test_reply_within_timeout(self):
+        request = self.make_track_request(['reply'])
+        api.send_request(request)
+        self.assertEqual(request.response.HighestSeverity, 'SUCCESS')
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(request.client.options.timeout, 0.5)
+
+    def test_transient_fault_sent_again(self):
+        request = self.make_track_request(['unavailable', 'reply'])
+        api.send_request(request)
+        self.assertEqual(request.response.HighestSeverity, 'SUCCESS')
+        self.assertEqual(self.server.requests, 2)
+
+    def test_slow_reply_times_out_and_is_sent_again(self):
+        request = self.make_track_request(['stall', 'reply'])
+        api.send_request(request)
+        self.assertEqual(request.response.HighestSeverity, 'SUCCESS')
+        self.assertEqual(self.server.requests, 2)
+
+    def test_attempts_bounded(self):
+        request = self.make_track_request(['unavailable'] * api.MAX_ATTEMPTS + ['reply'])
+        self.assertRaises(Exception, api.send_request, request)
+        self.assertEqual(self.server.requests, api.MAX_ATTEMPTS)
+
+    def test_timed_out_delete_not_sent_again(self):
+        # Fedex may have processed it, sending it again could act twice
+        request = self.make_delete_request(['stall', 'reply'])
+        with self.assertRaises(Exception) as context:
+            api.send_request(request)
+        self.assertTrue(transport.is_timeout(context.exception))
+        self.assertEqual(self.server.requests, 1)
+
+    def test_circuit_opens_and_fails_fast(self):
+        request = self.make_track_request(['unavailable'] * 10)
+        self.assertRaises(Exception, api.send_request, request)
+        # the third attempt of the second call finds the circuit open
+        self.assertRaises(api.FedexUnavailableError, api.send_request, request)
+        self.assertEqual(self.server.requests, api.BREAKER_FAILURES)
+        self.assertRaises(api.FedexUnavailableError, api.send_request, request)
+        self.assertEqual(self.server.requests, api.BREAKER_FAILURES)
+        self.assertTrue(routing.get_health(TEST_FEDEX_SETTINGS).get('throttled_until'))
+
+    def test_success_closes_circuit(self):
+        request = self.make_track_request(['unavailable', 'unavailable', 'reply'])
+        api.send_request(request)
+        self.assertEqual(api.get_circuit(TEST_FEDEX_SETTINGS), {})
@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+
+import unittest
+
+import frappe
+from rq.timeouts import JobTimeoutException
+
+from fedex_shipment import bulk_shipment, shipment
+
+
+class TestBulkShipment(unittest.TestCase):
+    def setUp(self):
+        doc_bulk_shipment = frappe.get_doc({
+            'doctype': 'Fedex Bulk Shipment',
+            'status': 'Queued',
+            'max_parallel_jobs': 2,
+            'total_count': 3,
+            'items': [{'packing_slip': '_Test Packing Slip %s' % i, 'status': 'Pending'} for i in range(3)]
+        })
+        doc_bulk_shipment.flags.ignore_links = True
+        doc_bulk_shipment.insert(ignore_permissions=True)
+        # the items commit and roll back on their own
+        frappe.db.commit()
+        self.bulk_shipment = doc_bulk_shipment.name
+        self.items = [row.name for row in doc_bulk_shipment.items]
+
+    def tearDown(self):
+        frappe.delete_doc('Fedex Bulk Shipment', self.bulk_shipment, force=True, ignore_permissions=True)
+        frappe.db.commit()
+
+    def test_every_item_in_one_job(self):
+        rows = ['row-%s' % i for i in range(10)]
+        job_items = bulk_shipment.get_job_items(rows, 4)
+        self.assertEqual(len(job_items), 4)
+        self.assertEqual(sorted(item for items in job_items for item in items), sorted(rows))
+        self.assertEqual(sorted(len(items) for items in job_items), [2, 2, 3, 3])
+
+    def test_no_more_jobs_than_items(self):
+        self.assertEqual(bulk_shipment.get_job_items(['row-1', 'row-2'], 4), [['row-1'], ['row-2']])
+
+    def test_progress_counted_until_completed(self):
+        bulk_shipment.update_bulk_shipment_item(self.bulk_shipment, self.items[0], {'status': 'Completed'})
+        self.assertEqual(self.get_counters(), (1, 1, 0, 'Queued'))
+        bulk_shipment.update_bulk_shipment_item(self.bulk_shipment, self.items[1], {'status': 'Failed', 'error': 'x'})
+        bulk_shipment.update_bulk_shipment_item(self.bulk_shipment, self.items[2], {'status': 'Completed'})
+        self.assertEqual(self.get_counters(), (3, 2, 1, 'Completed with Errors'))
+        self.assertEqual(frappe.db.get_value('Fedex Bulk Shipment Item', self.items[1], 'status'), 'Failed')
+
+    def test_missing_packing_slip_fails_its_item_only(self):
+        packing_slip = frappe.db.get_value('Fedex Bulk Shipment Item', self.items[0], 'packing_slip')
+        prefetched = shipment.prefetch_shipment_sources([packing_slip])
+        bulk_shipment.process_bulk_shipment_item(self.bulk_shipment, self.items[0], packing_slip, prefetched)
+        status, error = frappe.db.get_value('Fedex Bulk Shipment Item', self.items[0], ['status', 'error'])
+        self.assertEqual(status, 'Failed')
+        self.assertTrue(error)
+        self.assertEqual(self.get_counters(), (1, 0, 1, 'Queued'))
+
+    def test_failed_prefetch_fails_its_items(self):
+        def prefetch_shipment_sources(packing_slips):
+            raise frappe.ValidationError('Lost connection to MySQL server')
+
+        original = shipment.prefetch_shipment_sources
+        shipment.prefetch_shipment_sources = prefetch_shipment_sources
+        try:
+            bulk_shipment.process_bulk_shipment_items(self.bulk_shipment, self.items)
+        finally:
+            shipment.prefetch_shipment_sources = original
+        self.assertEqual(self.get_counters(), (3, 0, 3, 'Completed with Errors'))
+
+    def test_stopped_job_fails_the_items_left(self):
+        def process_bulk_shipment_item(bulk_shipment_name, item, packing_slip, prefetched):
+            if item != self.items[0]:
+                raise JobTimeoutException('Job exceeded maximum timeout value')
+            bulk_shipment.update_bulk_shipment_item(bulk_shipment_name, item, {'status': 'Completed'})
+
+        original = bulk_shipment.process_bulk_shipment_item
+        bulk_shipment.process_bulk_shipment_item = process_bulk_shipment_item
+        try:
+            self.assertRaises(JobTimeoutException, bulk_shipment.process_bulk_shipment_items,
+                              self.bulk_shipment, self.items)
+        finally:
+            bulk_shipment.process_bulk_shipment_item = original
+        self.assertEqual(self.get_counters(), (3, 1, 2, 'Completed with Errors'))
+
+    def test_job_timeout_grows_with_its_slips(self):
+        self.assertGreaterEqual(bulk_shipment.get_job_timeout(['row'] * 100),
+                                100 * bulk_shipment.JOB_TIMEOUT_PER_PACKING_SLIP)
+
+    def get_counters(self):
+        return tuple(frappe.db.get_value('Fedex Bulk Shipment', self.bulk_shipment,
+                                         ['processed_count', 'succeeded_count', 'failed_count', 'status']))
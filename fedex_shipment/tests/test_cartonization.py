@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+import frappe
+
+from fedex_shipment import cartonization
+from fedex_shipment.tests.benchmark_cartonization import make_boxes, make_lines, get_lower_bound
+
+
+def make_box(name, side, max_weight=0, box_weight=0):
+    return cartonization.Box(name, side, side, side, 'IN', max_weight, box_weight, 'LB', fill_ratio=1.0)
+
+
+def make_line(item_code, qty, weight, dims):
+    return cartonization.Line(item_code, qty, weight, cartonization.to_inches(dims, 'IN') if dims else None)
+
+
+class TestCartonization(unittest.TestCase):
+    def test_open_box_topped_up(self):
+        # the small items fill the half box the large one left
+        packages = cartonization.pack([make_line('SMALL', 4, 1, (5, 5, 5)), make_line('LARGE', 1, 1, (10, 10, 5))],
+                                      [make_box('Box', 10)])
+        self.assertEqual(len(packages), 1)
+        self.assertEqual(packages[0].items, {'LARGE': 1, 'SMALL': 4})
+
+    def test_item_too_large_ships_alone(self):
+        packages = cartonization.pack([make_line('POLE', 2, 3, (20, 5, 5)), make_line('CUP', 1, 1, (4, 4, 4))],
+                                      [make_box('Box', 10)])
+        self.assertEqual(sorted(package.box and package.box.name for package in packages), [None, None, 'Box'])
+        pole = [package.as_dict() for package in packages if not package.box][0]
+        self.assertEqual((pole['length'], pole['width'], pole['height'], pole['weight_value']), (20, 5, 5, 3))
+
+    def test_weight_cap_of_box(self):
+        # 1 pound of box and 4 units of 2 pounds reach the 10 pound cap
+        packages = cartonization.pack([make_line('BOLT', 10, 2, (1, 1, 1))], [make_box('Box', 10, 10, 1)])
+        self.assertEqual(sorted(package.count for package in packages), [2, 4, 4])
+        self.assertEqual(max(package.as_dict()['weight_value'] for package in packages), 9)
+
+    def test_package_shrunk_to_smallest_box(self):
+        packages = cartonization.pack([make_line('CUBE', 1, 1, (5, 5, 5))], [make_box('Large', 20), make_box('Small', 6)])
+        self.assertEqual(packages[0].box.name, 'Small')
+        self.assertEqual(packages[0].as_dict()['length'], 6)
+
+    def test_without_boxes_split_by_weight(self):
+        packages = cartonization.pack([make_line('ENGINE', 10, 40, (20, 20, 20)), make_line('MANUAL', 2, 0, None)], [])
+        self.assertEqual(sorted(package.count for package in packages), [1, 3, 3, 5])
+        self.assertTrue(all(package.weight <= cartonization.MAX_PACKAGE_WEIGHT for package in packages))
+        self.assertEqual(sum(package.items.get('ENGINE', 0) for package in packages), 10)
+
+    def test_packer_packages_kept(self):
+        items = [frappe._dict({'item_code': 'CUBE', 'qty': 3, 'packages_json': json.dumps({'1': {'CUBE': 2}, '2': {'CUBE': 1}})})]
+        item_specs = {'CUBE': frappe._dict({'weight': 1.0, 'dims': cartonization.to_inches((5, 5, 5), 'IN')})}
+        packages = cartonization.make_packages(items, item_specs, [make_box('Small', 6), make_box('Large', 20)])
+        self.assertEqual([(package['weight_value'], package['length']) for package in packages], [(2, 20), (1, 6)])
+
+    def test_order_of_500_lines_near_lower_bound(self):
+        lines, boxes = make_lines(500), make_boxes()
+        packages = cartonization.pack(lines, boxes)
+        self.assertEqual(sum(package.count for package in packages), sum(line.qty for line in lines))
+        self.assertLess(len(packages), get_lower_bound(lines, boxes) * 1.5)
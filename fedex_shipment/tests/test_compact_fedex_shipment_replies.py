@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from fedex_shipment.patches import compact_fedex_shipment_replies
+
+
+RAW_RESPONSE = '''(ProcessShipmentReply){
+   HighestSeverity = "WARNING"
+   Notifications[] =
+      (Notification){
+         Severity = "WARNING"
+         Source = "ship"
+         Code = "7034"
+         Message = "Signature option {DIRECT} was changed"
+         MessageParameters[] =
+            (NotificationParameter){
+               Id = "SIGNATURE_OPTION"
+               Value = "DIRECT"
+            },
+         LocalizedMessage = "Signature option was changed"
+      },
+      (Notification){
+         Severity = "NOTE"
+         Source = "ship"
+         Code = "8236"
+         Message = "Address was corrected"
+      },
+   CompletedShipmentDetail =
+      (CompletedShipmentDetail){
+         CompletedPackageDetails[] =
+            (CompletedPackageDetail){
+               TrackingIds[] =
+                  (TrackingId){
+                     TrackingNumber = "794644790138"
+                  },
+            },
+      }
+ }'''
+
+
+class TestCompactFedexShipmentReplies(unittest.TestCase):
+    def test_nested_notification_read_to_its_end(self):
+        summary = compact_fedex_shipment_replies.summarize_raw_response(RAW_RESPONSE)
+        self.assertEqual(summary['severity'], 'WARNING')
+        self.assertEqual(summary['notifications'], [
+            {'severity': 'WARNING', 'code': '7034', 'message': 'Signature option {DIRECT} was changed'},
+            {'severity': 'NOTE', 'code': '8236', 'message': 'Address was corrected'}
+        ])
+        self.assertEqual(summary['tracking_numbers'], ['794644790138'])
+
+    def test_nested_blocks_left_out(self):
+        notification = compact_fedex_shipment_replies.get_blocks(RAW_RESPONSE, 'Notification')[0]
+        self.assertIn('LocalizedMessage', notification)
+        self.assertNotIn('SIGNATURE_OPTION', notification)
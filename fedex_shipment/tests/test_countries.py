@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import unittest
+
+import frappe
+
+from fedex_shipment import countries
+from fedex_shipment.tests.benchmark_countries import get_country_spellings, get_state_spellings
+
+
+class TestCountries(unittest.TestCase):
+    def test_country_code_of_any_spelling(self):
+        self.assertEqual(countries.get_country_code('United States'), 'US')
+        self.assertEqual(countries.get_country_code('U.S.A.'), 'US')
+        self.assertEqual(countries.get_country_code('Ivory Coast'), 'CI')
+        self.assertEqual(countries.get_country_code('Côte d’Ivoire'), 'CI')
+        self.assertEqual(countries.get_country_code('Réunion'), 'RE')
+        self.assertEqual(countries.get_country_code('MEX'), 'MX')
+        self.assertEqual(countries.get_country_code('mx'), 'MX')
+        self.assertEqual(countries.get_country_code('can'), 'CA')
+
+    def test_unknown_country(self):
+        self.assertRaises(frappe.ValidationError, countries.get_country_code, 'Atlantis')
+        self.assertIsNone(countries.get_country('Atlantis'))
+
+    def test_state_code_of_any_spelling(self):
+        self.assertEqual(countries.get_country_state_code('United States', 'California'), 'CA')
+        self.assertEqual(countries.get_country_state_code('USA', 'Calif.'), 'CA')
+        self.assertEqual(countries.get_country_state_code('US', 'ca'), 'CA')
+        self.assertEqual(countries.get_country_state_code('Mexico', 'Ciudad de México'), 'DF')
+        self.assertEqual(countries.get_country_state_code('Atlantis', 'California'), '')
+        self.assertEqual(countries.get_country_state_code('United States', ''), '')
+
+    def test_every_spelling_resolves(self):
+        for spelling in get_country_spellings():
+            self.assertTrue(countries.get_country(spelling), spelling)
+        for country, spelling in get_state_spellings():
+            self.assertTrue(countries.get_country_state_code(country, spelling), spelling)
@@ -0,0 +1,65 @@
+from __future__ import unicode_literals
+
+import os
+import tempfile
+import unittest
+
+from PyPDF2 import PdfFileReader
+
+import frappe
+
+from fedex_shipment import labels
+from fedex_shipment.tests.benchmark_labels import make_pdf_label, make_png_label, measure_in_process
+
+
+class TestLabelMerger(unittest.TestCase):
+    def setUp(self):
+        self.file_path = tempfile.mkstemp(suffix='.pdf')[1]
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def make_merger(self, label_image_type):
+        return labels.make_label_merger(frappe._dict({'label_image_type': label_image_type,
+                                                      'label_stock_type': 'PAPER_4X6'}))
+
+    def test_pdf_labels_merged_page_by_page(self):
+        label_merger = self.make_merger('PDF')
+        try:
+            for number in range(100):
+                label_merger.add_label(make_pdf_label(number))
+            label_merger.write(self.file_path)
+        finally:
+            label_merger.close()
+        with open(self.file_path, 'rb') as pdf_file:
+            self.assertEqual(PdfFileReader(pdf_file).getNumPages(), 100)
+
+    def test_png_labels_drawn_one_per_page(self):
+        label_merger = self.make_merger('PNG')
+        try:
+            for number in range(3):
+                label_merger.add_label(make_png_label(number))
+            label_merger.write(self.file_path)
+        finally:
+            label_merger.close()
+        with open(self.file_path, 'rb') as pdf_file:
+            self.assertEqual(PdfFileReader(pdf_file).getNumPages(), 3)
+
+    def test_labels_spooled_under_files_path_and_removed(self):
+        label_merger = self.make_merger('PDF')
+        label_merger.add_label(make_pdf_label(1))
+        temp_dir = label_merger.temp_dir
+        self.assertTrue(os.path.realpath(temp_dir).startswith(os.path.realpath(frappe.get_site_path())))
+        self.assertEqual(len(os.listdir(temp_dir)), 1)
+        label_merger.close()
+        self.assertFalse(os.path.exists(temp_dir))
+
+    def test_memory_stays_flat(self):
+        # the RSS growth of merging 100 labels is about the one of merging 10
+        growths = {}
+        for count in (10, 100):
+            elapsed, peak, growths[count], size = measure_in_process('PDF', make_pdf_label(1), count, timeout=120)
+        self.assertLess(growths[100] - growths[10], 8 * 1024 * 1024)
+
+    def test_merger_needs_write(self):
+        self.assertRaises(TypeError, labels.LabelMerger)
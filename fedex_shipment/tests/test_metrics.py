@@ -0,0 +1,50 @@
+from __future__ import unicode_literals
+
+import unittest
+
+import frappe
+
+from fedex_shipment import metrics
+
+
+TEST_OPERATION = '_test_operation'
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics._observations.clear()
+        self.clear_series()
+
+    def tearDown(self):
+        self.clear_series()
+
+    def clear_series(self):
+        series = [s for s in metrics.get_totals() if TEST_OPERATION in s]
+        if series:
+            frappe.cache().srem(metrics.SERIES_KEY, *series)
+            frappe.cache().delete(*[metrics.get_metric_key(s) for s in series])
+
+    def test_flushed_observations_in_totals(self):
+        metrics.observe('soap', TEST_OPERATION, 0.03)
+        metrics.observe('soap', TEST_OPERATION, 2, error=True)
+        metrics.flush()
+        metrics.observe('soap', TEST_OPERATION, 0.03)
+        metrics.flush()
+        totals = metrics.get_totals()
+        labels = 'soap|%s' % TEST_OPERATION
+        self.assertEqual(totals['count|' + labels], 3)
+        self.assertEqual(totals['errors|' + labels], 1)
+        self.assertEqual(totals['sum_us|' + labels], 2060000)
+        self.assertEqual(totals['bucket|%s|%s' % (labels, metrics.BUCKETS.index(0.05))], 2)
+        self.assertEqual(totals['bucket|%s|%s' % (labels, metrics.BUCKETS.index(2.5))], 1)
+
+    def test_totals_rendered_cumulative(self):
+        metrics.observe('soap', TEST_OPERATION, 0.03)
+        metrics.observe('soap', TEST_OPERATION, 2, error=True)
+        metrics.flush()
+        lines = metrics.render(metrics.get_totals()).splitlines()
+        labels = 'stage="soap",operation="%s"' % TEST_OPERATION
+        self.assertIn('fedex_duration_seconds_bucket{%s,le="0.05"} 1' % labels, lines)
+        self.assertIn('fedex_duration_seconds_bucket{%s,le="+Inf"} 2' % labels, lines)
+        self.assertIn('fedex_duration_seconds_count{%s} 2' % labels, lines)
+        self.assertIn('fedex_errors_total{%s} 1' % labels, lines)
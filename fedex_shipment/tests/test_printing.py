@@ -0,0 +1,118 @@
+from __future__ import unicode_literals
+
+import socket
+import threading
+import time
+import unittest
+
+import frappe
+
+from fedex_shipment import printing
+
+
+TEST_PRINTER_STATION = '_Test Fedex Printer Station'
+
+
+class PrinterStandIn(object):
+    # a raw port 9100 printer on localhost, keeping what each connection sent
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.port = self.server.getsockname()[1]
+        self.received = []
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except socket.error:
+                return
+            chunks = []
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            connection.close()
+            self.received.append(b''.join(chunks))
+
+    def wait_for(self, connections, timeout=5):
+        deadline = time.time() + timeout
+        while len(self.received) < connections and time.time() < deadline:
+            time.sleep(0.01)
+        return self.received
+
+    def close(self):
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.server.close()
+
+
+class TestPrinting(unittest.TestCase):
+    def setUp(self):
+        self.printer = PrinterStandIn()
+        if frappe.db.exists('Fedex Printer Station', TEST_PRINTER_STATION):
+            frappe.delete_doc('Fedex Printer Station', TEST_PRINTER_STATION, force=True)
+        frappe.get_doc({
+            'doctype': 'Fedex Printer Station',
+            'station_name': TEST_PRINTER_STATION,
+            'host': '127.0.0.1',
+            'port': self.printer.port,
+            'batch_size': 2
+        }).insert(ignore_permissions=True)
+        frappe.db.commit()
+        self.clear_spool()
+        self.labels = [b'^XA^FO50,50^FDPACKAGE %s^FS^XZ' % i for i in range(5)]
+        for label in self.labels:
+            frappe.cache().rpush(printing.get_spool_key(TEST_PRINTER_STATION), label)
+
+    def tearDown(self):
+        self.printer.close()
+        self.clear_spool()
+        frappe.delete_doc('Fedex Printer Station', TEST_PRINTER_STATION, force=True)
+        frappe.db.commit()
+
+    def clear_spool(self):
+        frappe.cache().delete_key(printing.get_spool_key(TEST_PRINTER_STATION))
+        frappe.cache().delete(printing.get_lock_key(TEST_PRINTER_STATION))
+
+    def get_spooled_count(self):
+        return frappe.cache().llen(printing.get_spool_key(TEST_PRINTER_STATION))
+
+    def test_spool_printed_in_batches(self):
+        printing.print_spooled_labels(TEST_PRINTER_STATION)
+        self.assertEqual(self.printer.wait_for(3), [b''.join(self.labels[0:2]), b''.join(self.labels[2:4]),
+                                                    self.labels[4]])
+        self.assertEqual(self.get_spooled_count(), 0)
+        labels_printed, batches_printed = frappe.db.get_value('Fedex Printer Station', TEST_PRINTER_STATION,
+                                                              ['labels_printed', 'batches_printed'])
+        self.assertEqual((labels_printed, batches_printed), (5, 3))
+
+    def test_locked_station_left_to_its_job(self):
+        frappe.cache().set(printing.get_lock_key(TEST_PRINTER_STATION), 1)
+        printing.print_spooled_labels(TEST_PRINTER_STATION)
+        self.assertEqual(self.printer.wait_for(1, timeout=0.5), [])
+        self.assertEqual(self.get_spooled_count(), 5)
+
+    def test_unreachable_printer_keeps_labels(self):
+        self.printer.close()
+        self.assertRaises(socket.error, printing.print_spooled_labels, TEST_PRINTER_STATION)
+        self.assertEqual(self.get_spooled_count(), 5)
+        self.assertIsNone(frappe.cache().get(printing.get_lock_key(TEST_PRINTER_STATION)))
+
+    def test_station_without_timeout_gets_the_default(self):
+        timeouts = []
+        send_to_printer = printing.send_to_printer
+        printing.send_to_printer = lambda host, port, timeout, labels: timeouts.append(timeout)
+        try:
+            frappe.db.set_value('Fedex Printer Station', TEST_PRINTER_STATION, 'timeout', 0)
+            printing.print_spooled_labels(TEST_PRINTER_STATION)
+        finally:
+            printing.send_to_printer = send_to_printer
+        self.assertEqual(timeouts, [printing.DEFAULT_TIMEOUT] * 3)
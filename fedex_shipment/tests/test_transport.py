@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+
+import socket
+import time
+import unittest
+
+from suds.transport import Request
+
+from fedex_shipment import transport
+from fedex_shipment.tests.soap_server import SoapServerStandIn, REPLY, SSL_CONTEXT
+
+
+class TestPooledTransport(unittest.TestCase):
+    def setUp(self):
+        self.ssl_context = transport.SSL_CONTEXT
+        transport._connections.clear()
+        transport._counters.clear()
+        transport.SSL_CONTEXT = SSL_CONTEXT
+        self.server = None
+
+    def tearDown(self):
+        if self.server:
+            self.server.close()
+        transport._connections.clear()
+        transport.SSL_CONTEXT = self.ssl_context
+
+    def send(self, timeout=2):
+        pooled_transport = transport.PooledTransport(pool_size=2, idle_timeout=60)
+        pooled_transport.options.timeout = timeout
+        request = Request(self.server.url, b'<soapenv:Envelope/>')
+        request.headers = {'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': '""'}
+        return pooled_transport.send(request)
+
+    def test_connection_reused(self):
+        self.server = SoapServerStandIn(['reply', 'reply'])
+        self.assertEqual(self.send().message, REPLY)
+        self.assertEqual(self.send().message, REPLY)
+        self.assertEqual((self.server.connections, self.server.requests), (1, 2))
+        self.assertEqual(transport._counters['reused'], 1)
+
+    def test_idle_closed_connection_sent_again(self):
+        self.server = SoapServerStandIn(['reply_close', 'reply'])
+        self.send()
+        time.sleep(0.1)
+        self.assertEqual(self.send().message, REPLY)
+        # the request reached the server once, over a new connection
+        self.assertEqual((self.server.connections, self.server.requests), (2, 2))
+        self.assertEqual(transport._counters['stale'], 1)
+
+    def test_dropped_connection_sent_again(self):
+        self.server = SoapServerStandIn(['reply_drop', 'reply'])
+        self.send()
+        time.sleep(0.1)
+        self.assertEqual(self.send().message, REPLY)
+        self.assertEqual((self.server.connections, self.server.requests), (2, 2))
+        self.assertEqual(transport._counters['stale'], 1)
+
+    def test_reset_after_write_not_sent_again(self):
+        self.server = SoapServerStandIn(['reply', 'reset'])
+        self.send()
+        self.assertRaises(socket.error, self.send)
+        time.sleep(0.1)
+        self.assertEqual((self.server.connections, self.server.requests), (1, 2))
+        self.assertEqual(transport._counters['stale'], 0)
+
+    def test_timeout_after_write_not_sent_again(self):
+        self.server = SoapServerStandIn(['reply', 'stall'])
+        self.send()
+        with self.assertRaises(socket.error) as context:
+            self.send(0.5)
+        self.assertTrue(transport.is_timeout(context.exception))
+        self.assertEqual((self.server.connections, self.server.requests), (1, 2))
+
+    def test_http_status_of_errors(self):
+        self.assertEqual(transport.get_http_status(Exception((503, 'Service Unavailable'))), 503)
+        self.assertIsNone(transport.get_http_status(Exception('Tracking number 794644290503 not found')))
@@ -0,0 +1,192 @@
+from __future__ import unicode_literals
+
+import logging
+import time
+from datetime import timedelta
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+from fedex.services.track_service import FedexTrackRequest
+
+import fedex_config
+import client_pool
+import api
+import metrics
+import ratelimit
+import routing
+
+
+logger = logging.getLogger(__name__)
+
+# Track v9 and later take up to 30 tracking numbers per request, the Track v5
+# service of older python-fedex releases takes a single one.
+MAX_TRACKING_NUMBERS_PER_REQUEST = 30
+TRACKING_PARALLELISM = 4
+# Shipments are polled in batches until two thirds of the scheduler tick
+# are used, so a run ends before the next one is due. A run still going
+# holds a lock the next tick skips on.
+SHIPMENTS_PER_BATCH = 300
+DEFAULT_SCHEDULER_INTERVAL = 240
+RUN_SHARE_OF_INTERVAL = 2.0 / 3
+
+# minutes between two polls of a shipment, doubled every time Fedex answered with an unchanged status
+MIN_TRACK_INTERVAL = 30
+MAX_TRACK_INTERVAL = 24 * 60
+
+DELIVERED_STATUS_CODE = 'DL'
+
+
+def poll_tracking():
+    scheduler_interval = cint(frappe.conf.get('scheduler_interval')) or DEFAULT_SCHEDULER_INTERVAL
+    lock_key = frappe.cache().make_key('fedex_tracking_lock')
+    if not frappe.cache().set(lock_key, 1, nx=True, ex=scheduler_interval):
+        return
+
+    try:
+        deadline = time.time() + scheduler_interval * RUN_SHARE_OF_INTERVAL
+        while time.time() < deadline and poll_batch(SHIPMENTS_PER_BATCH) == SHIPMENTS_PER_BATCH:
+            pass
+    finally:
+        frappe.cache().delete(lock_key)
+
+
+def poll_batch(limit):
+    # polls the limit shipments due first, returns how many there were
+    now = now_datetime()
+    shipments = frappe.db.sql("""select name, fedex_settings, tracking_number, delivery_status_code, track_interval
+        from `tabFedex Shipment`
+        where docstatus=1 and delivered=0 and ifnull(tracking_number, '')!=''
+            and (next_track_on is null or next_track_on <= %s)
+        order by next_track_on limit %s""", (now, limit), as_dict=True)
+    if not shipments:
+        return 0
+
+    packages = frappe.db.sql("""select name, parent, tracking_number, delivery_status_code
+        from `tabFedex Package`
+        where parenttype='Fedex Shipment' and parent in ({0})
+            and delivered=0 and ifnull(tracking_number, '')!=''""".format(', '.join(['%s'] * len(shipments))),
+        [s.name for s in shipments], as_dict=True)
+    packages_by_shipment = {}
+    for package in packages:
+        packages_by_shipment.setdefault(package.parent, []).append(package)
+
+    tracking_numbers = {}
+    for s in shipments:
+        numbers = tracking_numbers.setdefault(s.fedex_settings, set())
+        numbers.add(s.tracking_number)
+        numbers.update(p.tracking_number for p in packages_by_shipment.get(s.name, []))
+
+    statuses = {}
+    for fedex_settings, numbers in tracking_numbers.items():
+        statuses.update(track_numbers(fedex_settings, sorted(numbers)))
+
+    changed_count = 0
+    for s in shipments:
+        if update_shipment_status(s, packages_by_shipment.get(s.name, []), statuses, now):
+            changed_count += 1
+    frappe.db.commit()
+    logger.info('Fedex tracking: %s shipments polled, %s changed', len(shipments), changed_count)
+    return len(shipments)
+
+
+def update_shipment_status(s, packages, statuses, now):
+    # only the packages Fedex reported a new status for are written back
+    changed = False
+    for package in packages:
+        status = statuses.get(package.tracking_number)
+        if status and status[0] != package.delivery_status_code:
+            package.delivery_status_code = status[0]
+            frappe.db.sql("""update `tabFedex Package`
+                set delivery_status_code=%s, delivery_status=%s, delivered=%s
+                where name=%s""", (status[0], status[1], status[0] == DELIVERED_STATUS_CODE, package.name))
+            changed = True
+
+    values = {}
+    master_status = statuses.get(s.tracking_number)
+    if master_status and master_status[0] != s.delivery_status_code:
+        values['delivery_status_code'], values['delivery_status'] = master_status
+        changed = True
+    if changed:
+        # a shipment leaves the polling set once all of its packages are delivered
+        values['delivered'] = all(p.delivery_status_code == DELIVERED_STATUS_CODE for p in packages) \
+            if packages else master_status[0] == DELIVERED_STATUS_CODE
+        track_interval = MIN_TRACK_INTERVAL
+    elif master_status or any(statuses.get(p.tracking_number) for p in packages):
+        track_interval = min(max(cint(s.track_interval), MIN_TRACK_INTERVAL // 2) * 2, MAX_TRACK_INTERVAL)
+    else:
+        # Fedex did not answer for it, an outage must not push the next poll away
+        track_interval = max(cint(s.track_interval), MIN_TRACK_INTERVAL)
+    values.update({
+        'last_tracked_on': now,
+        'next_track_on': now + timedelta(minutes=track_interval),
+        'track_interval': track_interval
+    })
+
+    frappe.db.sql("""update `tabFedex Shipment` set {0} where name=%(name)s""".format(
+        ', '.join('{0}=%({0})s'.format(field) for field in values)), dict(values, name=s.name))
+    return changed
+
+
+@metrics.timed('track')
+def track_numbers(fedex_settings, tracking_numbers):
+    # Returns {tracking number: (status code, status description)} for the
+    # numbers Fedex answered; the others are left for the next poll.
+    config_obj = fedex_config.get(fedex_settings)
+    if supports_multiple_tracking_numbers(fedex_settings, config_obj):
+        batches = [tracking_numbers[i:i + MAX_TRACKING_NUMBERS_PER_REQUEST]
+                   for i in range(0, len(tracking_numbers), MAX_TRACKING_NUMBERS_PER_REQUEST)]
+    else:
+        batches = [[tracking_number] for tracking_number in tracking_numbers]
+
+    statuses = {}
+    for i in range(0, len(batches), TRACKING_PARALLELISM * 10):
+        track_requests = []
+        for batch in batches[i:i + TRACKING_PARALLELISM * 10]:
+            # any account of the company can track its shipments
+            batch_fedex_settings = routing.choose_fedex_settings(fedex_settings)
+            track_requests.append(make_track_request(batch_fedex_settings, fedex_config.get(batch_fedex_settings), batch))
+        errors = api.send_requests(track_requests, TRACKING_PARALLELISM, ratelimit.BACKGROUND)
+        for track_request, error in zip(track_requests, errors):
+            if error:
+                logger.warning('Fedex tracking request failed: %s', error)
+                continue
+            statuses.update(get_track_statuses(track_request))
+    return statuses
+
+
+def supports_multiple_tracking_numbers(fedex_settings, config_obj):
+    return hasattr(client_pool.get_request(FedexTrackRequest, fedex_settings, config_obj), 'SelectionDetails')
+
+
+def make_track_request(fedex_settings, config_obj, tracking_numbers):
+    # NOTE: TRACKING IS VERY ERRATIC ON THE TEST SERVERS. YOU MAY NEED TO USE
+    # PRODUCTION KEYS/PASSWORDS/ACCOUNT #.
+    track = client_pool.get_request(FedexTrackRequest, fedex_settings, config_obj)
+    if hasattr(track, 'SelectionDetails'):
+        selection_details = []
+        for tracking_number in tracking_numbers:
+            selection_detail = track.create_wsdl_object_of_type('TrackSelectionDetail')
+            selection_detail.PackageIdentifier.Type = 'TRACKING_NUMBER_OR_DOORTAG'
+            selection_detail.PackageIdentifier.Value = tracking_number
+            selection_details.append(selection_detail)
+        track.SelectionDetails = selection_details
+    else:
+        track.TrackPackageIdentifier.Type = 'TRACKING_NUMBER_OR_DOORTAG'
+        track.TrackPackageIdentifier.Value = tracking_numbers[0]
+    return track
+
+
+def get_track_statuses(track):
+    statuses = {}
+    if hasattr(track.response, 'CompletedTrackDetails'):
+        for completed_track_detail in track.response.CompletedTrackDetails:
+            for track_detail in getattr(completed_track_detail, 'TrackDetails', []):
+                status_detail = getattr(track_detail, 'StatusDetail', None)
+                if status_detail is not None:
+                    statuses[track_detail.TrackingNumber] = (status_detail.Code, status_detail.Description)
+    else:
+        for track_detail in getattr(track.response, 'TrackDetails', []):
+            if getattr(track_detail, 'StatusCode', None):
+                statuses[track_detail.TrackingNumber] = (track_detail.StatusCode, track_detail.StatusDescription)
+    return statuses
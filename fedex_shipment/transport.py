@@ -0,0 +1,202 @@
+from __future__ import unicode_literals
+
+import httplib
+import socket
+import ssl
+import threading
+import time
+import urllib2
+import urlparse
+from collections import Counter
+from StringIO import StringIO
+
+import frappe
+
+from suds.transport import Transport, Reply, TransportError
+from suds.transport.http import HttpTransport
+
+
+# Persistent HTTPS connections to the Fedex endpoints are kept per worker
+# process and keyed by (scheme, host, port), so the test and production
+# servers have their own. At most `pool size` idle connections are kept per
+# endpoint, and a connection idle for `idle timeout` seconds is closed. Both
+# can be set in site_config.json as fedex_http_pool_size and
+# fedex_http_idle_timeout.
+DEFAULT_POOL_SIZE = 8
+DEFAULT_IDLE_TIMEOUT = 60
+
+_connections = {}
+_lock = threading.Lock()
+_counters = Counter()
+_counters_lock = threading.Lock()
+SSL_CONTEXT = ssl.create_default_context()
+
+
+def make_transport():
+    return PooledTransport(frappe.conf.get('fedex_http_pool_size') or DEFAULT_POOL_SIZE,
+                           frappe.conf.get('fedex_http_idle_timeout') or DEFAULT_IDLE_TIMEOUT)
+
+
+class PooledTransport(Transport):
+    # One per suds client, as suds links the transport options to the
+    # options of its client, all sharing the connections of the worker.
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        Transport.__init__(self)
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+
+    def open(self, request):
+        # WSDL and schemas are read once per client pool entry, the plain way
+        transport = HttpTransport()
+        transport.options = self.options
+        return transport.open(request)
+
+    def send(self, request):
+        # httplib wants byte strings, a unicode request line breaks on a non ascii message
+        url = urlparse.urlsplit(str(request.url))
+        key = (url.scheme, url.hostname, url.port or (443 if url.scheme == 'https' else 80))
+        path = url.path + (str('?') + url.query if url.query else str(''))
+        headers = dict(request.headers)
+        # the envelopes of the last call, for the call log
+        self.sent, self.received = request.message, None
+
+        connection, reused = checkout(key, self.options.timeout, self.idle_timeout)
+        try:
+            response = post(connection, path, request.message, headers, reused)
+        except StaleConnectionError:
+            # the server closed the idle connection, the request did not get through
+            increment('stale')
+            connection, reused = checkout(key, self.options.timeout, self.idle_timeout, fresh=True)
+            response = post(connection, path, request.message, headers)
+
+        try:
+            body = self.received = response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            checkin(key, connection, self.pool_size)
+
+        if response.status in (202, 204):
+            return None
+        if response.status >= 300:
+            raise TransportError(response.reason, response.status, StringIO(body))
+        return Reply(response.status, dict(response.getheaders()), body)
+
+
+def get_http_status(error):
+    # the HTTP status of a failed call, whichever layer raised it, or None
+    if isinstance(error, urllib2.HTTPError):
+        return error.code
+    if isinstance(error, TransportError):
+        return error.httpcode
+    # suds raises Exception((http code, reason)) for HTTP errors without a SOAP fault
+    if error.args and isinstance(error.args[0], tuple) and error.args[0]:
+        return error.args[0][0]
+    return None
+
+
+class StaleConnectionError(Exception):
+    pass
+
+
+def post(connection, path, message, headers, reused=False):
+    # A reused connection the server closed while idle fails before the
+    # request is processed: while the request is written, or with no status
+    # line at all. Only then StaleConnectionError tells the caller to send it
+    # again. Any other failure may come after Fedex processed the request and
+    # is raised as it is, api decides by the idempotency of the request.
+    try:
+        connection.request(str('POST'), path, message, headers)
+    except Exception as ex:
+        connection.close()
+        if reused and isinstance(ex, (httplib.HTTPException, socket.error)) and not is_timeout(ex):
+            raise StaleConnectionError(ex)
+        raise
+    increment('requests')
+    try:
+        return connection.getresponse()
+    except Exception as ex:
+        connection.close()
+        if reused and is_empty_status_line(ex):
+            raise StaleConnectionError(ex)
+        raise
+
+
+def is_timeout(error):
+    # over TLS python 2.7 raises ssl.SSLError('The read operation timed out'), not socket.timeout
+    return isinstance(error, socket.timeout) or \
+        isinstance(error, ssl.SSLError) and 'timed out' in str(error.args[0] if error.args else '')
+
+
+def is_empty_status_line(error):
+    # The connection was closed without a byte of reply. How httplib says so
+    # differs between 2.7 releases, and a TLS connection dropped without a
+    # close_notify fails in ssl instead with newer OpenSSL versions.
+    if isinstance(error, ssl.SSLError):
+        return any(eof in str(error) for eof in ('unexpected eof', 'EOF occurred in violation of protocol'))
+    return isinstance(error, httplib.BadStatusLine) and \
+        (error.line in ('', "''") or error.line.startswith('No status line received'))
+
+
+def checkout(key, timeout, idle_timeout, fresh=False):
+    scheme, host, port = key
+    with _lock:
+        idle = _connections.get(key, [])
+        expired_before = time.time() - idle_timeout
+        while idle and not fresh:
+            connection, last_used = idle.pop()
+            if last_used >= expired_before:
+                increment('reused')
+                if connection.sock:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+            connection.close()
+            increment('evicted')
+    if scheme == 'https':
+        connection = httplib.HTTPSConnection(host, port, timeout=timeout, context=SSL_CONTEXT)
+    else:
+        connection = httplib.HTTPConnection(host, port, timeout=timeout)
+    connection.connect()
+    # httplib writes the headers and the message apart, Nagle would hold the
+    # message back until the headers are acknowledged on a kept alive connection
+    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    increment('opened')
+    return connection, False
+
+
+def checkin(key, connection, pool_size):
+    with _lock:
+        idle = _connections.setdefault(key, [])
+        if len(idle) < pool_size:
+            idle.append((connection, time.time()))
+            return
+    connection.close()
+    increment('discarded')
+
+
+def increment(counter, value=1):
+    # a Counter update is not atomic, the pool threads all count here
+    with _counters_lock:
+        _counters[counter] += value
+
+
+def flush_counters():
+    # adds the counts of this worker to the site totals, from the calling thread
+    with _counters_lock:
+        counters = dict(_counters)
+        _counters.clear()
+    for counter, value in counters.items():
+        frappe.cache().incrby(get_counter_key(counter), value)
+
+
+def get_counters():
+    # site totals of opened, reused, stale, evicted and discarded connections and requests sent
+    return dict((counter, int(frappe.cache().get(get_counter_key(counter)) or 0))
+                for counter in ('requests', 'opened', 'reused', 'stale', 'evicted', 'discarded'))
+
+
+def get_counter_key(counter):
+    return frappe.cache().make_key('fedex_transport_counter:%s' % counter)
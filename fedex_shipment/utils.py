@@ -1,22 +1,58 @@
 from __future__ import unicode_literals
 
 import frappe
-from frappe.utils import flt
+from frappe.utils import flt, nowdate
+
+
+COMPANY_FEDEX_SETTINGS_CACHE_KEY = 'fedex_company_settings'
+EXCHANGE_RATES_CACHE_KEY = 'fedex_exchange_rates'
 
 
 def get_fedex_settings(company):
     all_fedex_settings = get_all_fedex_settings(company)
     if all_fedex_settings:
-        return all_fedex_settings[0][0]
+        return all_fedex_settings[0]
 
 
 def get_all_fedex_settings(company):
-    fs = frappe.db.sql("""select fs.name from `tabFedex Settings` fs
-        where (exists(select company from `tabFedex Settings Company` fsc where fsc.parent = fs.name and fsc.company=%(company)s ))""", {"company": company})
-    if fs:
-        return fs
-    else:
-        return []
+    # the default Fedex Settings of the company first, then the others oldest first
+    return get_company_fedex_settings_map().get(company, [])
+
+
+def get_companies_fedex_settings(companies):
+    company_fedex_settings_map = get_company_fedex_settings_map()
+    return dict((company, company_fedex_settings_map[company][0])
+                for company in set(companies) if company in company_fedex_settings_map)
+
+
+def get_company_fedex_settings_map():
+    # {company: [Fedex Settings]} of the site, built once and kept in the
+    # cache until any Fedex Settings changes
+    company_fedex_settings_map = frappe.cache().get_value(COMPANY_FEDEX_SETTINGS_CACHE_KEY)
+    if company_fedex_settings_map is None:
+        company_fedex_settings_map = {}
+        for company, fedex_settings in frappe.db.sql("""select fsc.company, fs.name
+                from `tabFedex Settings Company` fsc, `tabFedex Settings` fs
+                where fsc.parent = fs.name and ifnull(fsc.company, '')!=''
+                order by fsc.is_default desc, fs.creation, fs.name"""):
+            all_fedex_settings = company_fedex_settings_map.setdefault(company, [])
+            if fedex_settings not in all_fedex_settings:
+                all_fedex_settings.append(fedex_settings)
+        frappe.cache().set_value(COMPANY_FEDEX_SETTINGS_CACHE_KEY, company_fedex_settings_map)
+    return company_fedex_settings_map
+
+
+def get_interchangeable_fedex_settings(fedex_settings):
+    # the given Fedex Settings and every other one serving all of its companies
+    company_lists = [all_fedex_settings for all_fedex_settings in get_company_fedex_settings_map().values()
+                     if fedex_settings in all_fedex_settings]
+    if not company_lists:
+        return [fedex_settings]
+    return [fs for fs in company_lists[0] if all(fs in all_fedex_settings for all_fedex_settings in company_lists[1:])]
+
+
+def clear_company_fedex_settings_cache(doc=None, method=None):
+    frappe.cache().delete_value(COMPANY_FEDEX_SETTINGS_CACHE_KEY)
 
 
 def get_amount(required_currency, actual_currency, amount, from_currency, into_currency, rate):
@@ -27,3 +63,44 @@ def get_amount(required_currency, actual_currency, amount, from_currency, into_c
     elif required_currency.upper() == from_currency.upper() and actual_currency.upper() == into_currency.upper():
         return flt(amount) / flt(rate)
     frappe.throw('Cannot get amount in required currency %s from %s using conversion from_currency=%s and into_currency=%s' % (required_currency, actual_currency, from_currency, into_currency))
+
+
+def get_exchange_rate(from_currency, into_currency):
+    # Rate of the day, from the Fedex replies seen today or else from the
+    # Currency Exchange records. 0 if neither knows the currencies.
+    exchange_rates = get_exchange_rates()
+    key = get_exchange_rate_key(from_currency, into_currency)
+    if key not in exchange_rates:
+        rate = flt(frappe.db.get_value('Currency Exchange',
+                                       {'from_currency': from_currency, 'to_currency': into_currency}, 'exchange_rate'))
+        if not rate:
+            reverse_rate = flt(frappe.db.get_value('Currency Exchange',
+                                                   {'from_currency': into_currency, 'to_currency': from_currency}, 'exchange_rate'))
+            rate = 1 / reverse_rate if reverse_rate else 0.0
+        exchange_rates[key] = rate
+        set_exchange_rates(exchange_rates)
+    return exchange_rates[key]
+
+
+def cache_exchange_rate(from_currency, into_currency, rate):
+    exchange_rates = get_exchange_rates()
+    if flt(rate) and exchange_rates.get(get_exchange_rate_key(from_currency, into_currency)) != flt(rate):
+        exchange_rates[get_exchange_rate_key(from_currency, into_currency)] = flt(rate)
+        exchange_rates[get_exchange_rate_key(into_currency, from_currency)] = 1 / flt(rate)
+        set_exchange_rates(exchange_rates)
+
+
+def get_exchange_rates():
+    # {"FROM:INTO": rate} of today, started again every day
+    exchange_rates = frappe.cache().get_value(EXCHANGE_RATES_CACHE_KEY)
+    if not exchange_rates or exchange_rates['date'] != nowdate():
+        return {}
+    return exchange_rates['rates']
+
+
+def set_exchange_rates(exchange_rates):
+    frappe.cache().set_value(EXCHANGE_RATES_CACHE_KEY, {'date': nowdate(), 'rates': exchange_rates})
+
+
+def get_exchange_rate_key(from_currency, into_currency):
+    return '%s:%s' % (from_currency.upper(), into_currency.upper())